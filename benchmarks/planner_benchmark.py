@@ -0,0 +1,316 @@
+# app/benchmarks/planner_benchmark.py
+"""
+TransportPlanner ベンチマーク
+
+MySQL を使わずに、truck_master.csv / plan.csv / DELIVERY_PROGRESS CSV と同じ形の
+合成データ（受注・製品・容器・トラック）を生成して
+TransportPlanner.calculate_loading_plan_from_orders を計測する。
+
+計測項目:
+    - 実行時間（wall time）
+    - ピークメモリ（tracemalloc）
+    - Step1〜Step9 のステップ別時間（result['profile'] から取得）
+
+使い方:
+    python -m benchmarks.planner_benchmark
+    python -m benchmarks.planner_benchmark --orders 100 1000 --days 7 30
+    python -m benchmarks.planner_benchmark --compare benchmarks/results/planner_xxxxxxx.json
+    python -m benchmarks.planner_benchmark --parallel-groups --workers 4
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+from typing import Any, Dict, List, Set
+
+import pandas as pd
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from domain.calculators.transport_planner import TransportPlanner
+
+DEFAULT_ORDERS = [100, 1_000, 10_000, 100_000]
+DEFAULT_DAYS = [7, 30, 90]
+RESULTS_DIR = os.path.join(ROOT_DIR, 'benchmarks', 'results')
+
+class FakeCalendarRepository:
+    """メモリ上の会社カレンダー（土日＋指定休日を非営業日とする）"""
+
+    def __init__(self, holidays: Set[date] = None):
+        self.holidays = holidays or set()
+
+    def is_working_day(self, target_date: date) -> bool:
+        if target_date in self.holidays:
+            return False
+        return target_date.weekday() not in [5, 6]
+
+
+# ---- 合成データ生成 ----
+
+def generate_trucks(num_trucks: int = 4) -> pd.DataFrame:
+    """truck_master.csv と同じ列構成のトラックマスタ"""
+    base = [
+        # name, depth, max_weight, default_use, arrival_day_offset
+        ('NO_2_10T', 9740, 10000, 1, 0),
+        ('NO_4_10T', 9000, 10000, 1, 0),
+        ('NO_3_10T', 9740, 10000, 1, 1),
+        ('NO_5_10T', 6100, 4000, 0, 1),
+    ]
+    rows = []
+    for i in range(num_trucks):
+        name, depth, max_weight, default_use, offset = base[i % len(base)]
+        rows.append({
+            'id': i + 1,
+            'name': name if i < len(base) else f"{name}_{i + 1}",
+            'width': 2400,
+            'depth': depth,
+            'height': 2400,
+            'max_weight': max_weight,
+            'departure_time': '18:00:00' if offset else '10:00:00',
+            'arrival_time': '10:00:00' if offset else '15:00:00',
+            'default_use': default_use,
+            'arrival_day_offset': offset,
+            'priority_product_codes': None,
+        })
+    return pd.DataFrame(rows)
+
+
+def generate_containers(num_containers: int = 6) -> List[Any]:
+    """TransportRepository.get_containers と同じ属性の容器リスト"""
+    sizes = [(1100, 1100, 900), (1200, 1000, 800), (1000, 800, 700), (800, 600, 500)]
+    containers = []
+    for i in range(num_containers):
+        width, depth, height = sizes[i % len(sizes)]
+        stackable = i % 3 != 2
+        containers.append(SimpleNamespace(
+            id=i + 1,
+            name=f"容器{i + 1}",
+            width=width,
+            depth=depth,
+            height=height,
+            max_weight=500,
+            max_volume=width * depth * height / 1_000_000_000,
+            can_mix=False,
+            stackable=stackable,
+            max_stack=2 if stackable else 1,
+            created_at=None,
+        ))
+    return containers
+
+
+def generate_products(num_products: int, containers: List[Any], trucks_df: pd.DataFrame,
+                      rng: random.Random) -> pd.DataFrame:
+    """ProductRepository.get_all_products と同じ列構成の製品マスタ"""
+    truck_ids = trucks_df['id'].tolist()
+    default_ids = trucks_df.loc[trucks_df['default_use'] == 1, 'id'].tolist()
+    rows = []
+    for i in range(num_products):
+        container = rng.choice(containers)
+        restricted = rng.random() < 0.4
+        if restricted:
+            used_truck_ids = ','.join(str(t) for t in rng.sample(truck_ids, k=min(2, len(truck_ids))))
+        else:
+            used_truck_ids = None if rng.random() < 0.5 else ','.join(str(t) for t in default_ids)
+        rows.append({
+            'id': i + 1,
+            'product_code': f"V{rng.randint(10_000_000, 99_999_999):08d}{i % 100:02d}",
+            'product_name': f"製品{i + 1}",
+            'used_container_id': container.id,
+            'capacity': rng.choice([3, 4, 5, 6, 8, 10, 12, 20]),
+            'used_truck_ids': used_truck_ids,
+            'can_advance': 1 if rng.random() < 0.5 else 0,
+        })
+    return pd.DataFrame(rows)
+
+
+def generate_orders(num_orders: int, products_df: pd.DataFrame, start_date: date, days: int,
+                    rng: random.Random) -> pd.DataFrame:
+    """DELIVERY_PROGRESS / plan.csv と同じ列構成の受注（納入進度）"""
+    product_ids = products_df['id'].tolist()
+    product_codes = dict(zip(products_df['id'], products_df['product_code']))
+    rows = []
+    for i in range(num_orders):
+        product_id = rng.choice(product_ids)
+        delivery_date = start_date + timedelta(days=rng.randrange(days))
+        order_quantity = rng.randint(10, 120)
+        shipped_quantity = rng.choice([0, 0, 0, order_quantity // 2])
+        remaining_quantity = order_quantity - shipped_quantity
+        rows.append({
+            'id': i + 1,
+            'order_id': f"ORD-{delivery_date.strftime('%Y%m%d')}-{product_codes[product_id]}",
+            'product_id': product_id,
+            'order_date': delivery_date,
+            'delivery_date': delivery_date,
+            'order_quantity': order_quantity,
+            'planned_quantity': 0,
+            'shipped_quantity': shipped_quantity,
+            'planned_progress_quantity': 0,
+            'remaining_quantity': remaining_quantity,
+            'status': '未出荷',
+        })
+    return pd.DataFrame(rows)
+
+
+def build_dataset(num_orders: int, days: int, start_date: date, seed: int = 0) -> Dict[str, Any]:
+    """受注規模に応じた製品数・トラック数で一式を生成"""
+    rng = random.Random(seed)
+    num_products = max(20, min(2_000, num_orders // 5))
+    orders_per_day = num_orders / max(1, days)
+    num_trucks = max(4, int(orders_per_day // 40) + 1)
+
+    trucks_df = generate_trucks(num_trucks)
+    containers = generate_containers()
+    products_df = generate_products(num_products, containers, trucks_df, rng)
+    orders_df = generate_orders(num_orders, products_df, start_date, days, rng)
+    return {
+        'orders_df': orders_df,
+        'products_df': products_df,
+        'containers': containers,
+        'trucks_df': trucks_df,
+        'truck_container_rules': [],
+    }
+
+
+# ---- 計測 ----
+
+def run_case(num_orders: int, days: int, start_date: date, seed: int = 0,
+             verbose: bool = False, parallel_groups: bool = False,
+             max_workers: int = None) -> Dict[str, Any]:
+    """1ケース（受注数×日数）を実行して計測結果を返す"""
+    dataset = build_dataset(num_orders, days, start_date, seed)
+    calendar_repo = FakeCalendarRepository()
+    planner = TransportPlanner(parallel_groups=parallel_groups, max_workers=max_workers)
+
+    output = None if verbose else io.StringIO()
+    tracemalloc.start()
+    started = time.perf_counter()
+    with (contextlib.nullcontext() if verbose else contextlib.redirect_stdout(output)):
+        result = planner.calculate_loading_plan_from_orders(
+            orders_df=dataset['orders_df'],
+            products_df=dataset['products_df'],
+            containers=dataset['containers'],
+            trucks_df=dataset['trucks_df'],
+            truck_container_rules=dataset['truck_container_rules'],
+            start_date=start_date,
+            days=days,
+            calendar_repo=calendar_repo,
+            profile=True
+        )
+    wall_time = time.perf_counter() - started
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # ステップ別時間は planner のプロファイル（Step1〜Step9）を使用
+    step_timings = {
+        step['step']: round(step['duration_ms'] / 1000, 4) for step in result['profile']['steps']
+    }
+    step_timings['other'] = round(max(0.0, wall_time - sum(step_timings.values())), 4)
+
+    return {
+        'orders': num_orders,
+        'days': days,
+        'products': len(dataset['products_df']),
+        'trucks': len(dataset['trucks_df']),
+        'wall_time_sec': round(wall_time, 4),
+        'peak_memory_mb': round(peak_memory / 1024 / 1024, 2),
+        'step_timings_sec': step_timings,
+        'total_trips': result['summary']['total_trips'],
+        'total_warnings': result['summary']['total_warnings'],
+        'truck_groups': planner.last_group_report.get('groups'),
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return 'unknown'
+
+
+def compare_results(baseline: Dict[str, Any], current: Dict[str, Any]) -> List[str]:
+    """2つの結果ファイルを比較して差分行を返す"""
+    baseline_cases = {(r['orders'], r['days']): r for r in baseline.get('results', [])}
+    lines = [f"比較: {baseline.get('commit')} → {current.get('commit')}"]
+    for case in current.get('results', []):
+        key = (case['orders'], case['days'])
+        base = baseline_cases.get(key)
+        if not base:
+            lines.append(f"  {key[0]:>7}件 × {key[1]:>2}日: 比較対象なし")
+            continue
+        ratio = case['wall_time_sec'] / base['wall_time_sec'] if base['wall_time_sec'] else 0
+        lines.append(
+            f"  {key[0]:>7}件 × {key[1]:>2}日: {base['wall_time_sec']:.3f}s → {case['wall_time_sec']:.3f}s"
+            f" (x{ratio:.2f}), メモリ {base['peak_memory_mb']}MB → {case['peak_memory_mb']}MB"
+        )
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='TransportPlanner ベンチマーク')
+    parser.add_argument('--orders', type=int, nargs='+', default=DEFAULT_ORDERS, help='受注件数')
+    parser.add_argument('--days', type=int, nargs='+', default=DEFAULT_DAYS, help='計画日数')
+    parser.add_argument('--start-date', default='2025-10-15', help='計画開始日 (YYYY-MM-DD)')
+    parser.add_argument('--seed', type=int, default=0, help='乱数シード')
+    parser.add_argument('--output', help='結果JSONの出力先（省略時は benchmarks/results/planner_<commit>.json）')
+    parser.add_argument('--compare', help='比較対象の結果JSON')
+    parser.add_argument('--verbose', action='store_true', help='プランナーのログを表示')
+    parser.add_argument('--parallel-groups', action='store_true',
+                        help='独立したトラックグループごとに Step3 を並列実行')
+    parser.add_argument('--workers', type=int, help='並列実行のプロセス数（省略時はCPU数）')
+    args = parser.parse_args(argv)
+
+    start_date = datetime.strptime(args.start_date, '%Y-%m-%d').date()
+    commit = _git_commit()
+
+    results = []
+    for days in args.days:
+        for num_orders in args.orders:
+            case = run_case(num_orders, days, start_date, args.seed, args.verbose,
+                            args.parallel_groups, args.workers)
+            results.append(case)
+            slowest = max(
+                (item for item in case['step_timings_sec'].items() if item[0] != 'other'),
+                key=lambda item: item[1]
+            )
+            print(f"{num_orders:>7}件 × {days:>2}日: {case['wall_time_sec']:.3f}s, "
+                  f"{case['peak_memory_mb']}MB, 便数 {case['total_trips']} (最遅: {slowest[0]} {slowest[1]:.3f}s)")
+
+    report = {
+        'commit': commit,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'seed': args.seed,
+        'parallel_groups': args.parallel_groups,
+        'start_date': args.start_date,
+        'results': results,
+    }
+
+    output_path = args.output or os.path.join(RESULTS_DIR, f"planner_{commit}.json")
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"✅ 結果を保存しました: {output_path}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        for line in compare_results(baseline, report):
+            print(line)
+
+
+if __name__ == '__main__':
+    main()
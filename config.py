@@ -1,7 +1,7 @@
 # app/config.py
 import os
 from dataclasses import dataclass
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
 @dataclass
 class DatabaseConfig:
@@ -14,6 +14,12 @@ class DatabaseConfig:
     port: int = 3306
     autocommit: bool = True
     connect_timeout: int = 10
+    # コネクションプール設定（SQLAlchemy QueuePool）
+    pool_size: int = 5            # 常時保持する接続数
+    max_overflow: int = 10        # pool_size を超えて一時的に作れる接続数
+    pool_timeout: int = 30        # 空き接続を待つ最大秒数
+    pool_recycle: int = 3600      # この秒数を超えた接続は再作成（MySQL wait_timeout 対策）
+    pool_pre_ping: bool = True    # 取得時に接続の生存確認を行う
     
     def to_dict(self) -> Dict[str, Any]:
         return {
@@ -26,6 +32,16 @@ class DatabaseConfig:
             'autocommit': self.autocommit,
             'connect_timeout': self.connect_timeout
         }
+    
+    def pool_options(self) -> Dict[str, Any]:
+        """create_engine に渡すプール設定"""
+        return {
+            'pool_size': self.pool_size,
+            'max_overflow': self.max_overflow,
+            'pool_timeout': self.pool_timeout,
+            'pool_recycle': self.pool_recycle,
+            'pool_pre_ping': self.pool_pre_ping,
+        }
 
 @dataclass
 class AppConfig:
@@ -33,6 +49,17 @@ class AppConfig:
     page_title: str = "生産計画管理システム"
     page_icon: str = "🏭"
     layout: str = "wide"
+    # 積載計画結果のキャッシュ（同じ期間・同じデータでの再作成を省略）
+    plan_cache_size: int = 16         # 保持する計画結果の件数
+    plan_cache_ttl_sec: int = 600     # DBを直接更新された場合に備えた有効期限（秒）
+    # 営業日インデックスの有効期限（他プロセス・DB直接更新のカレンダー変更を反映する間隔、秒）
+    calendar_index_ttl_sec: int = 300
+    # マスタスナップショットの有効期限（他プロセス・DB直接更新のマスタ変更を反映する間隔、秒）
+    master_snapshot_ttl_sec: int = 300
+    # 積載計画の Step3 を製品×トラックのグループごとにプロセス並列で計算するか
+    # （フォールバック積載が起こりうる日は逐次。需要が少ない・グループが1つなら自動で逐次）
+    planner_parallel_groups: bool = False
+    planner_max_workers: Optional[int] = None   # None は CPU 数
 
 # 設定インスタンス
 DB_CONFIG = DatabaseConfig()
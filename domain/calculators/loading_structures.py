@@ -0,0 +1,267 @@
+# app/domain/calculators/loading_structures.py
+"""
+積載計画の内部データ構造
+
+TransportPlanner の Step2〜Step8 で需要・積載明細・トラック状態を
+__slots__ 付きの軽量オブジェクトとして扱う。
+- 未設定の項目は dict に変換したときに出力されない（従来の dict と同じキー構成）
+- truck_ids はタプルで保持し、copy() は浅いコピーのみ（明示的なコピーオンライト）
+- 既存コードとの互換のため ['key'] / get() / setdefault() でもアクセスできる
+- daily_plans へ返すときに to_dict() で従来の dict 形式に戻す
+"""
+from typing import Any, Dict, List, Optional, Set
+
+
+# 需要・積載明細で使う項目（daily_plans の dict キーと同じ名前）
+PLAN_RECORD_FIELDS = (
+    'product_id',
+    'product_code',
+    'product_name',
+    'container_id',
+    'container_name',
+    'num_containers',
+    'total_quantity',
+    'calculated_quantity',
+    'capacity',
+    'remainder',
+    'surplus',
+    'floor_area',
+    'floor_area_per_container',
+    'delivery_date',
+    'loading_date',
+    'truck_ids',
+    'max_stack',
+    'stackable',
+    'can_advance',
+    'is_advanced',
+    'final_day_overflow',
+    'original_date',
+    'is_special_delivery',
+    'adjusted_for_next_day_arrival',
+)
+
+
+class PlanRecord:
+    """需要・積載明細の共通基底（dict 互換アクセス付き）"""
+
+    __slots__ = PLAN_RECORD_FIELDS
+
+    def __init__(self, **fields):
+        for key, value in fields.items():
+            setattr(self, key, value)
+        truck_ids = fields.get('truck_ids')
+        if truck_ids is not None and not isinstance(truck_ids, tuple):
+            self.truck_ids = tuple(truck_ids)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'PlanRecord':
+        return cls(**{key: value for key, value in data.items() if key in PLAN_RECORD_FIELDS})
+
+    def copy(self):
+        """浅いコピー（truck_ids はタプルなので共有して問題ない）"""
+        new = self.__class__.__new__(self.__class__)
+        for key in PLAN_RECORD_FIELDS:
+            try:
+                setattr(new, key, getattr(self, key))
+            except AttributeError:
+                continue
+        return new
+
+    def to_dict(self) -> Dict[str, Any]:
+        """daily_plans 用の dict に変換（未設定の項目は含めない）"""
+        data = {}
+        for key in PLAN_RECORD_FIELDS:
+            try:
+                value = getattr(self, key)
+            except AttributeError:
+                continue
+            if key == 'truck_ids':
+                value = list(value)
+            data[key] = value
+        return data
+
+    # ---- dict 互換アクセス ----
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key == 'truck_ids' and value is not None and not isinstance(value, tuple):
+            value = tuple(value)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in PLAN_RECORD_FIELDS and hasattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def setdefault(self, key, default=None):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            self[key] = default
+            return default
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.to_dict()!r})"
+
+
+class Demand(PlanRecord):
+    """積載需要（製品×納期×容器）"""
+
+    __slots__ = ()
+
+    def to_loaded_item(self) -> 'LoadedItem':
+        """この需要をそのまま積載明細にする（浅いコピー）"""
+        item = LoadedItem.__new__(LoadedItem)
+        for key in PLAN_RECORD_FIELDS:
+            try:
+                setattr(item, key, getattr(self, key))
+            except AttributeError:
+                continue
+        return item
+
+
+class LoadedItem(PlanRecord):
+    """トラックへの積載明細"""
+
+    __slots__ = ()
+
+
+class ContainerLoad:
+    """トラック1台に積んだ同一容器の集計（容器数・段数・底面積）"""
+
+    __slots__ = ('count', 'floor_area_per_container', 'stackable', 'max_stack')
+
+    def __init__(self, floor_area_per_container: float, stackable: bool, max_stack: int):
+        self.count = 0
+        self.floor_area_per_container = floor_area_per_container
+        self.stackable = stackable
+        self.max_stack = max_stack
+
+    def stacks(self, count: int = None, stackable: bool = None, max_stack: int = None) -> int:
+        """床に置く配置数（段積み可能なら容器数を段数で割り上げ）"""
+        count = self.count if count is None else count
+        stackable = self.stackable if stackable is None else stackable
+        max_stack = self.max_stack if max_stack is None else max_stack
+        if stackable and max_stack > 1:
+            return (count + max_stack - 1) // max_stack
+        return count
+
+    def floor_area(self, stackable: bool = None, max_stack: int = None) -> float:
+        return self.floor_area_per_container * self.stacks(stackable=stackable, max_stack=max_stack)
+
+
+class TruckLoad:
+    """
+    トラック1台の容器別積載集計
+    積載・荷降ろしのたびに O(1) で更新し、同容器の検索や積載率計算を
+    loaded_items の再走査なしで行えるようにする。
+    """
+
+    __slots__ = ('containers',)
+
+    def __init__(self):
+        self.containers: Dict[int, ContainerLoad] = {}
+
+    @classmethod
+    def from_items(cls, items) -> 'TruckLoad':
+        load = cls()
+        for item in items:
+            load.add_item(item)
+        return load
+
+    def add(self, container_id: int, num_containers: int, floor_area_per_container: float,
+            stackable: bool = False, max_stack: int = 1):
+        entry = self.containers.get(container_id)
+        if entry is None:
+            # 容器の属性は最初に積んだ明細の値を使う（従来の container_totals と同じ）
+            entry = ContainerLoad(floor_area_per_container, stackable, max_stack)
+            self.containers[container_id] = entry
+        entry.count += num_containers
+
+    def add_item(self, item):
+        self.add(
+            item['container_id'],
+            item['num_containers'],
+            item['floor_area_per_container'],
+            item.get('stackable', False),
+            item.get('max_stack', 1)
+        )
+
+    def remove_item(self, item):
+        entry = self.containers.get(item['container_id'])
+        if entry is None:
+            return
+        entry.count -= item['num_containers']
+        if entry.count <= 0:
+            del self.containers[item['container_id']]
+
+    def get(self, container_id: int) -> Optional[ContainerLoad]:
+        return self.containers.get(container_id)
+
+    def count(self, container_id: int) -> int:
+        entry = self.containers.get(container_id)
+        return entry.count if entry else 0
+
+    def loaded_area(self) -> float:
+        """積載済み底面積（容器種類数のループのみ）"""
+        total = 0
+        for entry in self.containers.values():
+            total += entry.floor_area()
+        return total
+
+
+class TruckState:
+    """日次積載計画中のトラック状態"""
+
+    __slots__ = (
+        'truck_id',
+        'truck_name',
+        'truck_info',
+        'loaded_items',
+        'remaining_floor_area',
+        'total_floor_area',
+        'loaded_container_ids',
+        'priority_products',
+        'is_default',
+        'unavailable_for_same_day',
+        'load',
+    )
+
+    def __init__(self, truck_id: int, truck_name: str, truck_info: Dict[str, Any],
+                 floor_area: float, priority_products: List[str], is_default: bool):
+        self.truck_id = truck_id
+        self.truck_name = truck_name
+        self.truck_info = truck_info
+        self.loaded_items: List[PlanRecord] = []
+        self.remaining_floor_area = floor_area
+        self.total_floor_area = floor_area
+        self.loaded_container_ids: Set[int] = set()
+        self.priority_products = priority_products
+        self.is_default = is_default
+        self.unavailable_for_same_day = False
+        self.load = TruckLoad()
+
+    def add_item(self, item: PlanRecord):
+        """積載明細を追加して容器別集計を更新"""
+        self.loaded_items.append(item)
+        self.load.add_item(item)
+
+    @property
+    def utilization(self) -> float:
+        """現在の底面積利用率（0〜1）"""
+        if not self.total_floor_area:
+            return 0
+        return (self.total_floor_area - self.remaining_floor_area) / self.total_floor_area
+
+
+def plan_records_to_dicts(records: Optional[List[Any]]) -> List[Dict[str, Any]]:
+    """PlanRecord と dict が混在するリストを dict のリストに変換"""
+    if not records:
+        return [] if records is None else records
+    return [record.to_dict() if isinstance(record, PlanRecord) else record for record in records]
@@ -0,0 +1,144 @@
+# app/domain/calculators/plan_frame.py
+"""
+積載計画結果の列指向表現（PlanFrame）
+
+daily_plans → trucks → loaded_items の入れ子 dict を、積載明細1件＝1行の DataFrame に
+一度だけ展開する。Excel/CSV/PDF 出力・DB保存・一覧表示・未計画受注の抽出はこの表を読む。
+
+- 行は積載日の昇順、同じ日の中はトラック・明細の順（daily_plans の並び）
+- 値は計画結果から取り出したまま（未設定のキーは None、容器数・数量は 0）
+- PlanFrame.of() は同じ計画結果オブジェクトに対して作成済みの表を返す。
+  計画結果は作成後に変更しない前提（変更した場合は from_result() で作り直す）
+"""
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List
+
+import pandas as pd
+
+# 列名と、計画結果での取り出し元
+PLAN_FRAME_COLUMNS = (
+    'loading_date',        # daily_plans のキー（'%Y-%m-%d'）
+    'truck_index',         # その日のトラックの順番（1始まり）
+    'truck_id',
+    'truck_name',
+    'product_id',
+    'product_code',
+    'product_name',
+    'container_id',
+    'num_containers',
+    'total_quantity',
+    'delivery_date',       # 明細の値のまま
+    'delivery_date_str',   # '%Y-%m-%d'（未設定は ''）
+    'original_date',
+    'original_date_str',
+    'is_advanced',
+    'is_special_delivery',
+    'volume_rate',         # トラックの積載率（明細ごとに同じ値）
+    'weight_rate',
+    'floor_area_rate',
+)
+
+# ID・日付は Python の値のまま保持する（DB保存・キー比較用）
+_OBJECT_COLUMNS = ('truck_id', 'product_id', 'container_id', 'delivery_date', 'original_date')
+
+# PlanFrame.of() で保持する計画結果の数
+_MEMO_SIZE = 4
+
+
+def format_plan_date(value) -> str:
+    """日付を '%Y-%m-%d' の文字列に（未設定は ''、日付でなければ str()）"""
+    if value is None or value == '':
+        return ''
+    if hasattr(value, 'strftime'):
+        return value.strftime('%Y-%m-%d')
+    return str(value)
+
+
+class PlanFrame:
+    """積載明細1件＝1行の計画表（items）と、計画の積載日一覧（dates）"""
+
+    _memo: 'OrderedDict[int, tuple]' = OrderedDict()
+    _lock = threading.Lock()
+
+    def __init__(self, items: pd.DataFrame, dates: List[str]):
+        self.items = items
+        self.dates = dates
+
+    @classmethod
+    def of(cls, plan_result: Dict[str, Any]) -> 'PlanFrame':
+        """計画結果の PlanFrame を取得（同じ結果オブジェクトなら作成済みのものを返す）"""
+        key = id(plan_result)
+        with cls._lock:
+            entry = cls._memo.get(key)
+            if entry is not None and entry[0] is plan_result:
+                cls._memo.move_to_end(key)
+                return entry[1]
+        frame = cls.from_result(plan_result)
+        with cls._lock:
+            # 結果オブジェクトも保持して、id の再利用で別の結果と取り違えないようにする
+            cls._memo[key] = (plan_result, frame)
+            cls._memo.move_to_end(key)
+            while len(cls._memo) > _MEMO_SIZE:
+                cls._memo.popitem(last=False)
+        return frame
+
+    @classmethod
+    def from_result(cls, plan_result: Dict[str, Any]) -> 'PlanFrame':
+        """計画結果の daily_plans を列ごとのリストに展開して DataFrame を作成"""
+        daily_plans = (plan_result or {}).get('daily_plans') or {}
+        dates = sorted(daily_plans.keys())
+        columns = {name: [] for name in PLAN_FRAME_COLUMNS}
+        formatted = {}
+
+        def date_str(value):
+            try:
+                if value not in formatted:
+                    formatted[value] = format_plan_date(value)
+                return formatted[value]
+            except TypeError:
+                return format_plan_date(value)
+
+        for loading_date in dates:
+            for truck_index, truck in enumerate(daily_plans[loading_date].get('trucks', []), start=1):
+                items = truck.get('loaded_items') or []
+                if not items:
+                    continue
+                utilization = truck.get('utilization') or {}
+                count = len(items)
+                columns['loading_date'].extend([loading_date] * count)
+                columns['truck_index'].extend([truck_index] * count)
+                columns['truck_id'].extend([truck.get('truck_id')] * count)
+                columns['truck_name'].extend([truck.get('truck_name')] * count)
+                columns['volume_rate'].extend([utilization.get('volume_rate', 0)] * count)
+                columns['weight_rate'].extend([utilization.get('weight_rate', 0)] * count)
+                columns['floor_area_rate'].extend([utilization.get('floor_area_rate', 0)] * count)
+                for item in items:
+                    delivery_date = item.get('delivery_date')
+                    original_date = item.get('original_date')
+                    columns['product_id'].append(item.get('product_id'))
+                    columns['product_code'].append(item.get('product_code', ''))
+                    columns['product_name'].append(item.get('product_name', ''))
+                    columns['container_id'].append(item.get('container_id'))
+                    columns['num_containers'].append(item.get('num_containers', 0))
+                    columns['total_quantity'].append(item.get('total_quantity', 0))
+                    columns['delivery_date'].append(delivery_date)
+                    columns['delivery_date_str'].append(date_str(delivery_date))
+                    columns['original_date'].append(original_date)
+                    columns['original_date_str'].append(date_str(original_date))
+                    columns['is_advanced'].append(bool(item.get('is_advanced', False)))
+                    columns['is_special_delivery'].append(bool(item.get('is_special_delivery', False)))
+
+        items_df = pd.DataFrame({
+            name: pd.Series(values, dtype=object) if name in _OBJECT_COLUMNS else values
+            for name, values in columns.items()
+        }, columns=list(PLAN_FRAME_COLUMNS))
+        return cls(items_df, dates)
+
+    @property
+    def empty(self) -> bool:
+        return self.items.empty
+
+    def by_date(self) -> Dict[str, pd.DataFrame]:
+        """積載日 → その日の明細（明細の無い日は含まない）"""
+        return {loading_date: rows for loading_date, rows in self.items.groupby('loading_date', sort=False)}
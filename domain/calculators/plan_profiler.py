@@ -0,0 +1,86 @@
+# app/domain/calculators/plan_profiler.py
+"""
+積載計画のステップ別プロファイラ
+
+TransportPlanner.calculate_loading_plan_from_orders(profile=True) のときだけ生成され、
+各ステップの処理時間・需要件数（入力/出力）・トラック状態の変化量を記録する。
+profile=False のときはインスタンスを作らないため計測コストはかからない。
+"""
+import time
+from typing import Any, Dict, List, Optional
+
+# ステップID → 表示名
+STEP_LABELS = {
+    'step1_demand_analysis': 'Step1: 需要分析とトラック台数決定',
+    'step2_forward_scheduling': 'Step2: 前倒し処理',
+    'step3_daily_loading_plan': 'Step3: 日次積載計画作成',
+    'step4_relocate_remaining': 'Step4: 積み残しの再配置',
+    'step5_forward_remaining': 'Step5: 積み残しの前倒し',
+    'step6_relocate_next_days': 'Step6: 前日特便配送',
+    'step7_final_overflow': 'Step7: 最終日積み残しフラグ',
+    'step8_next_day_arrival': 'Step8: 翌日着トラック調整',
+    'step9_summary': 'Step9: 計画日再計算とサマリー',
+}
+
+
+def count_plan_state(daily_plans: Dict[str, Dict]) -> Dict[str, int]:
+    """daily_plans のトラック数・積載明細数・積み残し数を数える"""
+    trucks = 0
+    items = 0
+    remaining = 0
+    for plan in daily_plans.values():
+        plan_trucks = plan.get('trucks', [])
+        trucks += len(plan_trucks)
+        for truck_plan in plan_trucks:
+            items += len(truck_plan.get('loaded_items', []))
+        remaining += len(plan.get('remaining_demands') or [])
+    return {'trucks': trucks, 'loaded_items': items, 'remaining_demands': remaining}
+
+
+class PlanProfiler:
+    """ステップ単位の計測結果を保持"""
+
+    def __init__(self):
+        self.steps: List[Dict[str, Any]] = []
+        self._current: Optional[Dict[str, Any]] = None
+        self._started_at = time.perf_counter()
+
+    def begin(self, step: str, demands_in: int = None, plan_state: Dict[str, int] = None):
+        """ステップ開始（plan_state を渡すと終了時との差分をトラック状態の変化として記録）"""
+        self._current = {
+            'step': step,
+            'label': STEP_LABELS.get(step, step),
+            'demands_in': demands_in,
+            '_plan_state': plan_state,
+            '_started': time.perf_counter(),
+        }
+
+    def end(self, demands_out: int = None, plan_state: Dict[str, int] = None, **counters):
+        """ステップ終了"""
+        current = self._current
+        if current is None:
+            return
+        record = {
+            'step': current['step'],
+            'label': current['label'],
+            'duration_ms': round((time.perf_counter() - current['_started']) * 1000, 2),
+            'demands_in': current['demands_in'],
+            'demands_out': demands_out,
+        }
+        before = current['_plan_state']
+        if before is not None and plan_state is not None:
+            record['trucks_delta'] = plan_state['trucks'] - before['trucks']
+            record['loaded_items_delta'] = plan_state['loaded_items'] - before['loaded_items']
+            record['remaining_delta'] = plan_state['remaining_demands'] - before['remaining_demands']
+        record.update(counters)
+        self.steps.append(record)
+        self._current = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        total_ms = round((time.perf_counter() - self._started_at) * 1000, 2)
+        slowest = max(self.steps, key=lambda s: s['duration_ms']) if self.steps else None
+        return {
+            'total_ms': total_ms,
+            'slowest_step': slowest['step'] if slowest else None,
+            'steps': self.steps,
+        }
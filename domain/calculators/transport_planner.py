@@ -1,8 +1,18 @@
 # app/domain/calculators/transport_planner.py
-from typing import List, Dict, Any, Tuple
+import copy
+import hashlib
+import os
+import time
+from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime, date, timedelta
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
+from domain.calculators.loading_structures import (
+    Demand, LoadedItem, TruckState, TruckLoad, plan_records_to_dicts
+)
+from domain.calculators.plan_profiler import PlanProfiler, count_plan_state
 
 class TransportPlanner:
     """
@@ -18,8 +28,31 @@ class TransportPlanner:
     Step3: 日次積載計画作成（優先製品→同容器製品→異容器製品）
     Step4: 非デフォルトトラック活用
     """
-    def __init__(self, calendar_repo=None):
+    # グループ並列を使う最小需要件数（これ未満はプロセス起動の方が高くつく）
+    PARALLEL_MIN_DEMANDS = 500
+    # 日ごとの需要の底面積（段積み前）が使えるトラックの床面積のこの割合を超える日は
+    # フォールバック積載が起こりうるとみなし、並列に回さず最初から逐次で計算する
+    PARALLEL_FALLBACK_LOAD_RATIO = 0.9
+    # 差分再計算で影響範囲の拡大を繰り返す上限（超えたら全体を再計算）
+    REPLAN_MAX_ROUNDS = 5
+    # 影響範囲がこの割合以上の製品に及ぶ場合は差分の利点が無いので最初から全体を再計算
+    REPLAN_MAX_SCOPE_RATIO = 0.5
+
+    def __init__(self, calendar_repo=None, use_columnar_demand=True, check_demand_parity=False,
+                 parallel_groups=False, max_workers=None):
         self.calendar_repo = calendar_repo
+        # Step1 を列指向版で実行するか（False で従来の行ループ版）
+        self.use_columnar_demand = use_columnar_demand
+        # True の場合、列指向版と従来版の両方を実行して結果を突き合わせる
+        self.check_demand_parity = check_demand_parity
+        self.last_demand_parity_diffs = []
+        # True の場合、製品とトラックの連結成分（独立グループ）ごとに Step3 をプロセスプールで実行
+        self.parallel_groups = parallel_groups
+        self.max_workers = max_workers
+        self.last_group_report = {}
+        self.last_replan_report = {}
+        # Step3 で used_truck_ids 外へのフォールバック積載に入った製品（入るたびに追加）
+        self._fallback_product_ids = []
 
     def calculate_loading_plan_from_orders(self,
                                           orders_df: pd.DataFrame,
@@ -29,16 +62,328 @@ class TransportPlanner:
                                           truck_container_rules: List[Any],
                                           start_date: date,
                                           days: int = 7,
-                                          calendar_repo=None) -> Dict[str, Any]:
-        """新ルールに基づく積載計画作成"""
+                                          calendar_repo=None,
+                                          profile: bool = False) -> Dict[str, Any]:
+        """
+        新ルールに基づく積載計画作成
+
+        profile=True の場合、ステップ別の処理時間・需要件数・トラック状態の変化を
+        result['profile'] に格納する（False のときは計測しない）
+        """
+        profiler = PlanProfiler() if profile else None
+        self.calendar_repo = calendar_repo
+        working_dates, container_map, truck_map, product_map = self._prepare_planning_maps(
+            containers, trucks_df, products_df, start_date, days, calendar_repo
+        )
+        # Step1: 需要分析とトラック台数決定
+        if profiler:
+            profiler.begin('step1_demand_analysis', demands_in=len(orders_df))
+        daily_demands, use_non_default = self._analyze_demand(
+            orders_df, products_df, product_map, container_map, truck_map, working_dates
+        )
+        if profiler:
+            demand_count = sum(len(d) for d in daily_demands.values())
+            profiler.end(demands_out=demand_count, use_non_default=use_non_default)
+            profiler.begin('step2_forward_scheduling', demands_in=demand_count)
+        result = self._plan_from_demands(
+            daily_demands, use_non_default, working_dates, truck_map, container_map, product_map,
+            start_date, profiler
+        )
+        result['dependency_info']['signature'] = self._input_signature(
+            products_df, containers, trucks_df, truck_container_rules, working_dates
+        )
+        result['dependency_info']['order_fingerprints'] = self._order_fingerprints(orders_df)
+        return result
+
+    def replan_from_orders(self,
+                           previous_result: Dict[str, Any],
+                           changed_keys,
+                           orders_df: pd.DataFrame,
+                           products_df: pd.DataFrame,
+                           containers: List[Any],
+                           trucks_df: pd.DataFrame,
+                           truck_container_rules: List[Any],
+                           start_date: date,
+                           days: int = 7,
+                           calendar_repo=None) -> Dict[str, Any]:
+        """
+        受注の一部が変わったときの差分再計算
+
+        変更された製品は、前回結果に残した製品ごとの受注の指紋（dependency_info['order_fingerprints']）
+        と今回の orders_df を比べて求める（どの経路で delivery_progress が書き換わっても検知できる）。
+        changed_keys（(product_id, delivery_date) の集合）を渡した場合はその製品も加える。
+
+        変更製品が属するグループ（トラック・優先積載・製品コード・フォールバック積載・特便で
+        つながる製品×トラックの連結成分）だけを計画期間全体で Step2〜Step8 再計算し、
+        それ以外の製品・トラックは前回結果をそのまま使う。
+
+        全体計算との違い:
+        - グループ同士は同じトラックを取り合わないため、各トラックの積載内容は全体計算と同じ想定だが、
+          日ごとのトラックの並び（Step4/6/8 で追加されたトラックの位置）は全体計算と異なることがある。
+          並びは Excel の便番号・保存する計画に出るため、結果は計画キャッシュに入れない
+        - 効果があるのは、used_truck_ids でトラックが分かれていて、フォールバック積載・特便が
+          少ない（グループが分かれたままの）場合。積載が逼迫してフォールバック・特便で全製品が
+          つながる場合は全体を再計算する
+
+        次の場合は全体を再計算する:
+        - 前回結果に dependency_info・受注の指紋が無い／マスタ・ルール・計画日が前回と異なる
+        - 非デフォルトトラックの使用判定（Step1）が前回と変わった
+        - 変更製品がマスタに無い／影響範囲が REPLAN_MAX_SCOPE_RATIO 以上の製品に及ぶ／影響範囲が収束しない
+
+        Args:
+            previous_result: 前回の calculate_loading_plan_from_orders / replan_from_orders の結果
+            changed_keys: 変更が分かっている (product_id, delivery_date) の集合（None 可）
+            その他: calculate_loading_plan_from_orders と同じ（orders_df は変更後の全受注）
+        Returns:
+            Dict: calculate_loading_plan_from_orders と同じ形式。処理内容は last_replan_report に格納
+                  （mode: 'incremental' / 'full' / 'unchanged'）
+        """
+        started = time.perf_counter()
         self.calendar_repo = calendar_repo
+        working_dates, container_map, truck_map, product_map = self._prepare_planning_maps(
+            containers, trucks_df, products_df, start_date, days, calendar_repo
+        )
+        signature = self._input_signature(products_df, containers, trucks_df, truck_container_rules, working_dates)
+        # Step1 は use_non_default が全需要の平均で決まるため常に全体で行う
+        daily_demands, use_non_default = self._analyze_demand(
+            orders_df, products_df, product_map, container_map, truck_map, working_dates
+        )
+        fingerprints = self._order_fingerprints(orders_df)
+        previous_info = (previous_result or {}).get('dependency_info')
+        previous_fingerprints = (previous_info or {}).get('order_fingerprints')
+        changed_products = {
+            int(product_id) for product_id, _ in (changed_keys or []) if product_id is not None
+        }
+        if previous_fingerprints is not None:
+            changed_products.update(
+                product_id for product_id in set(previous_fingerprints) | set(fingerprints)
+                if previous_fingerprints.get(product_id) != fingerprints.get(product_id)
+            )
+
+        def full_rerun(reason):
+            print(f"ℹ️ 差分再計算を行わず全体を再計算します: {reason}")
+            result = self._plan_from_demands(
+                daily_demands, use_non_default, working_dates, truck_map, container_map, product_map, start_date
+            )
+            result['dependency_info']['signature'] = signature
+            result['dependency_info']['order_fingerprints'] = fingerprints
+            self.last_replan_report = {
+                'mode': 'full',
+                'reason': reason,
+                'changed_products': len(changed_products),
+                'products': len({d['product_id'] for demands in daily_demands.values() for d in demands}),
+                'trucks': len(truck_map),
+                'days': [d.strftime('%Y-%m-%d') for d in working_dates],
+                'rounds': 0,
+                'elapsed_ms': round((time.perf_counter() - started) * 1000, 1)
+            }
+            return result
+
+        if not previous_info:
+            return full_rerun('前回結果に依存情報がありません')
+        if previous_fingerprints is None:
+            return full_rerun('前回結果に受注の指紋がありません')
+        if previous_info.get('signature') != signature:
+            return full_rerun('マスタ・ルール・計画日が前回と異なります')
+        if previous_info.get('use_non_default') != use_non_default:
+            return full_rerun('非デフォルトトラックの使用判定が変わりました')
+        unknown = changed_products - set(product_map)
+        if unknown:
+            return full_rerun(f"マスタに無い製品ID {sorted(unknown)}")
+        if not changed_products:
+            self.last_replan_report = {
+                'mode': 'unchanged',
+                'reason': '受注が前回の計画から変わっていません',
+                'changed_products': 0,
+                'products': 0,
+                'trucks': 0,
+                'days': [],
+                'rounds': 0,
+                'elapsed_ms': round((time.perf_counter() - started) * 1000, 1)
+            }
+            return copy.deepcopy(previous_result)
+
+        # グループ分けの対象製品（今回の需要＋需要が無くなった変更製品）
+        products, demand_counts = self._demand_products(daily_demands)
+        default_truck_ids = [tid for tid, t in truck_map.items() if t.get('default_use', False)]
+        for product_id in changed_products - set(products):
+            row = product_map[product_id]
+            products[product_id] = (
+                row.get('product_code', ''),
+                self._parse_truck_ids(row.get('used_truck_ids'), default_truck_ids)
+            )
+        links = self._dependency_links(previous_info, truck_map, use_non_default)
+
+        def affected_scope():
+            groups = self._find_truck_groups(
+                products, truck_map, use_non_default, demand_counts,
+                link_code_substrings=True, extra_links=links
+            )
+            scope_products, scope_trucks = set(), set()
+            for group in groups:
+                if group['product_ids'] & changed_products:
+                    scope_products.update(group['product_ids'])
+                    scope_trucks.update(group['truck_ids'])
+            return scope_products, scope_trucks
+
+        # 影響範囲を再計算し、実行時に決まる関係（フォールバック積載・特便）が範囲を広げなくなるまで繰り返す
+        scope_products, scope_trucks = affected_scope()
+        sub_result = None
+        rounds = 0
+        while True:
+            if len(scope_products) >= len(products):
+                return full_rerun('影響範囲が全製品に及びます')
+            if len(scope_products) >= len(products) * self.REPLAN_MAX_SCOPE_RATIO:
+                return full_rerun(
+                    f"影響範囲が製品の{self.REPLAN_MAX_SCOPE_RATIO:.0%}以上に及びます（{len(scope_products)}/{len(products)}件）"
+                )
+            if rounds >= self.REPLAN_MAX_ROUNDS:
+                return full_rerun(f"影響範囲が{self.REPLAN_MAX_ROUNDS}回で収束しません")
+            rounds += 1
+            sub_demands = {}
+            for date_str, demands in daily_demands.items():
+                subset = [d for d in demands if d['product_id'] in scope_products]
+                if subset:
+                    sub_demands[date_str] = subset
+            sub_truck_map = {tid: t for tid, t in truck_map.items() if tid in scope_trucks}
+            sub_result = self._plan_from_demands(
+                sub_demands, use_non_default, working_dates, sub_truck_map, container_map, product_map, start_date
+            )
+            links = links + self._dependency_links(sub_result['dependency_info'], truck_map, use_non_default)
+            next_products, next_trucks = affected_scope()
+            if next_products == scope_products and next_trucks == scope_trucks:
+                break
+            scope_products, scope_trucks = next_products, next_trucks
+
+        daily_plans, dependency_info, affected_days = self._splice_plans(
+            previous_result, sub_result, scope_products, scope_trucks,
+            {str(products[pid][0]) for pid in scope_products}, working_dates, truck_map
+        )
+        result = self._finalize_plan(daily_plans, working_dates, use_non_default)
+        dependency_info.update({
+            'signature': signature,
+            'use_non_default': use_non_default,
+            'order_fingerprints': fingerprints
+        })
+        result['dependency_info'] = dependency_info
+        self.last_replan_report = {
+            'mode': 'incremental',
+            'reason': '',
+            'changed_products': len(changed_products),
+            'products': len(scope_products),
+            'trucks': len(scope_trucks),
+            'days': affected_days,
+            'rounds': rounds,
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 1)
+        }
+        print(f"✅ 差分再計算: 製品{len(scope_products)}/{len(products)}件・トラック{len(scope_trucks)}台"
+              f"（影響日 {len(affected_days)}日、{rounds}回）")
+        return result
+
+    @staticmethod
+    def _dependency_links(dependency_info, truck_map, use_non_default) -> List[Tuple[List[int], List[int]]]:
+        """依存情報から実行時に決まった製品×トラックの関係を作る（_find_truck_groups の extra_links 用）"""
+        links = []
+        fallback_products = dependency_info.get('fallback_products') or []
+        if fallback_products:
+            # フォールバック積載は使用可能な全トラックが候補
+            available_ids = [tid for tid, t in truck_map.items() if use_non_default or t.get('default_use', False)]
+            links.append((list(fallback_products), available_ids))
+        step6_products = dependency_info.get('step6_products') or []
+        if step6_products:
+            # 特便はトラック制約を無視して全非デフォルトトラックが候補
+            non_default_ids = [tid for tid, t in truck_map.items() if not t.get('default_use', False)]
+            links.append((list(step6_products), non_default_ids))
+        return links
+
+    def _splice_plans(self, previous_result, sub_result, scope_products, scope_trucks, scope_codes,
+                      working_dates, truck_map):
+        """
+        前回結果の影響範囲外の部分と、影響範囲の再計算結果を日ごとに合わせる
+
+        日ごとのトラックの並びは _merge_trucks による近似（全体計算と同じとは限らない）
+
+        Returns:
+            Tuple: daily_plans, dependency_info（signature 以外）, 影響日のリスト
+        """
+        previous_plans = previous_result.get('daily_plans', {})
+        sub_plans = sub_result['daily_plans']
+        empty_plan = {'trucks': [], 'warnings': [], 'remaining_demands': []}
+        date_keys = [d.strftime('%Y-%m-%d') for d in working_dates]
+        # 計画期間外の日付（翌日着トラックの移動先）は日付順に後ろへ並べる（全体計算と同じ並び）
+        extra_keys = sorted((set(previous_plans) | set(sub_plans)) - set(date_keys))
+
+        daily_plans = {}
+        affected_days = []
+        for date_str in date_keys + extra_keys:
+            previous_plan = previous_plans.get(date_str) or empty_plan
+            sub_plan = sub_plans.get(date_str) or empty_plan
+            kept_trucks = [
+                copy.deepcopy(truck_plan) for truck_plan in previous_plan['trucks']
+                if truck_plan['truck_id'] not in scope_trucks
+            ]
+            kept_remaining = [
+                copy.deepcopy(demand) for demand in previous_plan.get('remaining_demands') or []
+                if demand['product_id'] not in scope_products
+            ]
+            kept_warnings = [
+                warning for warning in previous_plan.get('warnings') or []
+                if self._warning_product_code(warning) not in scope_codes
+            ]
+            trucks = self._merge_trucks(kept_trucks, sub_plan['trucks'], truck_map)
+            if date_str in extra_keys and not trucks:
+                continue
+            if (len(kept_trucks) != len(previous_plan['trucks'])
+                    or len(kept_remaining) != len(previous_plan.get('remaining_demands') or [])
+                    or sub_plan['trucks'] or sub_plan.get('remaining_demands')):
+                affected_days.append(date_str)
+            daily_plans[date_str] = {
+                'trucks': trucks,
+                'total_trips': len(trucks),
+                'warnings': kept_warnings + list(sub_plan.get('warnings') or []),
+                'remaining_demands': kept_remaining + list(sub_plan.get('remaining_demands') or [])
+            }
+
+        previous_info = previous_result['dependency_info']
+        sub_info = sub_result['dependency_info']
+        trucks_after_step6 = {}
+        for date_str in date_keys:
+            truck_ids = {
+                tid for tid in previous_info.get('trucks_after_step6', {}).get(date_str, []) if tid not in scope_trucks
+            }
+            truck_ids.update(sub_info['trucks_after_step6'].get(date_str, []))
+            if truck_ids:
+                trucks_after_step6[date_str] = sorted(truck_ids)
+        # Step7: 最終計画日（Step6 終了時点でトラックのある最後の営業日）の積み残しにフラグを付け直す
+        final_date_str = next(
+            (date_str for date_str in reversed(date_keys) if date_str in trucks_after_step6), date_keys[-1]
+        )
+        for date_str, plan in daily_plans.items():
+            for demand in plan['remaining_demands']:
+                demand.pop('final_day_overflow', None)
+                if date_str == final_date_str:
+                    demand['final_day_overflow'] = True
+
+        def merged_products(key):
+            kept = {pid for pid in previous_info.get(key) or [] if pid not in scope_products}
+            return sorted(kept | set(sub_info.get(key) or []))
+
+        dependency_info = {
+            'fallback_products': merged_products('fallback_products'),
+            'step6_products': merged_products('step6_products'),
+            'trucks_after_step6': trucks_after_step6
+        }
+        return daily_plans, dependency_info, affected_days
+
+    def _prepare_planning_maps(self, containers, trucks_df, products_df, start_date, days, calendar_repo):
+        """営業日リストと容器・トラック・製品のマップを作成"""
         # 営業日のみで計画期間を構築
         working_dates = self._get_working_dates(start_date, days, calendar_repo)
         # データ準備
         container_map = {c.id: c for c in containers}
-        # トラックマップ作成（NaNチェック）
+        # トラックマップ作成（NaNチェック、行はdictに変換して保持）
         truck_map = {}
-        for _, row in trucks_df.iterrows():
+        for row in trucks_df.to_dict('records'):
             try:
                 truck_id = row['id']
                 if pd.isna(truck_id):
@@ -56,34 +401,94 @@ class TransportPlanner:
                 product_map[int(product_id)] = row
             except (ValueError, TypeError):
                 continue
-        # Step1: 需要分析とトラック台数決定
-        daily_demands, use_non_default = self._analyze_demand_and_decide_trucks(
+        return working_dates, container_map, truck_map, product_map
+
+    def _analyze_demand(self, orders_df, products_df, product_map, container_map, truck_map,
+                        working_dates) -> Tuple[Dict, bool]:
+        """Step1: 需要分析とトラック台数決定（列指向版／従来版の切り替えと突き合わせ）"""
+        if self.use_columnar_demand:
+            daily_demands, use_non_default = self._analyze_demand_columnar(
+                orders_df, products_df, container_map, truck_map, working_dates
+            )
+            if self.check_demand_parity:
+                legacy_demands, legacy_use_non_default = self._analyze_demand_and_decide_trucks(
+                    orders_df, product_map, container_map, truck_map, working_dates
+                )
+                diffs = self._compare_demand_results(
+                    (legacy_demands, legacy_use_non_default),
+                    (daily_demands, use_non_default)
+                )
+                self.last_demand_parity_diffs = diffs
+                if diffs:
+                    print(f"⚠️ Step1 列指向版と従来版で差異 {len(diffs)}件 → 従来版の結果を使用")
+                    for diff in diffs[:20]:
+                        print(f"  - {diff}")
+                    daily_demands, use_non_default = legacy_demands, legacy_use_non_default
+            return daily_demands, use_non_default
+        return self._analyze_demand_and_decide_trucks(
             orders_df, product_map, container_map, truck_map, working_dates
         )
+
+    def _plan_from_demands(self, daily_demands, use_non_default, working_dates, truck_map,
+                           container_map, product_map, start_date, profiler=None) -> Dict[str, Any]:
+        """
+        Step2〜Step9: Step1 の日別需要から積載計画を作成
+
+        result['dependency_info'] に差分再計算（replan_from_orders）で使う情報を残す:
+        - fallback_products: Step3 でフォールバック積載に入った製品（全トラックと連動）
+        - step6_products: Step6（特便）の対象になった製品（全非デフォルトトラックと連動）
+        - trucks_after_step6: Step7 の最終計画日を決める、Step6 終了時点の日別トラック
+        """
+        self._fallback_product_ids = []
         # Step2: 前倒し処理（最終日から逆順）
         adjusted_demands = self._forward_scheduling(
             daily_demands, truck_map, container_map, working_dates, use_non_default
         )
+        if profiler:
+            demand_count = sum(len(d) for d in adjusted_demands.values())
+            advanced_count = sum(
+                1 for demands in adjusted_demands.values() for d in demands if d.get('is_advanced', False)
+            )
+            profiler.end(demands_out=demand_count, advanced=advanced_count)
+            profiler.begin('step3_daily_loading_plan', demands_in=demand_count,
+                           plan_state=count_plan_state({}))
         # Step3: 日次積載計画作成
         daily_plans = {}
         all_remaining_demands = []  # 全日の積み残しを収集
+        group_plans = None
+        if self.parallel_groups:
+            group_plans = self._create_daily_plans_by_group(
+                adjusted_demands, truck_map, container_map, product_map, use_non_default, working_dates
+            )
         for working_date in working_dates:
             date_str = working_date.strftime('%Y-%m-%d')
             if date_str not in adjusted_demands or not adjusted_demands[date_str]:
                 daily_plans[date_str] = {'trucks': [], 'total_trips': 0, 'warnings': [], 'remaining_demands': []}
                 continue
-            plan = self._create_daily_loading_plan(
-                adjusted_demands[date_str],
-                truck_map,
-                container_map,
-                product_map,
-                use_non_default,
-                working_date
-            )
+            if group_plans is not None:
+                plan = group_plans[date_str]
+            else:
+                plan = self._create_daily_loading_plan(
+                    adjusted_demands[date_str],
+                    truck_map,
+                    container_map,
+                    product_map,
+                    use_non_default,
+                    working_date
+                )
             daily_plans[date_str] = plan
             # 積み残しを収集
             if plan.get('remaining_demands'):
                 all_remaining_demands.extend(plan['remaining_demands'])
+        if profiler:
+            plan_state = count_plan_state(daily_plans)
+            group_counters = {
+                key: self.last_group_report[key] for key in ('groups', 'workers', 'serial_days')
+                if group_plans is not None and key in self.last_group_report
+            }
+            profiler.end(demands_out=plan_state['remaining_demands'], plan_state=plan_state, **group_counters)
+            profiler.begin('step4_relocate_remaining', demands_in=len(all_remaining_demands),
+                           plan_state=plan_state)
         # Step4: 積み残しを他のトラック候補で再配置
         if all_remaining_demands:
             self._relocate_remaining_demands(
@@ -94,6 +499,11 @@ class TransportPlanner:
                 working_dates,
                 use_non_default
             )
+        if profiler:
+            plan_state = count_plan_state(daily_plans)
+            profiler.end(demands_out=plan_state['remaining_demands'], plan_state=plan_state)
+            profiler.begin('step5_forward_remaining', demands_in=plan_state['remaining_demands'],
+                           plan_state=plan_state)
         # Step5: 積み残しを前倒し（前倒し可能な製品のみ）
         self._forward_remaining_demands(
             daily_plans,
@@ -102,6 +512,14 @@ class TransportPlanner:
             working_dates,
             use_non_default
         )
+        if profiler:
+            plan_state = count_plan_state(daily_plans)
+            profiler.end(demands_out=plan_state['remaining_demands'], plan_state=plan_state)
+            profiler.begin('step6_relocate_next_days', demands_in=plan_state['remaining_demands'],
+                           plan_state=plan_state)
+        step6_products = {
+            demand.product_id for plan in daily_plans.values() for demand in plan.get('remaining_demands') or []
+        }
         # Step6: 積み残しを翌日以降に再配置
         self._relocate_to_next_days(
             daily_plans,
@@ -110,6 +528,14 @@ class TransportPlanner:
             working_dates,
             use_non_default
         )
+        trucks_after_step6 = {
+            date_str: sorted({truck_plan['truck_id'] for truck_plan in plan['trucks']})
+            for date_str, plan in daily_plans.items() if plan['trucks']
+        }
+        if profiler:
+            plan_state = count_plan_state(daily_plans)
+            profiler.end(demands_out=plan_state['remaining_demands'], plan_state=plan_state)
+            profiler.begin('step7_final_overflow', demands_in=plan_state['remaining_demands'])
         # まとめ対象日付を実際の計画日で絞り込み
         planned_dates = [
             date for date in working_dates
@@ -124,10 +550,36 @@ class TransportPlanner:
             if final_plan.get('remaining_demands'):
                 for demand in final_plan['remaining_demands']:
                     demand['final_day_overflow'] = True
+        if profiler:
+            overflow_count = len(daily_plans.get(final_date_str, {}).get('remaining_demands') or []) \
+                if final_date_str else 0
+            profiler.end(demands_out=overflow_count)
+            profiler.begin('step8_next_day_arrival', plan_state=count_plan_state(daily_plans))
         # Step8: 翌日着トラックの積載日を前日に調整
-        self._adjust_for_next_day_arrival_trucks(daily_plans, truck_map, start_date)
+        moved_trucks = self._adjust_for_next_day_arrival_trucks(daily_plans, truck_map, start_date)
+
+        # 内部構造（Demand/LoadedItem）を従来の dict 形式に戻す
+        self._convert_plan_records(daily_plans)
         
-        # Step9: トラック移動後にplanned_datesを再計算（期間外の日付も含める）
+        if profiler:
+            profiler.end(plan_state=count_plan_state(daily_plans), moved_trucks=moved_trucks)
+            profiler.begin('step9_summary')
+        result = self._finalize_plan(daily_plans, working_dates, use_non_default)
+        result['dependency_info'] = {
+            'use_non_default': use_non_default,
+            'fallback_products': sorted(set(self._fallback_product_ids)),
+            'step6_products': sorted(step6_products),
+            'trucks_after_step6': trucks_after_step6
+        }
+        if profiler:
+            summary = result['summary']
+            profiler.end(total_trips=summary['total_trips'], warnings=summary['total_warnings'])
+            result['profile'] = profiler.to_dict()
+        return result
+
+    def _finalize_plan(self, daily_plans, working_dates, use_non_default) -> Dict[str, Any]:
+        """Step9: トラック移動後の計画日でサマリーと期間を作成"""
+        # トラック移動後にplanned_datesを再計算（期間外の日付も含める）
         all_dates_with_trucks = [
             datetime.strptime(date_str, '%Y-%m-%d').date()
             for date_str in daily_plans.keys()
@@ -136,11 +588,10 @@ class TransportPlanner:
         if all_dates_with_trucks:
             all_dates_with_trucks.sort()
             planned_dates = all_dates_with_trucks
-            period_start = planned_dates[0]
-            period_end = planned_dates[-1]
         else:
-            period_start = working_dates[0]
-            period_end = working_dates[-1]
+            planned_dates = working_dates
+        period_start = planned_dates[0]
+        period_end = planned_dates[-1]
         
         # サマリー作成
         summary = self._create_summary(daily_plans, use_non_default, planned_dates)
@@ -153,6 +604,61 @@ class TransportPlanner:
             'use_non_default_truck': use_non_default
         }
 
+    @staticmethod
+    def _warning_product_code(warning: str) -> str:
+        """積み残し警告（"…: 製品コード (n容器=…"）から製品コードを取り出す"""
+        head, _, _ = warning.partition(' (')
+        return head.rpartition(': ')[2]
+
+    @staticmethod
+    def _merge_trucks(kept_trucks, new_trucks, truck_map) -> List[Dict]:
+        """
+        前回計画に残すトラックと再計算したトラックを合わせる
+
+        どちらの並びも変えずに、再計算したトラックを truck_map 順の位置に差し込む。
+        Step3 のトラックは truck_map 順なので同じ位置になるが、Step4/6/8 で後から追加された
+        トラックは全体計算では末尾に並ぶため、全体計算と並びが異なることがある。
+        """
+        if not kept_trucks or not new_trucks:
+            return kept_trucks + new_trucks
+        truck_order = {truck_id: index for index, truck_id in enumerate(truck_map)}
+        last = len(truck_order)
+        merged = []
+        kept_index = 0
+        for truck_plan in new_trucks:
+            order = truck_order.get(truck_plan['truck_id'], last)
+            while (kept_index < len(kept_trucks)
+                   and truck_order.get(kept_trucks[kept_index]['truck_id'], last) <= order):
+                merged.append(kept_trucks[kept_index])
+                kept_index += 1
+            merged.append(truck_plan)
+        merged.extend(kept_trucks[kept_index:])
+        return merged
+
+    @staticmethod
+    def _order_fingerprints(orders_df: pd.DataFrame) -> Dict[int, str]:
+        """製品ごとの受注行の指紋（差分再計算で変わった製品を見つける用、行の並びには依存しない）"""
+        if orders_df is None or orders_df.empty or 'product_id' not in orders_df.columns:
+            return {}
+        row_hashes = pd.util.hash_pandas_object(orders_df.astype(str), index=False)
+        fingerprints = {}
+        for product_id, hashes in row_hashes.groupby(orders_df['product_id']):
+            digest = hashlib.sha256(np.sort(hashes.to_numpy()).tobytes()).hexdigest()
+            fingerprints[int(product_id)] = digest
+        return fingerprints
+
+    @staticmethod
+    def _input_signature(products_df, containers, trucks_df, truck_container_rules, working_dates) -> str:
+        """マスタ・ルール・計画日の指紋（差分再計算で前回結果を使えるかの判定用）"""
+        digest = hashlib.sha256()
+        for frame in (products_df, trucks_df):
+            digest.update(frame.to_csv(index=False).encode('utf-8') if frame is not None else b'')
+        for container in containers:
+            digest.update(repr(sorted(getattr(container, '__dict__', {}).items())).encode('utf-8'))
+        digest.update(repr(truck_container_rules).encode('utf-8'))
+        digest.update(','.join(d.isoformat() for d in working_dates).encode('utf-8'))
+        return digest.hexdigest()
+
     def _get_working_dates(self, start_date: date, days: int, calendar_repo) -> List[date]:
         """営業日のみを取得"""
         working_dates = []
@@ -292,14 +798,7 @@ class TransportPlanner:
                 truck_ids = [tid for tid, t in truck_map.items() if t.get('default_use', False)]
             
             # 納期日を積載日として使用（arrival_day_offsetは最後に調整）
-            primary_loading_date = delivery_date
-            
-            # 営業日チェック
-            if self.calendar_repo:
-                for _ in range(7):
-                    if self.calendar_repo.is_working_day(primary_loading_date):
-                        break
-                    primary_loading_date -= timedelta(days=1)
+            primary_loading_date = self._resolve_loading_date(delivery_date)
             
             # 計画期間内のみ
             if primary_loading_date and primary_loading_date in working_dates:
@@ -339,6 +838,219 @@ class TransportPlanner:
         
         return dict(daily_demands), use_non_default
 
+    def _resolve_loading_date(self, delivery_date: date) -> date:
+        """納期日から積載日を決定（非営業日なら最大7日遡る）"""
+        loading_date = delivery_date
+        if self.calendar_repo:
+            for _ in range(7):
+                if self.calendar_repo.is_working_day(loading_date):
+                    break
+                loading_date -= timedelta(days=1)
+        return loading_date
+
+    def _parse_truck_ids(self, truck_ids_value, default_truck_ids) -> List[int]:
+        """製品の used_truck_ids を解析（未設定ならデフォルトトラック）"""
+        if truck_ids_value and not pd.isna(truck_ids_value):
+            return [int(tid.strip()) for tid in str(truck_ids_value).split(',')]
+        return list(default_truck_ids)
+
+    @staticmethod
+    def _numeric_column(df: pd.DataFrame, column: str, default=np.nan) -> pd.Series:
+        """列を数値化して取得（列が無い場合は default で埋める）"""
+        if column in df.columns:
+            return pd.to_numeric(df[column], errors='coerce')
+        return pd.Series(default, index=df.index, dtype='float64')
+
+    def _analyze_demand_columnar(self, orders_df, products_df, container_map,
+                                 truck_map, working_dates) -> Tuple[Dict, bool]:
+        """
+        Step1（列指向版）: 需要分析とトラック台数決定
+        受注・製品・容器を一度のマージで結合し、容器数・端数・余剰・底面積を
+        NumPy配列で一括計算する。戻り値は _analyze_demand_and_decide_trucks と同じ。
+        """
+        default_truck_ids = [tid for tid, t in truck_map.items() if t.get('default_use', False)]
+        default_total_floor_area = sum(
+            (truck_map[tid]['width'] * truck_map[tid]['depth']) / 1_000_000 for tid in default_truck_ids
+        )
+
+        def _decide(total_floor_area):
+            avg_floor_area = total_floor_area / len(working_dates) if working_dates else 0
+            return avg_floor_area > default_total_floor_area
+
+        if (orders_df is None or orders_df.empty or 'product_id' not in orders_df.columns
+                or products_df is None or products_df.empty or not container_map):
+            return {}, _decide(0)
+
+        orders = orders_df.reset_index(drop=True)
+
+        # --- 受注側: 製品ID・納期・残数量 ---
+        # 納期は delivery_date を優先し、偽値なら instruction_date（従来版の `or` と同じ）
+        if 'delivery_date' in orders.columns:
+            raw_dates = orders['delivery_date']
+            if 'instruction_date' in orders.columns:
+                raw_dates = raw_dates.where(raw_dates.astype(bool), orders['instruction_date'])
+        elif 'instruction_date' in orders.columns:
+            raw_dates = orders['instruction_date']
+        else:
+            return {}, _decide(0)
+
+        # 旧 planned_quantity は使わず、残数量ベースに統一
+        if 'remaining_quantity' in orders.columns:
+            quantity = self._numeric_column(orders, 'remaining_quantity').fillna(0)
+        elif 'shipped_quantity' in orders.columns:
+            quantity = (np.trunc(self._numeric_column(orders, 'order_quantity').fillna(0))
+                        - np.trunc(self._numeric_column(orders, 'shipped_quantity').fillna(0)))
+        else:
+            quantity = self._numeric_column(orders, 'order_quantity').fillna(0)
+
+        order_frame = pd.DataFrame({
+            'row_no': np.arange(len(orders)),
+            'product_id': self._numeric_column(orders, 'product_id'),
+            'delivery_date': raw_dates.map(self._parse_date),
+            'quantity': np.trunc(quantity).clip(lower=0).astype('int64'),
+        })
+        order_frame = order_frame[
+            order_frame['product_id'].notna()
+            & order_frame['delivery_date'].notna()
+            & (order_frame['quantity'] > 0)
+        ].copy()
+        order_frame['product_id'] = order_frame['product_id'].astype('int64')
+
+        # --- 製品側: 容器・入り数（同一IDは後勝ち＝product_map と同じ） ---
+        capacity = np.trunc(self._numeric_column(products_df, 'capacity').fillna(1)).clip(lower=1)
+        product_frame = pd.DataFrame({
+            'product_id': self._numeric_column(products_df, 'id'),
+            'container_id': np.trunc(self._numeric_column(products_df, 'used_container_id')),
+            'capacity': capacity,
+            'product_row': np.arange(len(products_df)),
+        })
+        product_frame = product_frame[product_frame['product_id'].notna()].copy()
+        product_frame['product_id'] = product_frame['product_id'].astype('int64')
+        product_frame = product_frame.drop_duplicates('product_id', keep='last')
+        product_frame = product_frame[
+            product_frame['container_id'].notna() & (product_frame['container_id'] != 0)
+        ].copy()
+        product_frame['container_id'] = product_frame['container_id'].astype('int64')
+        product_frame['capacity'] = product_frame['capacity'].astype('int64')
+
+        # --- 容器側: 1容器あたり底面積と段積み ---
+        container_ids = list(container_map.keys())
+        container_frame = pd.DataFrame({
+            'container_id': container_ids,
+            'floor_area_per_container': [
+                (container_map[cid].width * container_map[cid].depth) / 1_000_000 for cid in container_ids
+            ],
+            'max_stack': [getattr(container_map[cid], 'max_stack', 1) for cid in container_ids],
+            'stackable': [bool(getattr(container_map[cid], 'stackable', False)) for cid in container_ids],
+        })
+
+        merged = (order_frame
+                  .merge(product_frame, on='product_id', how='inner')
+                  .merge(container_frame, on='container_id', how='inner')
+                  .sort_values('row_no', kind='stable'))
+
+        if merged.empty:
+            return {}, _decide(0)
+
+        # --- 容器数・端数・余剰・底面積を一括計算 ---
+        qty = merged['quantity'].to_numpy(dtype=np.int64)
+        cap = merged['capacity'].to_numpy(dtype=np.int64)
+        max_stack = merged['max_stack'].fillna(1).to_numpy(dtype=np.int64)
+        stackable = merged['stackable'].to_numpy(dtype=bool)
+        per_container = merged['floor_area_per_container'].to_numpy(dtype=np.float64)
+
+        remainder = qty % cap
+        num_containers = (qty + cap - 1) // cap
+        surplus = np.where(remainder > 0, cap - remainder, 0)
+        use_stack = (max_stack > 1) & stackable
+        stacked = (num_containers + np.maximum(max_stack, 1) - 1) // np.maximum(max_stack, 1)
+        floor_area = per_container * np.where(use_stack, stacked, num_containers)
+
+        # 期間外の需要も含めて合計（従来版と同じく行順に加算）
+        total_floor_area = sum(floor_area.tolist())
+
+        # --- 積載日: 納期ごとに1回だけ営業日判定 ---
+        loading_by_delivery = {
+            d: self._resolve_loading_date(d) for d in merged['delivery_date'].unique()
+        }
+        working_set = set(working_dates)
+
+        product_rows = products_df.iloc[merged['product_row'].to_numpy()]
+        product_codes = (product_rows['product_code'].tolist()
+                         if 'product_code' in product_rows.columns else [''] * len(merged))
+        product_names = (product_rows['product_name'].tolist()
+                         if 'product_name' in product_rows.columns else [''] * len(merged))
+        can_advance = (product_rows['can_advance'].tolist()
+                       if 'can_advance' in product_rows.columns else [0] * len(merged))
+        truck_id_values = (product_rows['used_truck_ids'].tolist()
+                           if 'used_truck_ids' in product_rows.columns else [None] * len(merged))
+
+        truck_ids_cache = {}
+        daily_demands = defaultdict(list)
+        for i, (product_id, container_id, delivery_date) in enumerate(zip(
+                merged['product_id'].tolist(),
+                merged['container_id'].tolist(),
+                merged['delivery_date'].tolist())):
+            loading_date = loading_by_delivery[delivery_date]
+            if not loading_date or loading_date not in working_set:
+                continue
+
+            if product_id not in truck_ids_cache:
+                truck_ids_cache[product_id] = self._parse_truck_ids(truck_id_values[i], default_truck_ids)
+            container = container_map[container_id]
+            total_quantity = int(qty[i])
+
+            daily_demands[loading_date.strftime('%Y-%m-%d')].append({
+                'product_id': product_id,
+                'product_code': product_codes[i],
+                'product_name': product_names[i],
+                'container_id': container_id,
+                'num_containers': int(num_containers[i]),
+                'total_quantity': total_quantity,
+                'calculated_quantity': total_quantity,
+                'capacity': int(cap[i]),
+                'remainder': int(remainder[i]),
+                'surplus': int(surplus[i]),
+                'floor_area': float(floor_area[i]),
+                'floor_area_per_container': float(per_container[i]),
+                'delivery_date': delivery_date,
+                'loading_date': loading_date,
+                'truck_ids': list(truck_ids_cache[product_id]),
+                'max_stack': getattr(container, 'max_stack', 1),
+                'stackable': getattr(container, 'stackable', False),
+                'can_advance': bool(can_advance[i]),
+                'is_advanced': False
+            })
+
+        return dict(daily_demands), _decide(total_floor_area)
+
+    def _compare_demand_results(self, expected, actual) -> List[str]:
+        """Step1 の2つの結果（従来版・列指向版）を突き合わせ、差異を文字列で返す"""
+        expected_demands, expected_flag = expected
+        actual_demands, actual_flag = actual
+        diffs = []
+
+        if expected_flag != actual_flag:
+            diffs.append(f"use_non_default: {expected_flag} != {actual_flag}")
+
+        for date_str in sorted(set(expected_demands) | set(actual_demands)):
+            exp_list = expected_demands.get(date_str, [])
+            act_list = actual_demands.get(date_str, [])
+            if len(exp_list) != len(act_list):
+                diffs.append(f"{date_str}: 需要件数 {len(exp_list)} != {len(act_list)}")
+                continue
+            for idx, (exp, act) in enumerate(zip(exp_list, act_list)):
+                for key in set(exp) | set(act):
+                    exp_value, act_value = exp.get(key), act.get(key)
+                    if isinstance(exp_value, float) or isinstance(act_value, float):
+                        if abs(float(exp_value or 0) - float(act_value or 0)) <= 1e-9:
+                            continue
+                    elif exp_value == act_value:
+                        continue
+                    diffs.append(f"{date_str}[{idx}] {key}: {exp_value!r} != {act_value!r}")
+
+        return diffs
+
     def _forward_scheduling(self, daily_demands, truck_map, container_map, 
                            working_dates, use_non_default) -> Dict:
         """
@@ -348,9 +1060,9 @@ class TransportPlanner:
         ✅ 最終日の容量オーバー検出と特別処理を追加
         """
         adjusted_demands = {d.strftime('%Y-%m-%d'): [] for d in working_dates}
-        # 初期需要をコピー
+        # 初期需要を Demand に変換（以降は Demand のまま扱い、daily_plans 返却時に dict へ戻す）
         for date_str, demands in daily_demands.items():
-            adjusted_demands[date_str] = [d.copy() for d in demands]
+            adjusted_demands[date_str] = [Demand.from_dict(d) for d in demands]
         # 使用可能なトラックを取得
         if use_non_default:
             available_trucks = {tid: t for tid, t in truck_map.items()}
@@ -381,9 +1093,7 @@ class TransportPlanner:
                     remaining_demands.append(demand)
                     continue
                 # この製品が使用できるトラックを取得
-                allowed_truck_ids = demand.get('truck_ids', [])
-                if not allowed_truck_ids:
-                    allowed_truck_ids = list(available_trucks.keys())
+                allowed_truck_ids = demand.get('truck_ids') or list(available_trucks.keys())
                 # シンプルに全てのallowed_truck_idsを使用
                 valid_truck_ids = [tid for tid in allowed_truck_ids if tid in available_trucks]
                 # ✅ 修正: 複数トラックへの分割積載を試みる
@@ -392,17 +1102,18 @@ class TransportPlanner:
                 for truck_id in valid_truck_ids:
                     if truck_id not in truck_loads:
                         continue
-                    remaining_capacity = truck_loads[truck_id]['capacity'] - truck_loads[truck_id]['floor_area']
-                    if remaining_demand['floor_area'] <= remaining_capacity:
+                    truck_load = truck_loads[truck_id]
+                    remaining_capacity = truck_load['capacity'] - truck_load['floor_area']
+                    if remaining_demand.floor_area <= remaining_capacity:
                         # 全量積載可能
-                        truck_loads[truck_id]['floor_area'] += remaining_demand['floor_area']
+                        truck_load['floor_area'] += remaining_demand.floor_area
                         has_loaded_any = True
-                        remaining_demand['floor_area'] = 0
-                        remaining_demand['num_containers'] = 0
+                        remaining_demand.floor_area = 0
+                        remaining_demand.num_containers = 0
                         break
                     elif remaining_capacity > 0:
                         # 一部のみ積載可能 - 分割
-                        container = container_map.get(demand['container_id'])
+                        container = container_map.get(demand.container_id)
                         if container:
                             floor_area_per_container = (container.width * container.depth) / 1_000_000
                             max_stack = getattr(container, 'max_stack', 1)
@@ -419,27 +1130,27 @@ class TransportPlanner:
                                     loadable_floor_area = floor_area_per_container * stacked
                                 else:
                                     loadable_floor_area = floor_area_per_container * loadable_containers
-                                truck_loads[truck_id]['floor_area'] += loadable_floor_area
-                                remaining_demand['floor_area'] -= loadable_floor_area
-                                remaining_demand['num_containers'] -= loadable_containers
+                                truck_load['floor_area'] += loadable_floor_area
+                                remaining_demand.floor_area -= loadable_floor_area
+                                remaining_demand.num_containers -= loadable_containers
                                 has_loaded_any = True
                 # 積載結果を判定
-                if remaining_demand['num_containers'] <= 0:
+                if remaining_demand.num_containers <= 0:
                     # 全量積載成功 - そのまま残す（この日に積載完了）
                     remaining_demands.append(demand)
                 elif has_loaded_any:
                     # 一部積載できた - 積載できた分は記録、残りは前倒しor積み残し
-                    if remaining_demand['num_containers'] < demand['num_containers']:
+                    if remaining_demand.num_containers < demand.num_containers:
                         # 積載できた分を記録
                         loaded_demand = demand.copy()
-                        loaded_demand['num_containers'] = demand['num_containers'] - remaining_demand['num_containers']
-                        loaded_demand['total_quantity'] = loaded_demand['num_containers'] * demand['capacity'] - remaining_demand['surplus']  # 直した
-                        loaded_demand['floor_area'] = demand['floor_area'] - remaining_demand['floor_area']
+                        loaded_demand.num_containers = demand.num_containers - remaining_demand.num_containers
+                        loaded_demand.total_quantity = loaded_demand.num_containers * demand.capacity - remaining_demand.surplus  # 直した
+                        loaded_demand.floor_area = demand.floor_area - remaining_demand.floor_area
                         remaining_demands.append(loaded_demand)
                     # 残りを前倒し候補に
                     if demand.get('can_advance', False):
-                        remaining_demand['is_advanced'] = True
-                        remaining_demand['loading_date'] = prev_date
+                        remaining_demand.is_advanced = True
+                        remaining_demand.loading_date = prev_date
                         demands_to_forward.append(remaining_demand)
                     else:
                         # 前倒し不可 - 積み残し
@@ -447,8 +1158,8 @@ class TransportPlanner:
                 else:
                     # 全く積載できなかった - 前倒し候補
                     if demand.get('can_advance', False):
-                        demand['is_advanced'] = True
-                        demand['loading_date'] = prev_date
+                        demand.is_advanced = True
+                        demand.loading_date = prev_date
                         demands_to_forward.append(demand)
                     else:
                         # 前倒し不可 - そのまま残す（警告は後で出る）
@@ -460,6 +1171,249 @@ class TransportPlanner:
             adjusted_demands[current_date_str] = remaining_demands
         return adjusted_demands
 
+    @staticmethod
+    def _demand_products(demands_by_date) -> Tuple[Dict[int, Tuple[str, List[int]]], Dict[int, int]]:
+        """日別需要から製品ごとの (製品コード, truck_ids) と需要件数を集める"""
+        products = {}
+        demand_counts = defaultdict(int)
+        for demands in demands_by_date.values():
+            for demand in demands:
+                products.setdefault(demand['product_id'], (demand['product_code'], demand.get('truck_ids') or []))
+                demand_counts[demand['product_id']] += 1
+        return products, demand_counts
+
+    def _find_truck_groups(self, products, truck_map, use_non_default, demand_counts=None,
+                           link_code_substrings=False, extra_links=()) -> List[Dict[str, Any]]:
+        """
+        互いに影響しない製品×トラックのグループ（連結成分）を求める
+
+        次の関係をたどって同じグループにまとめる:
+        - 製品の truck_ids に含まれるトラック（未設定なら使用可能な全トラック）
+        - 製品を優先積載製品に指定しているトラック（需要の並び順が変わるため）
+        - 同じ製品コードの製品（並び順のキーが同じになるため）
+        - link_code_substrings=True のとき、製品コードが他の製品コードに含まれる製品
+          （Step4〜6 の積み残し警告の削除は製品コードの部分一致で行われるため）
+        - extra_links の (製品ID群, トラックID群)（フォールバック積載・特便など実行時に決まる関係）
+        Args:
+            products: {製品ID: (製品コード, truck_ids)}
+        Returns:
+            List[Dict]: product_ids, truck_ids（truck_map順）, demands（需要件数）
+        """
+        if use_non_default:
+            available_ids = list(truck_map.keys())
+        else:
+            available_ids = [tid for tid, t in truck_map.items() if t.get('default_use', False)]
+        available = set(available_ids)
+        demand_counts = demand_counts or {}
+        parent = {}
+
+        def find(node):
+            parent.setdefault(node, node)
+            while parent[node] != node:
+                parent[node] = parent[parent[node]]
+                node = parent[node]
+            return node
+
+        def union(a, b):
+            root_a, root_b = find(a), find(b)
+            if root_a != root_b:
+                parent[root_b] = root_a
+
+        code_nodes = {}
+        for product_id, (product_code, truck_ids) in products.items():
+            product_node = ('product', product_id)
+            union(code_nodes.setdefault(str(product_code), product_node), product_node)
+            for truck_id in truck_ids or available_ids:
+                if truck_id in available:
+                    union(product_node, ('truck', truck_id))
+        for truck_id in available_ids:
+            for product_code in self._get_priority_products(truck_map[truck_id]):
+                if str(product_code) in code_nodes:
+                    union(code_nodes[str(product_code)], ('truck', truck_id))
+        if link_code_substrings:
+            self._link_code_substrings(code_nodes, union)
+        for product_ids, truck_ids in extra_links:
+            nodes = [('product', pid) for pid in product_ids if pid in products]
+            nodes += [('truck', tid) for tid in truck_ids if tid in truck_map]
+            for node in nodes[1:]:
+                union(nodes[0], node)
+
+        groups = {}
+        for node in list(parent):
+            kind, key = node
+            if kind != 'product':
+                continue
+            group = groups.setdefault(find(node), {'product_ids': set(), 'truck_ids': [], 'demands': 0})
+            group['product_ids'].add(key)
+            group['demands'] += demand_counts.get(key, 0)
+        for truck_id in truck_map:
+            node = ('truck', truck_id)
+            if node in parent and find(node) in groups:
+                groups[find(node)]['truck_ids'].append(truck_id)
+        return list(groups.values())
+
+    @staticmethod
+    def _link_code_substrings(code_nodes, union):
+        """製品コードが他の製品コードの部分文字列になっている製品同士をまとめる"""
+        codes_by_length = defaultdict(set)
+        for code in code_nodes:
+            if code:
+                codes_by_length[len(code)].add(code)
+        # 数字だけのコードは警告文の「n容器=m個」にも一致しうるため全製品と連動させる
+        numeric_codes = [code for code in code_nodes if code.isdigit()]
+        if numeric_codes:
+            first = code_nodes[numeric_codes[0]]
+            for node in code_nodes.values():
+                union(first, node)
+            return
+        for code in code_nodes:
+            for length, shorter_codes in codes_by_length.items():
+                if length >= len(code):
+                    continue
+                for start in range(len(code) - length + 1):
+                    part = code[start:start + length]
+                    if part in shorter_codes:
+                        union(code_nodes[part], code_nodes[code])
+
+    def _create_daily_plans_by_group(self, adjusted_demands, truck_map, container_map, product_map,
+                                     use_non_default, working_dates) -> Optional[Dict[str, Dict]]:
+        """
+        Step3（グループ並列版）: グループごとに全営業日の日次積載計画をプロセスプールで作成し、
+        逐次版と同じ並び（トラックは truck_map 順、積み残し・警告は需要の優先度順）でマージする
+
+        フォールバック積載（used_truck_ids 外の低稼働率トラックへの積載）はグループをまたぐため、
+        起こりうる日（_fallback_risk_dates）は最初から並列に回さず全トラックで逐次計算する。
+        予測を外れてフォールバックが起きた日は、プール終了後に逐次で再計算する。
+        グループが1つしかない・並列に回せる需要が少ない・プール実行に失敗した場合は None（逐次版で計算）。
+        """
+        products, demand_counts = self._demand_products(adjusted_demands)
+        groups = self._find_truck_groups(products, truck_map, use_non_default, demand_counts)
+        risk_dates = self._fallback_risk_dates(adjusted_demands, groups, truck_map, use_non_default)
+        parallel_demand_count = sum(
+            len(demands) for date_str, demands in adjusted_demands.items() if date_str not in risk_dates
+        )
+        self.last_group_report = {
+            'groups': len(groups), 'workers': 0, 'serial_days': 0, 'risk_days': len(risk_dates)
+        }
+        workers = min(self.max_workers or os.cpu_count() or 1, len(groups))
+        if workers < 2 or parallel_demand_count < self.PARALLEL_MIN_DEMANDS:
+            return None
+
+        # 需要件数の多いグループから順に、合計件数が最も少ないワーカーへ割り当て
+        buckets = [{'product_ids': set(), 'truck_ids': set(), 'demands': 0} for _ in range(workers)]
+        for group in sorted(groups, key=lambda g: g['demands'], reverse=True):
+            bucket = min(buckets, key=lambda b: b['demands'])
+            bucket['product_ids'].update(group['product_ids'])
+            bucket['truck_ids'].update(group['truck_ids'])
+            bucket['demands'] += group['demands']
+        tasks = []
+        for bucket in buckets:
+            product_ids = bucket['product_ids']
+            demands_by_date = {}
+            for date_str, demands in adjusted_demands.items():
+                if date_str in risk_dates:
+                    continue
+                subset = [d for d in demands if d.product_id in product_ids]
+                if subset:
+                    demands_by_date[date_str] = subset
+            container_ids = {d.container_id for demands in demands_by_date.values() for d in demands}
+            tasks.append({
+                'demands': demands_by_date,
+                'truck_map': {tid: t for tid, t in truck_map.items() if tid in bucket['truck_ids']},
+                'container_map': {cid: c for cid, c in container_map.items() if cid in container_ids},
+                'product_map': {pid: row for pid, row in product_map.items() if pid in product_ids},
+                'use_non_default': use_non_default,
+                'working_dates': working_dates
+            })
+
+        print(f"\n⚡ Step3: {len(groups)}グループを{len(tasks)}プロセスで並列計算")
+        try:
+            with ProcessPoolExecutor(max_workers=len(tasks)) as executor:
+                results = list(executor.map(_plan_truck_group, tasks))
+        except Exception as e:
+            print(f"⚠️ グループ並列計算に失敗したため逐次計算に切り替えます: {e}")
+            return None
+
+        serial_dates = set(risk_dates)
+        for _, fallback_dates in results:
+            serial_dates.update(fallback_dates)
+        truck_order = {tid: index for index, tid in enumerate(truck_map)}
+        priority_trucks = self._priority_truck_by_code(
+            (tid, self._get_priority_products(t)) for tid, t in truck_map.items()
+            if use_non_default or t.get('default_use', False)
+        )
+        group_plans = {}
+        for working_date in working_dates:
+            date_str = working_date.strftime('%Y-%m-%d')
+            if not adjusted_demands.get(date_str):
+                continue
+            if date_str in serial_dates:
+                group_plans[date_str] = self._create_daily_loading_plan(
+                    adjusted_demands[date_str], truck_map, container_map, product_map,
+                    use_non_default, working_date
+                )
+                continue
+            trucks = []
+            remaining_pairs = []
+            for plans, _ in results:
+                plan = plans.get(date_str)
+                if not plan:
+                    continue
+                trucks.extend(plan['trucks'])
+                # 積み残し警告は remaining_demands と1対1で作られるので組にして並べ替える
+                remaining_pairs.extend(zip(plan['remaining_demands'], plan['warnings']))
+            trucks.sort(key=lambda truck_plan: truck_order[truck_plan['truck_id']])
+            remaining_pairs.sort(key=lambda pair: self._demand_priority(pair[0], priority_trucks))
+            group_plans[date_str] = {
+                'trucks': trucks,
+                'total_trips': len(trucks),
+                'warnings': [warning for _, warning in remaining_pairs],
+                'remaining_demands': [demand for demand, _ in remaining_pairs]
+            }
+        if serial_dates:
+            print(f"ℹ️ フォールバック積載が起こりうる・発生した{len(serial_dates)}日は逐次で計算しました"
+                  f"（事前判定 {len(risk_dates)}日）")
+        self.last_group_report.update({'workers': len(tasks), 'serial_days': len(serial_dates)})
+        return group_plans
+
+    def _fallback_risk_dates(self, adjusted_demands, groups, truck_map, use_non_default) -> set:
+        """
+        フォールバック積載が起こりうる日（グループ並列から外して逐次で計算する日）
+
+        日ごとに、グループ全体と、同じ truck_ids を持つ製品のまとまりのそれぞれについて、
+        需要の底面積の合計が使えるトラックの床面積 × PARALLEL_FALLBACK_LOAD_RATIO を超えるかを見る。
+        需要の底面積は段積み前の値なので、判定は安全側（逐次に回す日が多め）になる。
+        """
+        available = {
+            tid: (t['width'] * t['depth']) / 1_000_000 for tid, t in truck_map.items()
+            if use_non_default or t.get('default_use', False)
+        }
+        group_of = {}
+        group_capacity = []
+        for index, group in enumerate(groups):
+            for product_id in group['product_ids']:
+                group_of[product_id] = index
+            group_capacity.append(sum(available.get(tid, 0) for tid in group['truck_ids']))
+
+        risk_dates = set()
+        for date_str, demands in adjusted_demands.items():
+            group_area = defaultdict(float)
+            set_area = defaultdict(float)
+            for demand in demands:
+                area = demand.get('floor_area', 0) or 0
+                group_area[group_of.get(demand.product_id)] += area
+                truck_ids = frozenset(tid for tid in (demand.get('truck_ids') or []) if tid in available)
+                set_area[truck_ids or frozenset(available)] += area
+            if any(
+                index is None or area > group_capacity[index] * self.PARALLEL_FALLBACK_LOAD_RATIO
+                for index, area in group_area.items()
+            ) or any(
+                area > sum(available[tid] for tid in truck_ids) * self.PARALLEL_FALLBACK_LOAD_RATIO
+                for truck_ids, area in set_area.items()
+            ):
+                risk_dates.add(date_str)
+        return risk_dates
+
     def _create_daily_loading_plan(self, demands, truck_map, container_map, 
                                    product_map, use_non_default, current_date=None) -> Dict:
         """
@@ -479,17 +1433,14 @@ class TransportPlanner:
         truck_states = {}
         for truck_id, truck_info in available_trucks.items():
             truck_floor_area = (truck_info['width'] * truck_info['depth']) / 1_000_000
-            truck_states[truck_id] = {
-                'truck_id': truck_id,
-                'truck_name': truck_info['name'],
-                'truck_info': truck_info,
-                'loaded_items': [],
-                'remaining_floor_area': truck_floor_area,
-                'total_floor_area': truck_floor_area,
-                'loaded_container_ids': set(),
-                'priority_products': self._get_priority_products(truck_info),
-                'is_default': truck_info.get('default_use', False)
-            }
+            truck_states[truck_id] = TruckState(
+                truck_id=truck_id,
+                truck_name=truck_info['name'],
+                truck_info=truck_info,
+                floor_area=truck_floor_area,
+                priority_products=self._get_priority_products(truck_info),
+                is_default=truck_info.get('default_use', False)
+            )
         # 製品を優先度順にソート
         sorted_demands = self._sort_demands_by_priority(demands, truck_states)
         
@@ -500,15 +1451,15 @@ class TransportPlanner:
             arrival_day_offset = truck_info.get('arrival_day_offset', 0)
             # 翌日到着のトラックは当日納期の製品には使用不可
             if arrival_day_offset > 0:
-                state['unavailable_for_same_day'] = True
+                state.unavailable_for_same_day = True
             filtered_truck_states[truck_id] = state
             
         # 各製品を適切なトラックに積載
         for demand in sorted_demands:
             loaded = False
             # ✅ 元の総注文数量を保存（検証用）
-            original_total_quantity = demand['total_quantity']
-            original_num_containers = demand['num_containers']
+            original_total_quantity = demand.total_quantity
+            original_num_containers = demand.num_containers
             # 製品のトラック制約を取得
             allowed_truck_ids = demand.get('truck_ids', [])
             if not allowed_truck_ids:
@@ -536,29 +1487,28 @@ class TransportPlanner:
             remaining_demand = demand.copy()
             # ✅ 改善: 複数トラックへの分割積載を積極的に試みる
             for truck_id in candidate_trucks:
-                if remaining_demand['num_containers'] <= 0:
+                if remaining_demand.num_containers <= 0:
                     # 全量積載完了
                     break
                 truck_state = truck_states[truck_id]
                 truck_info = truck_map[truck_id]
-                container_id = remaining_demand['container_id']
+                container_id = remaining_demand.container_id
                 
                 # 納期チェック（シンプル化：current_dateから到着可能かのみチェック）
                 demand_delivery_date = remaining_demand.get('delivery_date')
                 if not self._can_arrive_on_time(truck_info, current_date, demand_delivery_date):
                     continue
                 # 同じ容器が既に積載されているか確認（段積み統合用）
-                same_container_items = [item for item in truck_state['loaded_items'] 
-                                       if item['container_id'] == container_id]
-                if same_container_items:
+                same_container = truck_state.load.get(container_id)
+                if same_container is not None:
                     # 同じ容器が既にある場合、段積みとして統合できるか確認
                     container = container_map.get(container_id)
                     if container and getattr(container, 'stackable', False):
                         max_stack = getattr(container, 'max_stack', 1)
                         floor_area_per_container = (container.width * container.depth) / 1_000_000
-                        # 既存の容器数を計算（同じ容器IDの全製品）
-                        existing_containers = sum(item['num_containers'] for item in same_container_items)
-                        new_total_containers = existing_containers + remaining_demand['num_containers']
+                        # 既存の容器数（同じ容器IDの全製品、集計済み）
+                        existing_containers = same_container.count
+                        new_total_containers = existing_containers + remaining_demand.num_containers
                         # 既存の配置数
                         existing_stacks = (existing_containers + max_stack - 1) // max_stack
                         # 新しい配置数
@@ -566,42 +1516,42 @@ class TransportPlanner:
                         # 追加で必要な配置数
                         additional_stacks = new_stacks - existing_stacks
                         additional_floor_area = additional_stacks * floor_area_per_container
-                        if additional_floor_area <= truck_state['remaining_floor_area']:
+                        if additional_floor_area <= truck_state.remaining_floor_area:
                             # 段積みとして統合可能
-                            truck_state['loaded_items'].append(remaining_demand)
-                            truck_state['remaining_floor_area'] -= additional_floor_area
+                            truck_state.add_item(remaining_demand.to_loaded_item())
+                            truck_state.remaining_floor_area -= additional_floor_area
                             loaded = True
                             break
                 # 通常の積載チェック
-                if remaining_demand['floor_area'] <= truck_state['remaining_floor_area']:
+                if remaining_demand.floor_area <= truck_state.remaining_floor_area:
                     # 全量積載可能
-                    loaded_item = remaining_demand.copy()
+                    loaded_item = remaining_demand.to_loaded_item()
                     # ✅ 数量の整合性を確認
-                    expected_quantity = min(loaded_item['num_containers'] * loaded_item['capacity'] - loaded_item['surplus'], # 直した
+                    expected_quantity = min(loaded_item.num_containers * loaded_item.capacity - loaded_item.surplus, # 直した
                                          original_total_quantity)
-                    if loaded_item['total_quantity'] != expected_quantity:
-                        print(f"      🔄 数量を補正: {loaded_item['total_quantity']} → {expected_quantity}")
-                        loaded_item['total_quantity'] = expected_quantity
-                    truck_state['loaded_items'].append(loaded_item)
-                    truck_state['remaining_floor_area'] -= remaining_demand['floor_area']
-                    truck_state['loaded_container_ids'].add(remaining_demand['container_id'])
+                    if loaded_item.total_quantity != expected_quantity:
+                        print(f"      🔄 数量を補正: {loaded_item.total_quantity} → {expected_quantity}")
+                        loaded_item.total_quantity = expected_quantity
+                    truck_state.add_item(loaded_item)
+                    truck_state.remaining_floor_area -= remaining_demand.floor_area
+                    truck_state.loaded_container_ids.add(remaining_demand.container_id)
                     loaded = True
-                    remaining_demand['num_containers'] = 0
+                    remaining_demand.num_containers = 0
                     break
-                elif truck_state['remaining_floor_area'] > 0:
+                elif truck_state.remaining_floor_area > 0:
                     # 一部積載可能（分割）
-                    container = container_map.get(remaining_demand['container_id'])
+                    container = container_map.get(remaining_demand.container_id)
                     if container:
                         floor_area_per_container = (container.width * container.depth) / 1_000_000
                         max_stack = getattr(container, 'max_stack', 1)
                         # 段積み考慮で積載可能な容器数を計算
                         if max_stack > 1 and getattr(container, 'stackable', False):
-                            max_stacks = int(truck_state['remaining_floor_area'] / floor_area_per_container)
+                            max_stacks = int(truck_state.remaining_floor_area / floor_area_per_container)
                             loadable_containers = max_stacks * max_stack
                         else:
-                            loadable_containers = int(truck_state['remaining_floor_area'] / floor_area_per_container)
-                        if loadable_containers > 0 and loadable_containers < remaining_demand['num_containers']:
-                            print(f"\n📊 製品{remaining_demand['product_code']}の分割積載計算:")
+                            loadable_containers = int(truck_state.remaining_floor_area / floor_area_per_container)
+                        if loadable_containers > 0 and loadable_containers < remaining_demand.num_containers:
+                            print(f"\n📊 製品{remaining_demand.product_code}の分割積載計算:")
                             
                             # 分割積載の数量計算 - より正確な実装
                             capacity = remaining_demand.get('capacity', 1)
@@ -646,69 +1596,71 @@ class TransportPlanner:
                                 loadable_floor_area = floor_area_per_container * loadable_containers
                             
                             # ✅ 数量の整合性チェックと補正
-                            calculated_quantity = loadable_containers * demand['capacity']
+                            calculated_quantity = loadable_containers * demand.capacity
                             actual_quantity = min(calculated_quantity, original_demand_quantity)
                             if calculated_quantity != actual_quantity:
                                 print(f"      🔄 積載数量を補正: {calculated_quantity} → {actual_quantity}")
                             
                             # ✅ 分割して積載（loaded_itemとして追加）
-                            actual_quantity = min(loadable_containers * capacity - demand['surplus'], original_demand_quantity - demand['surplus']) # 直した
-                            loaded_item = {
-                                'product_id': demand['product_id'],
-                                'product_code': demand['product_code'],
-                                'product_name': demand['product_name'],
-                                'container_id': demand['container_id'],
-                                'container_name': container.name,
-                                'num_containers': loadable_containers,  # ← 積載できた容器数
-                                'total_quantity': actual_quantity,     # ✅ 注文数量を超えない
-                                'floor_area': loadable_floor_area,
-                                'floor_area_per_container': floor_area_per_container,
-                                'delivery_date': demand['delivery_date'],
-                                'loading_date': demand.get('loading_date'),
-                                'capacity': capacity,
-                                'remainder': demand.get('remainder', 0),
-                                'surplus': demand.get('surplus', 0),
-                                'can_advance': demand.get('can_advance', False),
-                                'is_advanced': demand.get('is_advanced', False),
-                                'truck_ids': demand.get('truck_ids', []),
-                                'stackable': getattr(container, 'stackable', False),
-                                'max_stack': max_stack
-                            }
+                            actual_quantity = min(loadable_containers * capacity - demand.surplus, original_demand_quantity - demand.surplus) # 直した
+                            loaded_item = LoadedItem(
+                                product_id=demand.product_id,
+                                product_code=demand.product_code,
+                                product_name=demand.product_name,
+                                container_id=demand.container_id,
+                                container_name=container.name,
+                                num_containers=loadable_containers,  # ← 積載できた容器数
+                                total_quantity=actual_quantity,     # ✅ 注文数量を超えない
+                                floor_area=loadable_floor_area,
+                                floor_area_per_container=floor_area_per_container,
+                                delivery_date=demand.delivery_date,
+                                loading_date=demand.get('loading_date'),
+                                capacity=capacity,
+                                remainder=demand.get('remainder', 0),
+                                surplus=demand.get('surplus', 0),
+                                can_advance=demand.get('can_advance', False),
+                                is_advanced=demand.get('is_advanced', False),
+                                truck_ids=demand.get('truck_ids', []),
+                                stackable=getattr(container, 'stackable', False),
+                                max_stack=max_stack
+                            )
                             # ✅ 検証: 数量が容器数×容量と元の注文数量の小さい方と一致するか確認
-                            expected_quantity = min(loaded_item['num_containers'] * capacity - loaded_item['surplus'], original_demand_quantity - loaded_item['surplus']) # 直した
-                            #assert loaded_item['total_quantity'] == expected_quantity, \
-                            #    f"数量計算エラー: {loaded_item['total_quantity']} != {expected_quantity}"
-                            truck_state['loaded_items'].append(loaded_item)
-                            truck_state['remaining_floor_area'] -= loadable_floor_area
-                            truck_state['loaded_container_ids'].add(demand['container_id'])
+                            expected_quantity = min(loaded_item.num_containers * capacity - loaded_item.surplus, original_demand_quantity - loaded_item.surplus) # 直した
+                            #assert loaded_item.total_quantity == expected_quantity, \
+                            #    f"数量計算エラー: {loaded_item.total_quantity} != {expected_quantity}"
+                            truck_state.add_item(loaded_item)
+                            truck_state.remaining_floor_area -= loadable_floor_area
+                            truck_state.loaded_container_ids.add(demand.container_id)
                             # ✅ 残りを更新（必ず容器数ベースで再計算）
-                            remaining_demand['num_containers'] -= loadable_containers
-                            remaining_demand['total_quantity'] = remaining_demand['num_containers'] * demand['capacity'] - remaining_demand['surplus'] # 直した
-                            remaining_demand['floor_area'] -= loadable_floor_area
+                            remaining_demand.num_containers -= loadable_containers
+                            remaining_demand.total_quantity = remaining_demand.num_containers * demand.capacity - remaining_demand.surplus # 直した
+                            remaining_demand.floor_area -= loadable_floor_area
                             # ✅ 検証: 残り数量が元の総数量を超えていないか確認
-                            # assert remaining_demand['total_quantity'] <= original_total_quantity, \
-                            #     f"残り数量エラー: {remaining_demand['total_quantity']} > {original_total_quantity}"
+                            # assert remaining_demand.total_quantity <= original_total_quantity, \
+                            #     f"残り数量エラー: {remaining_demand.total_quantity} > {original_total_quantity}"
                             # デバッグログ
-                            print(f"      ✅ トラックID {truck_id}に分割積載成功（{loadable_containers}容器={loadable_containers * demand['capacity']}個, 残り={remaining_demand['num_containers']}容器={remaining_demand['total_quantity']}個）")
+                            print(f"      ✅ トラックID {truck_id}に分割積載成功（{loadable_containers}容器={loadable_containers * demand.capacity}個, 残り={remaining_demand.num_containers}容器={remaining_demand.total_quantity}個）")
                             # 次のトラックへ継続（まだ残りがあれば）
-                            if remaining_demand['num_containers'] > 0:   # ここまで直した
+                            if remaining_demand.num_containers > 0:   # ここまで直した
                                 continue
                             else:
                                 loaded = True
                                 break
             # ✅ フォールバック: 低稼働率トラックへの再配置
-            if not loaded and remaining_demand['num_containers'] > 0:
+            if not loaded and remaining_demand.num_containers > 0:
+                # used_truck_ids 外のトラックも候補になるため、グループ並列・差分再計算で連動扱いにする
+                self._fallback_product_ids.append(demand.product_id)
                 low_utilization_threshold = 0.7
                 fallback_candidates = [
                     state for state in truck_states.values()
-                    if state['total_floor_area'] > 0 and
-                    (1 - state['remaining_floor_area'] / state['total_floor_area']) < low_utilization_threshold
+                    if state.total_floor_area > 0 and
+                    (1 - state.remaining_floor_area / state.total_floor_area) < low_utilization_threshold
                 ]
-                fallback_candidates.sort(key=lambda s: s['remaining_floor_area'], reverse=True)
+                fallback_candidates.sort(key=lambda s: s.remaining_floor_area, reverse=True)
                 for truck_state in fallback_candidates:
-                    if remaining_demand['num_containers'] <= 0:
+                    if remaining_demand.num_containers <= 0:
                         break
-                    candidate_container = container_map.get(remaining_demand['container_id'])
+                    candidate_container = container_map.get(remaining_demand.container_id)
                     if not candidate_container:
                         continue
                     floor_area_per_container = (candidate_container.width * candidate_container.depth) / 1_000_000
@@ -716,7 +1668,7 @@ class TransportPlanner:
                         continue
                     max_stack = getattr(candidate_container, 'max_stack', 1)
                     stackable = getattr(candidate_container, 'stackable', False)
-                    available_area = truck_state['remaining_floor_area']
+                    available_area = truck_state.remaining_floor_area
                     if available_area <= 0:
                         continue
                     if stackable and max_stack > 1:
@@ -729,7 +1681,7 @@ class TransportPlanner:
                         loadable_floor_area = loadable_containers * floor_area_per_container
                     if loadable_containers <= 0:
                         continue
-                    loadable_containers = min(loadable_containers, remaining_demand['num_containers'])
+                    loadable_containers = min(loadable_containers, remaining_demand.num_containers)
                     capacity = remaining_demand.get('capacity', 1)
                     # ✅ 数量は必ず「容器数×容量」で計算
                     loadable_quantity = loadable_containers * capacity
@@ -738,93 +1690,72 @@ class TransportPlanner:
                         loadable_floor_area = floor_area_per_container * stacked
                     else:
                         loadable_floor_area = floor_area_per_container * loadable_containers
-                    fallback_item = {
-                        'product_id': remaining_demand['product_id'],
-                        'product_code': remaining_demand['product_code'],
-                        'product_name': remaining_demand.get('product_name', ''),
-                        'container_id': remaining_demand['container_id'],
-                        'container_name': candidate_container.name,
-                        'num_containers': loadable_containers,
-                        'remainder': demand.get('remainder', 0),
-                        'surplus': demand.get('surplus', 0),
-                        'total_quantity': loadable_containers * demand['capacity'] - demand['surplus'],  # ✅ 必ず「容器数×容量」-余りで計算 直した
-                        'floor_area': loadable_floor_area,
-                        'floor_area_per_container': floor_area_per_container,
-                        'delivery_date': remaining_demand['delivery_date'],
-                        'loading_date': remaining_demand.get('loading_date'),
-                        'capacity': capacity,
-                        'can_advance': remaining_demand.get('can_advance', False),
-                        'is_advanced': remaining_demand.get('is_advanced', False),
-                        'truck_ids': remaining_demand.get('truck_ids', []),
-                        'stackable': stackable,
-                        'max_stack': max_stack
-                    }
+                    fallback_item = LoadedItem(
+                        product_id=remaining_demand.product_id,
+                        product_code=remaining_demand.product_code,
+                        product_name=remaining_demand.get('product_name', ''),
+                        container_id=remaining_demand.container_id,
+                        container_name=candidate_container.name,
+                        num_containers=loadable_containers,
+                        remainder=demand.get('remainder', 0),
+                        surplus=demand.get('surplus', 0),
+                        total_quantity=loadable_containers * demand.capacity - demand.surplus,  # ✅ 必ず「容器数×容量」-余りで計算 直した
+                        floor_area=loadable_floor_area,
+                        floor_area_per_container=floor_area_per_container,
+                        delivery_date=remaining_demand.delivery_date,
+                        loading_date=remaining_demand.get('loading_date'),
+                        capacity=capacity,
+                        can_advance=remaining_demand.get('can_advance', False),
+                        is_advanced=remaining_demand.get('is_advanced', False),
+                        truck_ids=remaining_demand.get('truck_ids', []),
+                        stackable=stackable,
+                        max_stack=max_stack
+                    )
                     # ✅ 検証
-                    # assert fallback_item['total_quantity'] == fallback_item['num_containers'] * capacity, \
-                    #     f"フォールバック数量計算エラー: {fallback_item['total_quantity']} != {fallback_item['num_containers']} * {capacity}"
-                    truck_state['loaded_items'].append(fallback_item)
-                    truck_state['remaining_floor_area'] -= loadable_floor_area
-                    truck_state['loaded_container_ids'].add(remaining_demand['container_id'])
-                    remaining_demand['num_containers'] -= loadable_containers
-                    remaining_demand['total_quantity'] = remaining_demand['num_containers'] * demand['capacity'] - demand['surplus']  # ✅ new 直した
-                    remaining_demand['floor_area'] -= loadable_floor_area
+                    # assert fallback_item.total_quantity == fallback_item.num_containers * capacity, \
+                    #     f"フォールバック数量計算エラー: {fallback_item.total_quantity} != {fallback_item.num_containers} * {capacity}"
+                    truck_state.add_item(fallback_item)
+                    truck_state.remaining_floor_area -= loadable_floor_area
+                    truck_state.loaded_container_ids.add(remaining_demand.container_id)
+                    remaining_demand.num_containers -= loadable_containers
+                    remaining_demand.total_quantity = remaining_demand.num_containers * demand.capacity - demand.surplus  # ✅ new 直した
+                    remaining_demand.floor_area -= loadable_floor_area
                     # ✅ 検証
-                    # assert remaining_demand['total_quantity'] <= original_total_quantity, \
-                    #     f"フォールバック残り数量エラー: {remaining_demand['total_quantity']} > {original_total_quantity}"
+                    # assert remaining_demand.total_quantity <= original_total_quantity, \
+                    #     f"フォールバック残り数量エラー: {remaining_demand.total_quantity} > {original_total_quantity}"
                     loaded = True
-                if remaining_demand['num_containers'] > 0:
-                    print(f"      ⚠️ {demand['product_code']}: 積み残し {remaining_demand['num_containers']}容器={remaining_demand['total_quantity']}個")
+                if remaining_demand.num_containers > 0:
+                    print(f"      ⚠️ {demand.product_code}: 積み残し {remaining_demand.num_containers}容器={remaining_demand.total_quantity}個")
                     # ✅ 最終検証: 積み残し数量が正しいか確認
-                    expected_remaining_quantity = remaining_demand['num_containers'] * remaining_demand['capacity'] - remaining_demand['surplus']  # 直した
-                    if remaining_demand['total_quantity'] != expected_remaining_quantity:
-                        print(f"      🚨 数量不整合を検出！修正します: {remaining_demand['total_quantity']} → {expected_remaining_quantity}")
-                        remaining_demand['total_quantity'] = expected_remaining_quantity
+                    expected_remaining_quantity = remaining_demand.num_containers * remaining_demand.capacity - remaining_demand.surplus  # 直した
+                    if remaining_demand.total_quantity != expected_remaining_quantity:
+                        print(f"      🚨 数量不整合を検出！修正します: {remaining_demand.total_quantity} → {expected_remaining_quantity}")
+                        remaining_demand.total_quantity = expected_remaining_quantity
                     remaining_demands.append(remaining_demand)
         # トラックプランを作成（積載があるトラックのみ）
         final_truck_plans = []
         for truck_id, truck_state in truck_states.items():
-            if truck_state['loaded_items']:
+            if truck_state.loaded_items:
                 # ✅ 各loaded_itemの数量を検証
-                for item in truck_state['loaded_items']:
-                    expected_quantity = item['num_containers'] * item.get('capacity', 1)- item.get('surplus', 0) # 直した
+                for item in truck_state.loaded_items:
+                    expected_quantity = item.num_containers * item.get('capacity', 1)- item.get('surplus', 0) # 直した
                      # 検証
-                    if item['total_quantity'] != expected_quantity:
-                        print(f"      🚨 積載明細の数量不整合を検出！修正します: {item.get('product_code', 'unknown')} {item['total_quantity']} → {expected_quantity}")
-                        item['total_quantity'] = expected_quantity
-                # 積載率を計算（容器別に段積み考慮）
-                container_totals = {}  # container_id -> 容器数の合計
-                # 容器別に集計
-                for item in truck_state['loaded_items']:
-                    container_id = item['container_id']
-                    if container_id not in container_totals:
-                        container_totals[container_id] = {
-                            'num_containers': 0,
-                            'floor_area_per_container': item['floor_area_per_container'],
-                            'stackable': item.get('stackable', False),
-                            'max_stack': item.get('max_stack', 1)
-                        }
-                    container_totals[container_id]['num_containers'] += item['num_containers']
-                # 容器別に底面積を計算
-                total_loaded_area = 0
-                for container_id, info in container_totals.items():
-                    if info['stackable'] and info['max_stack'] > 1:
-                        # 段積み可能
-                        stacked_containers = (info['num_containers'] + info['max_stack'] - 1) // info['max_stack']
-                        container_area = info['floor_area_per_container'] * stacked_containers
-                    else:
-                        # 段積みなし
-                        container_area = info['floor_area_per_container'] * info['num_containers']
-                    total_loaded_area += container_area
-                utilization_rate = round(total_loaded_area / truck_state['total_floor_area'] * 100, 1)
+                    if item.total_quantity != expected_quantity:
+                        print(f"      🚨 積載明細の数量不整合を検出！修正します: {item.get('product_code', 'unknown')} {item.total_quantity} → {expected_quantity}")
+                        item.total_quantity = expected_quantity
+                # 積載率を計算（容器別集計から段積み考慮の底面積を取得）
+                total_loaded_area = truck_state.load.loaded_area()
+                utilization_rate = round(total_loaded_area / truck_state.total_floor_area * 100, 1)
                 truck_plan = {
                     'truck_id': truck_id,
-                    'truck_name': truck_state['truck_name'],
-                    'loaded_items': truck_state['loaded_items'],
+                    'truck_name': truck_state.truck_name,
+                    'loaded_items': truck_state.loaded_items,
                     'utilization': {
                         'floor_area_rate': utilization_rate,
                         'volume_rate': utilization_rate,
                         'weight_rate': 0
-                    }
+                    },
+                    '_load': truck_state.load  # 容器別集計（返却前に除去）
                 }
                 final_truck_plans.append(truck_plan)
         # 積み残し警告
@@ -835,15 +1766,15 @@ class TransportPlanner:
                 if is_final_day_overflow:
                     # 最終日の容量オーバー - 特別警告
                     warnings.append(
-                        f"🚨 最終日容量オーバー: {demand['product_code']} ({demand['num_containers']}容器={demand['total_quantity']}個) ※非デフォルトトラック追加が必要"
+                        f"🚨 最終日容量オーバー: {demand.product_code} ({demand.num_containers}容器={demand.total_quantity}個) ※非デフォルトトラック追加が必要"
                     )
                 elif can_advance:
                     warnings.append(
-                        f"⚠ 積み残し: {demand['product_code']} ({demand['num_containers']}容器={demand['total_quantity']}個) ※前倒し配送可能"
+                        f"⚠ 積み残し: {demand.product_code} ({demand.num_containers}容器={demand.total_quantity}個) ※前倒し配送可能"
                     )
                 else:
                     warnings.append(
-                        f"❌ 積み残し: {demand['product_code']} ({demand['num_containers']}容器={demand['total_quantity']}個) ※前倒し不可"
+                        f"❌ 積み残し: {demand.product_code} ({demand.num_containers}容器={demand.total_quantity}個) ※前倒し不可"
                     )
         return {
             'trucks': final_truck_plans,
@@ -869,26 +1800,39 @@ class TransportPlanner:
         4. トラック制約がある製品
         5. その他
         """
-        def get_priority(demand):
-            product_code = demand['product_code']
-            truck_ids = demand.get('truck_ids', [])
-            is_advanced = demand.get('is_advanced', False)
-            # 1. 前倒しされた製品（最優先）
-            if is_advanced:
-                return (0, truck_ids[0] if truck_ids else 0, product_code)
-            # 2. トラック制約が1つのみの製品
-            if truck_ids and len(truck_ids) == 1:
-                return (1, truck_ids[0], product_code)
-            # 3. 優先積載製品に指定されている場合
-            for truck_id, truck_state in truck_states.items():
-                if product_code in truck_state['priority_products']:
-                    return (2, truck_id, product_code)
-            # 4. トラック制約がある場合
-            if truck_ids:
-                return (3, truck_ids[0], product_code)
-            # 5. その他
-            return (4, 0, product_code)
-        return sorted(demands, key=get_priority)
+        priority_trucks = self._priority_truck_by_code(
+            (truck_id, truck_state.priority_products) for truck_id, truck_state in truck_states.items()
+        )
+        return sorted(demands, key=lambda demand: self._demand_priority(demand, priority_trucks))
+
+    @staticmethod
+    def _priority_truck_by_code(truck_priority_products) -> Dict[str, int]:
+        """製品コード → その製品を優先積載に指定している最初のトラックID"""
+        priority_trucks = {}
+        for truck_id, product_codes in truck_priority_products:
+            for product_code in product_codes:
+                priority_trucks.setdefault(product_code, truck_id)
+        return priority_trucks
+
+    @staticmethod
+    def _demand_priority(demand, priority_trucks) -> Tuple:
+        """_sort_demands_by_priority のソートキー"""
+        product_code = demand.product_code
+        truck_ids = demand.get('truck_ids', [])
+        # 1. 前倒しされた製品（最優先）
+        if demand.get('is_advanced', False):
+            return (0, truck_ids[0] if truck_ids else 0, product_code)
+        # 2. トラック制約が1つのみの製品
+        if truck_ids and len(truck_ids) == 1:
+            return (1, truck_ids[0], product_code)
+        # 3. 優先積載製品に指定されている場合
+        if product_code in priority_trucks:
+            return (2, priority_trucks[product_code], product_code)
+        # 4. トラック制約がある場合
+        if truck_ids:
+            return (3, truck_ids[0], product_code)
+        # 5. その他
+        return (4, 0, product_code)
 
     def _sort_candidate_trucks(self, candidate_trucks, demand, truck_states, truck_map, current_date=None):
         """候補トラックを優先順位でソート
@@ -899,8 +1843,8 @@ class TransportPlanner:
         3. 同容器が既に積載されている
         4. 空き容量が大きい
         """
-        product_code = demand['product_code']
-        container_id = demand['container_id']
+        product_code = demand.product_code
+        container_id = demand.container_id
         truck_ids = demand.get('truck_ids', [])
         delivery_date = demand.get('delivery_date')
         def get_truck_priority(truck_id):
@@ -918,20 +1862,19 @@ class TransportPlanner:
             else:
                 truck_priority_index = 9999  # リストにない場合は低優先度
             # 2. 優先積載製品に指定されている
-            if product_code in truck_state['priority_products']:
+            if product_code in truck_state.priority_products:
                 priority_product_flag = 0
             else:
                 priority_product_flag = 1
             # 3. 同容器が既に積載されている
-            if container_id in truck_state['loaded_container_ids']:
+            if container_id in truck_state.loaded_container_ids:
                 same_container_flag = 0
             else:
                 same_container_flag = 1
             # 4. 空き容量（大きい方が優先）
-            remaining_area = truck_state['remaining_floor_area']
+            remaining_area = truck_state.remaining_floor_area
             # 5. 現在の利用率（低い方を優先）
-            utilized_area = truck_state['total_floor_area'] - truck_state['remaining_floor_area']
-            utilization_rate = utilized_area / truck_state['total_floor_area'] if truck_state['total_floor_area'] else 0
+            utilization_rate = truck_state.utilization
             return (
                 truck_priority_index,
                 priority_product_flag,
@@ -1032,26 +1975,8 @@ class TransportPlanner:
                         break
                 # トラックプランが存在する場合、残り容量を計算
                 if target_truck_plan:
-                    # 既存の積載量を計算
-                    loaded_area = 0
-                    container_totals = {}
-                    for item in target_truck_plan['loaded_items']:
-                        container_id = item['container_id']
-                        if container_id not in container_totals:
-                            container_totals[container_id] = {
-                                'num_containers': 0,
-                                'floor_area_per_container': item['floor_area_per_container'],
-                                'stackable': item.get('stackable', False),
-                                'max_stack': item.get('max_stack', 1)
-                            }
-                        container_totals[container_id]['num_containers'] += item['num_containers']
-                    for container_id, info in container_totals.items():
-                        if info['stackable'] and info['max_stack'] > 1:
-                            stacked_containers = (info['num_containers'] + info['max_stack'] - 1) // info['max_stack']
-                            container_area = info['floor_area_per_container'] * stacked_containers
-                        else:
-                            container_area = info['floor_area_per_container'] * info['num_containers']
-                        loaded_area += container_area
+                    # 既存の積載量（容器別集計から取得）
+                    loaded_area = self._get_truck_load(target_truck_plan).loaded_area()
                     remaining_area = truck_floor_area - loaded_area
                 else:
                     # トラックプランが存在しない場合、全容量が空き
@@ -1060,7 +1985,7 @@ class TransportPlanner:
                 if demand['floor_area'] <= remaining_area:
                     # 積載可能！
                     print(f"      ✅ 再配置成功: トラックID {truck_id}, 日付 {target_date_str}")
-                    loaded_item = demand.copy()
+                    loaded_item = demand.to_loaded_item()
                     loaded_item['loading_date'] = target_date
                     # ✅ 数量検証
                     expected_quantity = loaded_item['num_containers'] * loaded_item['capacity']
@@ -1071,7 +1996,7 @@ class TransportPlanner:
                         loaded_item.setdefault('original_date', original_loading_date)
                     if target_truck_plan:
                         # 既存のトラックプランに追加
-                        target_truck_plan['loaded_items'].append(loaded_item)
+                        self._add_to_truck_plan(target_truck_plan, loaded_item)
                         # 積載率を再計算
                         new_loaded_area = loaded_area + demand['floor_area']
                         new_utilization_rate = round(new_loaded_area / truck_floor_area * 100, 1)
@@ -1088,7 +2013,8 @@ class TransportPlanner:
                                 'floor_area_rate': new_utilization_rate,
                                 'volume_rate': new_utilization_rate,
                                 'weight_rate': 0
-                            }
+                            },
+                            '_load': TruckLoad.from_items([loaded_item])
                         }
                         day_plan['trucks'].append(new_truck_plan)
                         day_plan['total_trips'] += 1
@@ -1174,25 +2100,7 @@ class TransportPlanner:
                             break
                     # 残り容量を計算
                     if target_truck_plan:
-                        loaded_area = 0
-                        container_totals = {}
-                        for item in target_truck_plan['loaded_items']:
-                            container_id = item['container_id']
-                            if container_id not in container_totals:
-                                container_totals[container_id] = {
-                                    'num_containers': 0,
-                                    'floor_area_per_container': item['floor_area_per_container'],
-                                    'stackable': item.get('stackable', False),
-                                    'max_stack': item.get('max_stack', 1)
-                                }
-                            container_totals[container_id]['num_containers'] += item['num_containers']
-                        for container_id, info in container_totals.items():
-                            if info['stackable'] and info['max_stack'] > 1:
-                                stacked_containers = (info['num_containers'] + info['max_stack'] - 1) // info['max_stack']
-                                container_area = info['floor_area_per_container'] * stacked_containers
-                            else:
-                                container_area = info['floor_area_per_container'] * info['num_containers']
-                            loaded_area += container_area
+                        loaded_area = self._get_truck_load(target_truck_plan).loaded_area()
                         remaining_area = truck_floor_area - loaded_area
                     else:
                         # トラックプランが存在しない場合、新規作成が必要
@@ -1211,29 +2119,30 @@ class TransportPlanner:
                                 'truck_id': truck_id,
                                 'truck_name': truck_info['name'],
                                 'loaded_items': [],
-                                'utilization': {'floor_area_rate': 0, 'volume_rate': 0, 'weight_rate': 0}
+                                'utilization': {'floor_area_rate': 0, 'volume_rate': 0, 'weight_rate': 0},
+                                '_load': TruckLoad()
                             }
                             prev_plan['trucks'].append(target_truck_plan)
                             prev_plan['total_trips'] = len(prev_plan['trucks'])
                         # ✅ アイテムを追加
                         capacity = demand['capacity']
                         expected_quantity = demand['num_containers'] * capacity
-                        target_truck_plan['loaded_items'].append({
-                            'product_id': demand['product_id'],
-                            'product_code': demand['product_code'],
-                            'product_name': demand.get('product_name', ''),
-                            'container_id': demand['container_id'],
-                            'container_name': container.name,
-                            'num_containers': demand['num_containers'],
-                            'total_quantity': expected_quantity,  # ✅ 必ず「容器数×容量」
-                            'floor_area_per_container': demand['floor_area'] / demand['num_containers'],
-                            'delivery_date': demand['delivery_date'],
-                            'loading_date': prev_date,
-                            'is_advanced': True,  # 前倒しフラグ
-                            'stackable': container.stackable,
-                            'max_stack': container.max_stack,
-                            'capacity': capacity
-                        })
+                        self._add_to_truck_plan(target_truck_plan, LoadedItem(
+                            product_id=demand['product_id'],
+                            product_code=demand['product_code'],
+                            product_name=demand.get('product_name', ''),
+                            container_id=demand['container_id'],
+                            container_name=container.name,
+                            num_containers=demand['num_containers'],
+                            total_quantity=expected_quantity,  # ✅ 必ず「容器数×容量」
+                            floor_area_per_container=demand['floor_area'] / demand['num_containers'],
+                            delivery_date=demand['delivery_date'],
+                            loading_date=prev_date,
+                            is_advanced=True,  # 前倒しフラグ
+                            stackable=container.stackable,
+                            max_stack=container.max_stack,
+                            capacity=capacity
+                        ))
                         # 積載率を再計算
                         self._recalculate_utilization(target_truck_plan, truck_info, container_map)
                         # 前倒し成功を記録
@@ -1261,45 +2170,39 @@ class TransportPlanner:
         loaded_area = 0
         loaded_volume = 0
         loaded_weight = 0
-        container_totals = {}
-        # ✅ 数量検証しながら集計
+        # ✅ 数量検証
         for item in truck_plan['loaded_items']:
-            container_id = item['container_id']
-            # ✅ 数量検証
             expected_quantity = item['num_containers'] * item.get('capacity', 1)
             if item['total_quantity'] != expected_quantity:
                 print(f"      🚨 積載率計算時の数量不整合を修正: {item.get('product_code', 'unknown')} {item['total_quantity']} → {expected_quantity}")
                 item['total_quantity'] = expected_quantity
-            if container_id not in container_totals:
-                container = container_map.get(container_id)
-                if not container:
-                    continue
-                container_totals[container_id] = {
-                    'num_containers': 0,
-                    'floor_area_per_container': item['floor_area_per_container'],
-                    'volume_per_container': (container.width * container.depth * container.height) / 1_000_000_000,
-                    'weight_per_container': container.max_weight,
-                    'stackable': container.stackable,
-                    'max_stack': container.max_stack
-                }
-            container_totals[container_id]['num_containers'] += item['num_containers']
-        for container_id, info in container_totals.items():
-            if info['stackable'] and info['max_stack'] > 1:
-                # 段積み可能
-                stacked_containers = (info['num_containers'] + info['max_stack'] - 1) // info['max_stack']
-                container_area = info['floor_area_per_container'] * stacked_containers
-            else:
-                # 段積みなし
-                container_area = info['floor_area_per_container'] * info['num_containers']
-            loaded_area += container_area
-            loaded_volume += info['volume_per_container'] * info['num_containers']
-            loaded_weight += info['weight_per_container'] * info['num_containers']
+        # 容器別集計から底面積・体積・重量を算出（段積み可否は容器マスタを優先）
+        for container_id, entry in self._get_truck_load(truck_plan).containers.items():
+            container = container_map.get(container_id)
+            if not container:
+                continue
+            loaded_area += entry.floor_area(stackable=container.stackable, max_stack=container.max_stack)
+            loaded_volume += (container.width * container.depth * container.height) / 1_000_000_000 * entry.count
+            loaded_weight += container.max_weight * entry.count
         truck_plan['utilization'] = {
             'floor_area_rate': round(loaded_area / truck_floor_area * 100, 1) if truck_floor_area > 0 else 0,
             'volume_rate': round(loaded_volume / truck_volume * 100, 1) if truck_volume > 0 else 0,
             'weight_rate': round(loaded_weight / truck_max_weight * 100, 1) if truck_max_weight > 0 else 0
         }
 
+    def _get_truck_load(self, truck_plan) -> TruckLoad:
+        """トラックプランの容器別集計を取得（無ければ loaded_items から作成）"""
+        load = truck_plan.get('_load')
+        if load is None:
+            load = TruckLoad.from_items(truck_plan['loaded_items'])
+            truck_plan['_load'] = load
+        return load
+
+    def _add_to_truck_plan(self, truck_plan, item):
+        """トラックプランに積載明細を追加し、容器別集計も更新"""
+        self._get_truck_load(truck_plan).add_item(item)
+        truck_plan['loaded_items'].append(item)
+
     def _relocate_to_next_days(self, daily_plans, truck_map, container_map, 
                                working_dates, use_non_default):
         """
@@ -1348,25 +2251,7 @@ class TransportPlanner:
                             break
                     # 残り容量を計算
                     if target_truck_plan:
-                        loaded_area = 0
-                        container_totals = {}
-                        for item in target_truck_plan['loaded_items']:
-                            container_id = item['container_id']
-                            if container_id not in container_totals:
-                                container_totals[container_id] = {
-                                    'num_containers': 0,
-                                    'floor_area_per_container': item['floor_area_per_container'],
-                                    'stackable': item.get('stackable', False),
-                                    'max_stack': item.get('max_stack', 1)
-                                }
-                            container_totals[container_id]['num_containers'] += item['num_containers']
-                        for container_id, info in container_totals.items():
-                            if info['stackable'] and info['max_stack'] > 1:
-                                stacked_containers = (info['num_containers'] + info['max_stack'] - 1) // info['max_stack']
-                                container_area = info['floor_area_per_container'] * stacked_containers
-                            else:
-                                container_area = info['floor_area_per_container'] * info['num_containers']
-                            loaded_area += container_area
+                        loaded_area = self._get_truck_load(target_truck_plan).loaded_area()
                         remaining_area = truck_floor_area - loaded_area
                     else:
                         # トラックプランが存在しない場合、全容量が空き
@@ -1385,29 +2270,30 @@ class TransportPlanner:
                                 'truck_id': truck_id,
                                 'truck_name': truck_info['name'],
                                 'loaded_items': [],
-                                'utilization': {'floor_area_rate': 0, 'volume_rate': 0, 'weight_rate': 0}
+                                'utilization': {'floor_area_rate': 0, 'volume_rate': 0, 'weight_rate': 0},
+                                '_load': TruckLoad()
                             }
                             current_plan['trucks'].append(target_truck_plan)
                             current_plan['total_trips'] = len(current_plan['trucks'])
                         # ✅ アイテムを追加（特便フラグを設定）
                         capacity = demand['capacity']
                         expected_quantity = demand['num_containers'] * capacity
-                        target_truck_plan['loaded_items'].append({
-                            'product_id': demand['product_id'],
-                            'product_code': demand['product_code'],
-                            'product_name': demand.get('product_name', ''),
-                            'container_id': demand['container_id'],
-                            'container_name': container.name,
-                            'num_containers': demand['num_containers'],
-                            'total_quantity': expected_quantity,  # ✅ 必ず「容器数×容量」
-                            'floor_area_per_container': demand['floor_area'] / demand['num_containers'],
-                            'delivery_date': demand['delivery_date'],
-                            'loading_date': current_date,
-                            'is_special_delivery': True,  # 特便フラグ
-                            'stackable': container.stackable,
-                            'max_stack': container.max_stack,
-                            'capacity': capacity
-                        })
+                        self._add_to_truck_plan(target_truck_plan, LoadedItem(
+                            product_id=demand['product_id'],
+                            product_code=demand['product_code'],
+                            product_name=demand.get('product_name', ''),
+                            container_id=demand['container_id'],
+                            container_name=container.name,
+                            num_containers=demand['num_containers'],
+                            total_quantity=expected_quantity,  # ✅ 必ず「容器数×容量」
+                            floor_area_per_container=demand['floor_area'] / demand['num_containers'],
+                            delivery_date=demand['delivery_date'],
+                            loading_date=current_date,
+                            is_special_delivery=True,  # 特便フラグ
+                            stackable=container.stackable,
+                            max_stack=container.max_stack,
+                            capacity=capacity
+                        ))
                         # 積載率を再計算
                         self._recalculate_utilization(target_truck_plan, truck_info, container_map)
                         # 当日の警告を削除
@@ -1442,6 +2328,7 @@ class TransportPlanner:
         
         # 日付順にソート
         sorted_dates = sorted(daily_plans.keys())
+        moved_count = 0
         
         for date_str in sorted_dates:
             current_date = datetime.strptime(date_str, '%Y-%m-%d').date()
@@ -1506,8 +2393,19 @@ class TransportPlanner:
                 # 当日のプランから削除
                 day_plan['trucks'].remove(truck_plan)
                 day_plan['total_trips'] = len(day_plan['trucks'])
+                moved_count += 1
         
         print(f"✅ 翌日着トラックの積載日調整が完了しました")
+        return moved_count
+
+    def _convert_plan_records(self, daily_plans):
+        """daily_plans 内の Demand/LoadedItem を dict に変換（返却直前の境界処理）"""
+        for plan in daily_plans.values():
+            for truck_plan in plan.get('trucks', []):
+                truck_plan.pop('_load', None)
+                truck_plan['loaded_items'] = plan_records_to_dicts(truck_plan['loaded_items'])
+            if plan.get('remaining_demands'):
+                plan['remaining_demands'] = plan_records_to_dicts(plan['remaining_demands'])
 
     def _create_summary(self, daily_plans, use_non_default, planned_dates=None) -> Dict:
         """サマリー作成"""
@@ -1525,3 +2423,27 @@ class TransportPlanner:
             'use_non_default_truck': use_non_default,
             'status': '正常' if total_warnings == 0 else '警告あり'
         }
+
+
+def _plan_truck_group(task: Dict[str, Any]) -> Tuple[Dict[str, Dict], List[str]]:
+    """プロセスプール用: 1ワーカー分のグループについて全営業日の Step3 を実行"""
+    planner = TransportPlanner()
+    plans = {}
+    fallback_dates = []
+    for working_date in task['working_dates']:
+        date_str = working_date.strftime('%Y-%m-%d')
+        demands = task['demands'].get(date_str)
+        if not demands:
+            continue
+        fallback_before = len(planner._fallback_product_ids)
+        plans[date_str] = planner._create_daily_loading_plan(
+            demands,
+            task['truck_map'],
+            task['container_map'],
+            task['product_map'],
+            task['use_non_default'],
+            working_date
+        )
+        if len(planner._fallback_product_ids) != fallback_before:
+            fallback_dates.append(date_str)
+    return plans, fallback_dates
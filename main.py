@@ -1,4 +1,5 @@
 # app/main.py
+import time
 import streamlit as st
 from repository.database_manager import DatabaseManager
 from services.production_service import ProductionService
@@ -36,18 +37,11 @@ class ProductionPlanningApp:
             "📅 会社カレンダー": CalendarPage(self.db),  # ✅ 追加
         }
     
-    def run(self):
+    def run(self, bootstrap_ms: float = None):
         """アプリケーション実行"""
-        # ページ設定
-        st.set_page_config(
-            page_title=APP_CONFIG.page_title,
-            page_icon=APP_CONFIG.page_icon,
-            layout=APP_CONFIG.layout
-        )
-        
-        
         # サイドバー表示
         selected_page = create_sidebar()
+        self._show_startup_metrics(bootstrap_ms)
         
         # 選択されたページを表示
         if selected_page in self.pages:
@@ -64,16 +58,55 @@ class ProductionPlanningApp:
         else:
             st.error("選択されたページが見つかりません")
     
+    def _show_startup_metrics(self, bootstrap_ms: float = None):
+        """起動時間（初回構築・今回の取得）と接続プールの状態を表示"""
+        with st.sidebar:
+            with st.expander("⏱️ 起動時間・接続状態"):
+                startup_ms = getattr(self, 'startup_ms', None)
+                if startup_ms is not None:
+                    st.write(f"**初回構築:** {startup_ms:,.1f} ms")
+                if bootstrap_ms is not None:
+                    st.write(f"**今回の取得:** {bootstrap_ms:,.1f} ms")
+                metrics = DatabaseManager.pool_metrics()
+                if metrics.get('initialized'):
+                    st.write(f"**接続:** 使用中 {metrics['checked_out']} / 待機 {metrics['checked_in']}"
+                             f"（overflow {metrics['overflow']}）")
+                    st.write(f"**取得待ち:** 平均 {metrics['wait_avg_ms']} ms / 最大 {metrics['wait_max_ms']} ms")
+    
     def __del__(self):
         """リソース解放"""
         if hasattr(self, 'db'):
             self.db.close()
 
+@st.cache_resource(show_spinner=False)
+def get_app() -> ProductionPlanningApp:
+    """
+    アプリ（DB接続・サービス・ページ）をプロセス内で1回だけ構築して再利用
+
+    全セッションで共有するため、ページ・サービス・リポジトリには実行ごとの状態を持たせない。
+    - プロセス共有: DBエンジン、マスタ・営業日・計画結果のキャッシュ、納入進度の変更履歴
+    - 実行ごとの結果（取込・保存・差分再計算のレポート）は戻り値で返し、画面状態は st.session_state
+    - プランナーは実行中の状態を持つため計画ごとに作る（TransportService.new_planner）
+    """
+    started = time.perf_counter()
+    app = ProductionPlanningApp()
+    app.startup_ms = (time.perf_counter() - started) * 1000
+    print(f"🚀 アプリ初期化: {app.startup_ms:.1f} ms")
+    return app
+
 def main():
     """メイン関数"""
+    # ページ設定（最初のStreamlitコマンドである必要がある）
+    st.set_page_config(
+        page_title=APP_CONFIG.page_title,
+        page_icon=APP_CONFIG.page_icon,
+        layout=APP_CONFIG.layout
+    )
     try:
-        app = ProductionPlanningApp()
-        app.run()
+        started = time.perf_counter()
+        app = get_app()
+        bootstrap_ms = (time.perf_counter() - started) * 1000
+        app.run(bootstrap_ms)
     except Exception as e:
         st.error(f"アプリケーション起動エラー: {e}")
         st.info("設定ファイルとデータベース接続を確認してください")
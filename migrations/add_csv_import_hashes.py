@@ -0,0 +1,127 @@
+"""
+マイグレーション: CSV取込のハッシュ管理
+
+- csv_import_history に file_hash / changed_products / skipped_products / progress_created 列を追加
+- 製品（品番×検査区分）ごとのV2/V3行ハッシュを保持する csv_import_row_hashes を作成
+  （progress_created: 納入進度まで作成した取込か。作成済みのテーブルには列を追加する）
+
+同じ内容のファイル・製品の再取込をスキップするために使用（CSVImportService.import_csv_data）
+"""
+import os
+import sys
+
+from sqlalchemy import text
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from repository.database_manager import DatabaseManager
+
+HISTORY_COLUMNS = {
+    'file_hash': 'CHAR(64) NULL',
+    'changed_products': 'INT NULL',
+    'skipped_products': 'INT NULL',
+    'progress_created': 'TINYINT(1) NULL',
+}
+
+ROW_HASH_COLUMNS = {
+    'progress_created': 'TINYINT(1) NOT NULL DEFAULT 0',
+}
+
+
+def _existing_columns(session, table_name: str = 'csv_import_history') -> set:
+    rows = session.execute(text("""
+        SELECT COLUMN_NAME
+        FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table_name
+    """), {'table_name': table_name}).fetchall()
+    return {row[0] for row in rows}
+
+
+def _has_index(session, index_name: str) -> bool:
+    row = session.execute(text("""
+        SELECT 1 FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'csv_import_history'
+          AND INDEX_NAME = :index_name
+        LIMIT 1
+    """), {'index_name': index_name}).fetchone()
+    return row is not None
+
+
+def migrate():
+    """マイグレーション実行"""
+    db = DatabaseManager()
+    session = db.get_session()
+    
+    try:
+        existing = _existing_columns(session)
+        for column, definition in HISTORY_COLUMNS.items():
+            if column in existing:
+                print(f"ℹ️ csv_import_history.{column} は追加済みです")
+                continue
+            session.execute(text(f"ALTER TABLE csv_import_history ADD COLUMN {column} {definition}"))
+            print(f"✅ csv_import_history.{column} を追加しました")
+        
+        if not _has_index(session, 'idx_import_history_file_hash'):
+            session.execute(text("CREATE INDEX idx_import_history_file_hash ON csv_import_history (file_hash)"))
+            print("✅ idx_import_history_file_hash を作成しました")
+        
+        session.execute(text("""
+            CREATE TABLE IF NOT EXISTS csv_import_row_hashes (
+                product_code VARCHAR(50) NOT NULL,
+                inspection_category VARCHAR(20) NOT NULL,
+                row_hash CHAR(64) NOT NULL,
+                progress_created TINYINT(1) NOT NULL DEFAULT 0,
+                updated_at DATETIME NOT NULL,
+                PRIMARY KEY (product_code, inspection_category)
+            )
+        """))
+        print("✅ csv_import_row_hashes テーブルを作成しました")
+        
+        existing = _existing_columns(session, 'csv_import_row_hashes')
+        for column, definition in ROW_HASH_COLUMNS.items():
+            if column not in existing:
+                session.execute(text(f"ALTER TABLE csv_import_row_hashes ADD COLUMN {column} {definition}"))
+                print(f"✅ csv_import_row_hashes.{column} を追加しました")
+        session.commit()
+        
+    except Exception as e:
+        session.rollback()
+        print(f"❌ マイグレーションエラー: {e}")
+        raise
+    
+    finally:
+        session.close()
+
+
+def rollback():
+    """ロールバック"""
+    db = DatabaseManager()
+    session = db.get_session()
+    
+    try:
+        session.execute(text("DROP TABLE IF EXISTS csv_import_row_hashes"))
+        if _has_index(session, 'idx_import_history_file_hash'):
+            session.execute(text("DROP INDEX idx_import_history_file_hash ON csv_import_history"))
+        existing = _existing_columns(session)
+        for column in HISTORY_COLUMNS:
+            if column in existing:
+                session.execute(text(f"ALTER TABLE csv_import_history DROP COLUMN {column}"))
+        session.commit()
+        print("✅ CSV取込のハッシュ管理を削除しました")
+        
+    except Exception as e:
+        session.rollback()
+        print(f"❌ ロールバックエラー: {e}")
+        raise
+    
+    finally:
+        session.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'rollback':
+        rollback()
+    else:
+        migrate()
@@ -0,0 +1,144 @@
+"""
+マイグレーション: delivery_progress に複合インデックス追加
+
+- idx_dp_product_delivery (product_id, delivery_date)
+    製品×納期での検索（積載計画保存・get_progress_by_product_and_date）
+- idx_dp_delivery_status (delivery_date, status)
+    期間指定の計画数リセット・納期＋ステータスでの一覧
+
+使い方:
+    python -m migrations.add_delivery_progress_indexes          # 追加 + 実行計画チェック
+    python -m migrations.add_delivery_progress_indexes check    # 実行計画チェックのみ
+    python -m migrations.add_delivery_progress_indexes rollback # 削除
+"""
+import os
+import sys
+from datetime import date, timedelta
+
+from sqlalchemy import text
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from repository.database_manager import DatabaseManager
+
+INDEXES = {
+    'idx_dp_product_delivery': '(product_id, delivery_date)',
+    'idx_dp_delivery_status': '(delivery_date, status)',
+}
+
+# 頻出クエリ（リポジトリの WHERE 句と同じ形）
+HOT_QUERIES = {
+    '製品×納期の進度取得': (
+        """
+        SELECT * FROM delivery_progress
+        WHERE product_id = :product_id
+          AND delivery_date >= :delivery_date AND delivery_date < :next_date
+        ORDER BY delivery_date, id LIMIT 1
+        """,
+        {'product_id': 1, 'delivery_date': date.today(), 'next_date': date.today() + timedelta(days=1)}
+    ),
+    '計画期間の計画数リセット': (
+        """
+        UPDATE delivery_progress SET planned_quantity = 0
+        WHERE delivery_date >= :start_date AND delivery_date < :end_date_exclusive
+        """,
+        {'start_date': date.today(), 'end_date_exclusive': date.today() + timedelta(days=30)}
+    ),
+    '納期＋ステータスの一覧': (
+        """
+        SELECT id FROM delivery_progress
+        WHERE delivery_date >= :start_date AND delivery_date < :end_date_exclusive
+          AND status = '未出荷'
+        """,
+        {'start_date': date.today(), 'end_date_exclusive': date.today() + timedelta(days=7)}
+    ),
+}
+
+
+def _existing_indexes(session) -> set:
+    rows = session.execute(text("""
+        SELECT DISTINCT INDEX_NAME
+        FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'delivery_progress'
+    """)).fetchall()
+    return {row[0] for row in rows}
+
+
+def migrate():
+    """マイグレーション実行"""
+    db = DatabaseManager()
+    session = db.get_session()
+    
+    try:
+        # MySQL は CREATE INDEX IF NOT EXISTS に対応していないため存在確認してから追加
+        existing = _existing_indexes(session)
+        for name, columns in INDEXES.items():
+            if name in existing:
+                print(f"ℹ️ {name} は作成済みです")
+                continue
+            session.execute(text(f"CREATE INDEX {name} ON delivery_progress {columns}"))
+            print(f"✅ {name} {columns} を作成しました")
+        session.commit()
+        
+    except Exception as e:
+        session.rollback()
+        print(f"❌ マイグレーションエラー: {e}")
+        raise
+    
+    finally:
+        session.close()
+
+
+def rollback():
+    """ロールバック"""
+    db = DatabaseManager()
+    session = db.get_session()
+    
+    try:
+        existing = _existing_indexes(session)
+        for name in INDEXES:
+            if name in existing:
+                session.execute(text(f"DROP INDEX {name} ON delivery_progress"))
+                print(f"✅ {name} を削除しました")
+        session.commit()
+        
+    except Exception as e:
+        session.rollback()
+        print(f"❌ ロールバックエラー: {e}")
+        raise
+    
+    finally:
+        session.close()
+
+
+def check_query_plans() -> bool:
+    """頻出クエリの実行計画を確認し、全件走査・確認失敗があれば警告（なければTrue）"""
+    db = DatabaseManager()
+    full_scan_labels = []
+    failed = []
+    for label, (query, params) in HOT_QUERIES.items():
+        full_scans = db.explain_full_scans(query, params, label=label)
+        if full_scans is None:
+            failed.append(label)
+        elif full_scans:
+            full_scan_labels.append(label)
+        else:
+            print(f"✅ {label}: インデックス使用")
+    if full_scan_labels:
+        print("⚠️ 全件走査のクエリがあります（件数が少ない表ではオプティマイザが全件走査を選ぶこともあります）")
+    if failed:
+        print(f"❌ 実行計画を確認できなかったクエリがあります: {', '.join(failed)}")
+    ok = not full_scan_labels and not failed
+    return ok
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'rollback':
+        rollback()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'check':
+        check_query_plans()
+    else:
+        migrate()
+        check_query_plans()
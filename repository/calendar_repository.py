@@ -2,324 +2,255 @@
 from sqlalchemy import text
 from datetime import date, timedelta
 from typing import List, Dict, Optional
+from bisect import bisect_left, bisect_right
+import threading
+import time
 import pandas as pd
+from config import APP_CONFIG
+from .database_manager import DatabaseManager
+
+
+class WorkingDayIndex:
+    """
+    営業日インデックス（メモリ常駐）
+
+    company_calendar を期間単位で一括読み込みし、
+    - 営業日判定: 日付オフセットのフラグ配列で O(1)
+    - 次/前の営業日: 営業日の序数ソート配列を二分探索で O(log n)
+    を提供する。カレンダー未登録日は土日を休日とみなす（is_working_day と同じ規則）。
+    登録済みの営業日だけの一覧（registered_*）も持つ（CalendarRepository の公開メソッド用）。
+    """
+
+    # 読み込み範囲外の日付を参照したときに前後へ広げる日数
+    EXTEND_DAYS = 366
+
+    def __init__(self, start_date: date, end_date: date, registered: Dict[date, bool],
+                 last_registered_working: Optional[date] = None):
+        self.start_date = start_date
+        self.end_date = end_date
+        self._base = start_date.toordinal()
+        # 範囲外も含めた、登録済み営業日の最終日（次の営業日の検索範囲を決めるのに使う）
+        self.last_registered_working = last_registered_working
+        # カレンダーの登録内容（with_overrides で未登録日の扱いを保ったまま差し替えるため保持）
+        self._registered = registered
+        self._registered_working_ordinals = sorted(
+            d.toordinal() for d, is_working in registered.items()
+            if is_working and start_date <= d <= end_date
+        )
+
+        span = (end_date - start_date).days + 1
+        self._flags = bytearray(span)
+        working_ordinals = []
+        for offset in range(span):
+            ordinal = self._base + offset
+            d = date.fromordinal(ordinal)
+            if d in registered:
+                is_working = registered[d]
+            else:
+                is_working = d.weekday() not in [5, 6]
+            if is_working:
+                self._flags[offset] = 1
+                working_ordinals.append(ordinal)
+        self._working_ordinals = working_ordinals
+
+    def covers(self, start_date: date, end_date: date = None) -> bool:
+        """指定期間が読み込み範囲内か"""
+        end_date = end_date or start_date
+        return self.start_date <= start_date and end_date <= self.end_date
+
+    def is_working_day(self, target_date: date) -> bool:
+        return self._flags[target_date.toordinal() - self._base] == 1
+
+    def next_working_day(self, target_date: date, skip_days: int = 1) -> Optional[date]:
+        """target_date より後の skip_days 番目の営業日（範囲外なら None）"""
+        pos = bisect_right(self._working_ordinals, target_date.toordinal()) + skip_days - 1
+        if pos < len(self._working_ordinals):
+            return date.fromordinal(self._working_ordinals[pos])
+        return None
+
+    def previous_working_day(self, target_date: date) -> Optional[date]:
+        """target_date より前の直近営業日（範囲外なら None）"""
+        pos = bisect_left(self._working_ordinals, target_date.toordinal()) - 1
+        if pos >= 0:
+            return date.fromordinal(self._working_ordinals[pos])
+        return None
+
+    def working_days_between(self, start_date: date, end_date: date) -> List[date]:
+        lo = bisect_left(self._working_ordinals, start_date.toordinal())
+        hi = bisect_right(self._working_ordinals, end_date.toordinal())
+        return [date.fromordinal(o) for o in self._working_ordinals[lo:hi]]
+
+    def registered_working_days_between(self, start_date: date, end_date: date) -> List[date]:
+        """期間内の、カレンダーに営業日として登録された日だけ"""
+        lo = bisect_left(self._registered_working_ordinals, start_date.toordinal())
+        hi = bisect_right(self._registered_working_ordinals, end_date.toordinal())
+        return [date.fromordinal(o) for o in self._registered_working_ordinals[lo:hi]]
+
+    def next_registered_working_day(self, target_date: date, skip_days: int = 1) -> Optional[date]:
+        """target_date より後の、登録済み営業日の skip_days 番目（読み込み範囲内に無ければ None）"""
+        pos = bisect_right(self._registered_working_ordinals, target_date.toordinal()) + skip_days - 1
+        if pos < len(self._registered_working_ordinals):
+            return date.fromordinal(self._registered_working_ordinals[pos])
+        return None
+
+    def with_overrides(self, holidays=(), working_days=()) -> 'WorkingDayIndex':
+        """休日・営業日を差し替えたコピー（DBは変更しない。what-if シナリオ用）"""
+        registered = dict(self._registered)
+        for target_date in holidays:
+            registered[target_date] = False
+        for target_date in working_days:
+            registered[target_date] = True
+        return WorkingDayIndex(self.start_date, self.end_date, registered, self.last_registered_working)
+
 
 class CalendarRepository:
     """会社カレンダーリポジトリ"""
+
+    # 営業日インデックスは接続先DBごとにプロセス内で共有する
+    # （計画実行ごと・ページごとに作られるリポジトリ間で再利用するため）
+    # {キー: (読み込み時刻, company_calendar のデータ版数, インデックス)}
+    _index_cache: Dict[str, tuple] = {}
+    _index_lock = threading.Lock()
     
     def __init__(self, db_manager):
         self.db = db_manager
-    
-    def is_working_day(self, target_date: date) -> bool:
-        """指定日が営業日かチェック"""
-        session = self.db.get_session()
-        try:
-            query = text("""
-                SELECT is_working_day 
-                FROM company_calendar 
-                WHERE calendar_date = :target_date
-            """)
-            
-            result = session.execute(query, {'target_date': target_date}).fetchone()
-            
-            if result:
-                return bool(result[0])
-            
-            # カレンダーに未登録の場合は土日をチェック
-            weekday = target_date.weekday()
-            return weekday not in [5, 6]  # 土日以外は営業日とみなす
-        
-        finally:
-            session.close()
-    
-    def get_next_working_day(self, target_date: date, skip_days: int = 1) -> date:
-        """次の営業日を取得"""
-        session = self.db.get_session()
-        try:
-            query = text("""
-                SELECT calendar_date 
-                FROM company_calendar 
-                WHERE calendar_date > :target_date 
-                  AND is_working_day = TRUE
-                ORDER BY calendar_date
-                LIMIT :skip_days
-            """)
-            
-            result = session.execute(query, {
-                'target_date': target_date,
-                'skip_days': skip_days
-            }).fetchall()
-            
-            if result and len(result) >= skip_days:
-                return result[skip_days - 1][0]
-            
-            # フォールバック: カレンダー未登録の場合
-            current = target_date + timedelta(days=1)
-            found_days = 0
-            
-            while found_days < skip_days:
-                if self.is_working_day(current):
-                    found_days += 1
-                    if found_days == skip_days:
-                        return current
-                current += timedelta(days=1)
-            
-            return current
-        
-        finally:
-            session.close()
-    
-    def get_working_days_between(self, start_date: date, end_date: date) -> List[date]:
-        """期間内の営業日リストを取得"""
+
+    # ---- 営業日インデックス ----
+
+    def _index_key(self) -> str:
+        engine = getattr(self.db, 'engine', None)
+        return str(engine.url) if engine is not None else str(id(self.db))
+
+    def _load_index(self, start_date: date, end_date: date) -> WorkingDayIndex:
+        """company_calendar の登録内容を期間指定で一括読み込み"""
         session = self.db.get_session()
         try:
             query = text("""
-                SELECT calendar_date 
-                FROM company_calendar 
+                SELECT calendar_date, is_working_day
+                FROM company_calendar
                 WHERE calendar_date BETWEEN :start_date AND :end_date
-                  AND is_working_day = TRUE
-                ORDER BY calendar_date
             """)
-            
+
             result = session.execute(query, {
                 'start_date': start_date,
                 'end_date': end_date
             }).fetchall()
-            
-            return [row[0] for row in result]
-        
-        finally:
-            session.close()
-    
-    def get_calendar_range(self, start_date: date, end_date: date) -> pd.DataFrame:
-        """期間のカレンダー情報を取得"""
-        session = self.db.get_session()
-        try:
-            query = text("""
-                SELECT 
-                    calendar_date,
-                    day_type,
-                    day_name,
-                    is_working_day,
-                    notes
-                FROM company_calendar 
-                WHERE calendar_date BETWEEN :start_date AND :end_date
-                ORDER BY calendar_date
-            """)
-            
-            result = session.execute(query, {
-                'start_date': start_date,
-                'end_date': end_date
-            })
-            
-            rows = result.fetchall()
-            if rows:
-                return pd.DataFrame(rows, columns=result.keys())
-            else:
-                return pd.DataFrame()
-        
-        finally:
-            session.close()
-    
-    def add_holiday(self, target_date: date, day_type: str, day_name: str = None, notes: str = None) -> bool:
-        """休日を追加"""
-        session = self.db.get_session()
-        try:
-            query = text("""
-                INSERT INTO company_calendar 
-                (calendar_date, day_type, day_name, is_working_day, notes)
-                VALUES (:date, :day_type, :day_name, FALSE, :notes)
-                ON DUPLICATE KEY UPDATE
-                    day_type = VALUES(day_type),
-                    day_name = VALUES(day_name),
-                    is_working_day = FALSE,
-                    notes = VALUES(notes)
-            """)
-            
-            session.execute(query, {
-                'date': target_date,
-                'day_type': day_type,
-                'day_name': day_name,
-                'notes': notes
-            })
-            session.commit()
-            return True
-        
-        except Exception as e:
-            session.rollback()
-            print(f"休日追加エラー: {e}")
-            return False
-        finally:
-            session.close()
-    
-    def add_working_day(self, target_date: date, notes: str = None) -> bool:
-        """営業日を追加（休日の振替など）"""
-        session = self.db.get_session()
-        try:
-            query = text("""
-                INSERT INTO company_calendar 
-                (calendar_date, day_type, is_working_day, notes)
-                VALUES (:date, '営業日', TRUE, :notes)
-                ON DUPLICATE KEY UPDATE
-                    day_type = '営業日',
-                    is_working_day = TRUE,
-                    notes = VALUES(notes)
-            """)
-            
-            session.execute(query, {
-                'date': target_date,
-                'notes': notes
-            })
-            session.commit()
-            return True
-        
-        except Exception as e:
-            session.rollback()
-            print(f"営業日追加エラー: {e}")
-            return False
-        finally:
-            session.close()
-    
-    def delete_calendar_date(self, target_date: date) -> bool:
-        """カレンダーから日付を削除"""
-        session = self.db.get_session()
-        try:
-            query = text("""
-                DELETE FROM company_calendar 
-                WHERE calendar_date = :date
-            """)
-            
-            session.execute(query, {'date': target_date})
-            session.commit()
-            return True
-        
-        except Exception as e:
-            session.rollback()
-            print(f"日付削除エラー: {e}")
-            return False
-        finally:
-            session.close()
-    
-    def bulk_import_holidays(self, holidays: List[Dict]) -> int:
-        """休日を一括インポート"""
-        session = self.db.get_session()
-        imported_count = 0
-        
-        try:
-            query = text("""
-                INSERT INTO company_calendar 
-                (calendar_date, day_type, day_name, is_working_day, notes)
-                VALUES (:date, :day_type, :day_name, FALSE, :notes)
-                ON DUPLICATE KEY UPDATE
-                    day_type = VALUES(day_type),
-                    day_name = VALUES(day_name),
-                    is_working_day = FALSE
-            """)
-            
-            for holiday in holidays:
-                session.execute(query, {
-                    'date': holiday['date'],
-                    'day_type': holiday.get('day_type', '祝日'),
-                    'day_name': holiday.get('day_name'),
-                    'notes': holiday.get('notes')
-                })
-                imported_count += 1
-            
-            session.commit()
-            return imported_count
-        
-        except Exception as e:
-            session.rollback()
-            print(f"一括インポートエラー: {e}")
-            return 0
+
+            registered = {}
+            for row in result:
+                calendar_date = row[0]
+                if hasattr(calendar_date, 'date') and callable(calendar_date.date):
+                    calendar_date = calendar_date.date()
+                registered[calendar_date] = bool(row[1])
+
+            last_registered_working = session.execute(text("""
+                SELECT MAX(calendar_date) FROM company_calendar WHERE is_working_day = TRUE
+            """)).scalar()
+            if last_registered_working is not None:
+                last_registered_working = self._to_date(last_registered_working)
+
+            return WorkingDayIndex(start_date, end_date, registered, last_registered_working)
+
         finally:
             session.close()
 
-    """会社カレンダーリポジトリ"""
-    
-    def __init__(self, db_manager):
-        self.db = db_manager
-    
+    def get_working_day_index(self, start_date: date, end_date: date = None) -> WorkingDayIndex:
+        """
+        指定期間をカバーする営業日インデックスを取得（範囲外なら広げて再読み込み）
+
+        このプロセスでの company_calendar への書き込み（データ版数）と、
+        他プロセス・DB直接更新に備えた有効期限（APP_CONFIG.calendar_index_ttl_sec）で読み直す。
+        """
+        start_date = self._to_date(start_date)
+        end_date = self._to_date(end_date) if end_date is not None else start_date
+        key = self._index_key()
+        versions = DatabaseManager.data_versions(('company_calendar',))
+
+        with self._index_lock:
+            index = None
+            entry = self._index_cache.get(key)
+            if entry is not None:
+                loaded_at, loaded_versions, cached = entry
+                if (loaded_versions == versions
+                        and time.monotonic() - loaded_at <= APP_CONFIG.calendar_index_ttl_sec):
+                    index = cached
+            if index is not None and index.covers(start_date, end_date):
+                return index
+
+            extend = timedelta(days=WorkingDayIndex.EXTEND_DAYS)
+            load_start = start_date - extend
+            load_end = end_date + extend
+            if index is not None:
+                load_start = min(load_start, index.start_date)
+                load_end = max(load_end, index.end_date)
+
+            index = self._load_index(load_start, load_end)
+            self._index_cache[key] = (time.monotonic(), versions, index)
+            return index
+
+    def invalidate_working_day_index(self):
+        """カレンダー更新時に営業日インデックスを破棄"""
+        with self._index_lock:
+            self._index_cache.pop(self._index_key(), None)
+
+    @staticmethod
+    def _to_date(value) -> date:
+        if hasattr(value, 'date') and callable(value.date):
+            return value.date()
+        if isinstance(value, str):
+            return date.fromisoformat(value[:10])
+        return value
+
     def is_working_day(self, target_date: date) -> bool:
-        """指定日が営業日かチェック"""
-        session = self.db.get_session()
-        try:
-            query = text("""
-                SELECT is_working_day 
-                FROM company_calendar 
-                WHERE calendar_date = :target_date
-            """)
-            
-            result = session.execute(query, {'target_date': target_date}).fetchone()
-            
-            if result:
-                return bool(result[0])
-            
-            # カレンダーに未登録の場合は土日をチェック
-            weekday = target_date.weekday()
-            return weekday not in [5, 6]  # 土日以外は営業日とみなす
-        
-        finally:
-            session.close()
+        """指定日が営業日かチェック（カレンダー未登録日は土日以外を営業日とみなす）"""
+        target_date = self._to_date(target_date)
+        return self.get_working_day_index(target_date).is_working_day(target_date)
     
     def get_next_working_day(self, target_date: date, skip_days: int = 1) -> date:
-        """次の営業日を取得"""
-        session = self.db.get_session()
-        try:
-            query = text("""
-                SELECT calendar_date 
-                FROM company_calendar 
-                WHERE calendar_date > :target_date 
-                  AND is_working_day = TRUE
-                ORDER BY calendar_date
-                LIMIT :skip_days
-            """)
-            
-            result = session.execute(query, {
-                'target_date': target_date,
-                'skip_days': skip_days
-            }).fetchall()
-            
-            if result and len(result) >= skip_days:
-                return result[skip_days - 1][0]
-            
-            # フォールバック: カレンダー未登録の場合
-            current = target_date + timedelta(days=1)
-            found_days = 0
-            
-            while found_days < skip_days:
-                if self.is_working_day(current):
-                    found_days += 1
-                    if found_days == skip_days:
-                        return current
-                current += timedelta(days=1)
-            
-            return current
-        
-        finally:
-            session.close()
+        """
+        次の営業日を取得
+
+        登録済みの営業日が skip_days 日分あればその日、
+        無ければ未登録日を土日以外とみなして数える（従来と同じ）。
+        """
+        target_date = self._to_date(target_date)
+        # 土日祝が続いても届く範囲を確保（不足すればインデックス側で再読み込み）
+        horizon = target_date + timedelta(days=skip_days * 7 + 7)
+        index = self.get_working_day_index(target_date, horizon)
+        if index.last_registered_working is not None and index.last_registered_working > index.end_date:
+            # 登録済み営業日が読み込み範囲の先にもある場合は、そこまで読み込んで探す
+            index = self.get_working_day_index(target_date, index.last_registered_working)
+        next_day = index.next_registered_working_day(target_date, skip_days)
+        if next_day is not None:
+            return next_day
+        next_day = index.next_working_day(target_date, skip_days)
+        if next_day is not None:
+            return next_day
+        return target_date + timedelta(days=skip_days)
+
+    def get_previous_working_day(self, target_date: date, max_days: int = 7) -> Optional[date]:
+        """前の営業日を取得（max_days 以内に無ければ None。未登録日は土日以外を営業日とみなす）"""
+        target_date = self._to_date(target_date)
+        floor = target_date - timedelta(days=max_days)
+        prev_day = self.get_working_day_index(floor, target_date).previous_working_day(target_date)
+        if prev_day is not None and prev_day >= floor:
+            return prev_day
+        return None
     
-    def get_working_days_between(self, start_date: date, end_date: date) -> List[date]:
-        """期間内の営業日リストを取得"""
-        session = self.db.get_session()
-        try:
-            query = text("""
-                SELECT calendar_date 
-                FROM company_calendar 
-                WHERE calendar_date BETWEEN :start_date AND :end_date
-                  AND is_working_day = TRUE
-                ORDER BY calendar_date
-            """)
-            
-            result = session.execute(query, {
-                'start_date': start_date,
-                'end_date': end_date
-            }).fetchall()
-            
-            return [row[0] for row in result]
-        
-        finally:
-            session.close()
+    def get_working_days_between(self, start_date: date, end_date: date,
+                                 include_unregistered: bool = False) -> List[date]:
+        """
+        期間内の営業日リストを取得
+
+        既定ではカレンダーに営業日として登録された日だけを返す（従来と同じ）。
+        include_unregistered=True のときは未登録日も土日以外を営業日として含める。
+        """
+        start_date = self._to_date(start_date)
+        end_date = self._to_date(end_date)
+        index = self.get_working_day_index(start_date, end_date)
+        if include_unregistered:
+            return index.working_days_between(start_date, end_date)
+        return index.registered_working_days_between(start_date, end_date)
     
     def get_calendar_range(self, start_date: date, end_date: date) -> pd.DataFrame:
         """期間のカレンダー情報を取得"""
@@ -369,6 +300,7 @@ class CalendarRepository:
                 'notes': notes
             })
             session.commit()
+            self.invalidate_working_day_index()
             return True
         
         except Exception as e:
@@ -397,6 +329,7 @@ class CalendarRepository:
                 'notes': notes
             })
             session.commit()
+            self.invalidate_working_day_index()
             return True
         
         except Exception as e:
@@ -417,6 +350,7 @@ class CalendarRepository:
             
             session.execute(query, {'date': target_date})
             session.commit()
+            self.invalidate_working_day_index()
             return True
         
         except Exception as e:
@@ -452,6 +386,7 @@ class CalendarRepository:
                 imported_count += 1
             
             session.commit()
+            self.invalidate_working_day_index()
             return imported_count
         
         except Exception as e:
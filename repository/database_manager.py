@@ -1,34 +1,181 @@
 # app/repository/database_manager.py
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.pool import QueuePool
 from config import DB_CONFIG
+import re
+import threading
+import time
+from typing import Optional
 import pandas as pd
 
+# 書き込み文の対象テーブル（INSERT/REPLACE/UPDATE/DELETE/TRUNCATE の先頭のテーブル名）
+_WRITE_TABLE = re.compile(
+    r"^\s*(?:INSERT(?:\s+IGNORE)?\s+INTO|REPLACE\s+INTO|UPDATE|DELETE\s+FROM|TRUNCATE(?:\s+TABLE)?)\s+`?(\w+)`?",
+    re.IGNORECASE
+)
+# テーブルを特定できない書き込み（ストアド・DDL・複数テーブルDELETEなど）
+_WRITE_ANY = re.compile(r"^\s*(?:INSERT|REPLACE|UPDATE|DELETE|TRUNCATE|CALL|CREATE|ALTER|DROP|LOAD)\b", re.IGNORECASE)
+# 一時テーブルの作成・削除（接続内だけの作業用なので、データ版数は進めない）
+_TEMPORARY_DDL = re.compile(r"^\s*(?:CREATE|DROP)\s+TEMPORARY\s+TABLE\b", re.IGNORECASE)
+
+
+class _TimedQueuePool(QueuePool):
+    """接続取得の待ち時間を計測する QueuePool"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - started
+            stats = DatabaseManager._pool_stats
+            with DatabaseManager._engine_lock:
+                stats['checkouts'] += 1
+                stats['wait_total_sec'] += waited
+                stats['wait_max_sec'] = max(stats['wait_max_sec'], waited)
+
+
 class DatabaseManager:
     """SQLAlchemy を使ったデータベース接続管理"""
 
-    def __init__(self):
-        # DB_CONFIG から接続情報を取得
-        user = DB_CONFIG.user
-        password = DB_CONFIG.password
-        host = DB_CONFIG.host
-        port = DB_CONFIG.port
-        dbname = DB_CONFIG.database
+    # エンジン（コネクションプール）はプロセス内で1つだけ作って共有する
+    _engine = None
+    _engine_lock = threading.Lock()
+    _pool_stats = {'checkouts': 0, 'wait_total_sec': 0.0, 'wait_max_sec': 0.0}
+    # テーブルごとのデータ版数（コミットされた書き込みごとに加算、'*' は全テーブル共通）
+    _data_versions = {}
 
-        db_url = f"mysql+pymysql://{user}:{password}@{host}:{port}/{dbname}?charset=utf8mb4"
-        self.engine = create_engine(db_url, echo=False, future=True)
+    def __init__(self):
+        self.engine = self.get_engine()
 
         # セッションファクトリ（scoped_sessionでスレッドセーフ）
         self.SessionLocal = scoped_session(sessionmaker(bind=self.engine, autocommit=False, autoflush=False))
 
+    @classmethod
+    def get_engine(cls):
+        """共有エンジンを取得（初回のみ DB_CONFIG から作成）"""
+        if cls._engine is None:
+            with cls._engine_lock:
+                if cls._engine is None:
+                    # DB_CONFIG から接続情報を取得
+                    user = DB_CONFIG.user
+                    password = DB_CONFIG.password
+                    host = DB_CONFIG.host
+                    port = DB_CONFIG.port
+                    dbname = DB_CONFIG.database
+
+                    db_url = f"mysql+pymysql://{user}:{password}@{host}:{port}/{dbname}?charset={DB_CONFIG.charset}"
+                    cls._engine = create_engine(
+                        db_url,
+                        echo=False,
+                        future=True,
+                        poolclass=_TimedQueuePool,
+                        connect_args={'connect_timeout': DB_CONFIG.connect_timeout},
+                        **DB_CONFIG.pool_options()
+                    )
+                    cls._track_writes(cls._engine)
+        return cls._engine
+
+    @classmethod
+    def _track_writes(cls, engine):
+        """書き込み文を接続ごとに記録し、コミット時に対象テーブルの版数を進める"""
+
+        @event.listens_for(engine, 'before_cursor_execute')
+        def _record_write(conn, cursor, statement, parameters, context, executemany):
+            match = _WRITE_TABLE.match(statement)
+            if match:
+                conn.info.setdefault('written_tables', set()).add(match.group(1).lower())
+            elif _TEMPORARY_DDL.match(statement):
+                return
+            elif _WRITE_ANY.match(statement):
+                conn.info.setdefault('written_tables', set()).add('*')
+
+        @event.listens_for(engine, 'commit')
+        def _bump_versions(conn):
+            tables = conn.info.pop('written_tables', None)
+            if not tables:
+                return
+            with cls._engine_lock:
+                for table in tables:
+                    cls._data_versions[table] = cls._data_versions.get(table, 0) + 1
+
+        @event.listens_for(engine, 'rollback')
+        def _discard_writes(conn):
+            conn.info.pop('written_tables', None)
+
+    @classmethod
+    def data_versions(cls, tables) -> tuple:
+        """
+        指定テーブルのデータ版数（このプロセスでコミットされた書き込み回数）
+
+        キャッシュのキーに使う。テーブルを特定できない書き込みは '*' として全テーブルに効く。
+        """
+        with cls._engine_lock:
+            return tuple(cls._data_versions.get(table, 0) for table in ('*',) + tuple(tables))
+
+    @classmethod
+    def pool_metrics(cls) -> dict:
+        """コネクションプールの状態（監視用）"""
+        if cls._engine is None:
+            return {'initialized': False}
+        pool = cls._engine.pool
+        with cls._engine_lock:
+            stats = dict(cls._pool_stats)
+        checkouts = stats['checkouts']
+        return {
+            'initialized': True,
+            'pool_size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': pool.overflow(),
+            'max_overflow': DB_CONFIG.max_overflow,
+            'checkouts': checkouts,
+            'wait_total_ms': round(stats['wait_total_sec'] * 1000, 2),
+            'wait_avg_ms': round(stats['wait_total_sec'] * 1000 / checkouts, 3) if checkouts else 0,
+            'wait_max_ms': round(stats['wait_max_sec'] * 1000, 2),
+            'status': pool.status(),
+        }
+
+    @classmethod
+    def dispose_engine(cls):
+        """共有エンジンを破棄（プロセス終了時・設定変更時のみ使用）"""
+        with cls._engine_lock:
+            if cls._engine is not None:
+                cls._engine.dispose()
+                cls._engine = None
+
     def get_session(self):
         """新しいセッションを取得"""
         return self.SessionLocal()
 
+    def explain_full_scans(self, query: str, params=None, label: str = None) -> Optional[list]:
+        """
+        EXPLAIN でクエリの実行計画を確認し、全件走査（type=ALL）になる表を返す
+
+        Returns:
+            list: 全件走査になる EXPLAIN 行（dict）のリスト。該当なしなら空
+            None: EXPLAIN を実行できなかった（確認できていない）
+        """
+        session = self.get_session()
+        try:
+            rows = session.execute(text(f"EXPLAIN {query}"), params or {}).fetchall()
+            full_scans = [dict(row._mapping) for row in rows if row._mapping.get('type') == 'ALL']
+            for row in full_scans:
+                print(
+                    f"⚠️ 全件走査: {label or query.strip()[:60]} "
+                    f"(table={row.get('table')}, rows={row.get('rows')}, possible_keys={row.get('possible_keys')})"
+                )
+            return full_scans
+        except Exception as e:
+            print(f"❌ EXPLAIN実行エラー（{label or query.strip()[:60]}）: {e}")
+            return None
+        finally:
+            session.close()
+
     def close(self):
-        """セッションと接続を閉じる"""
+        """このマネージャのセッションを閉じる（共有エンジンは破棄しない）"""
         self.SessionLocal.remove()
-        self.engine.dispose()
 # repository/database_manager.py の execute_query メソッド修正
 
     def execute_query(self, query: str, params=None):
@@ -1,18 +1,80 @@
 # app/repository/delivery_progress_repository.py
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy import text
-from typing import List, Dict, Any, Optional
-from datetime import date, datetime, time
+from typing import List, Dict, Any, Optional, Tuple
+from datetime import date, datetime, time, timedelta
+from time import perf_counter
+from collections import deque
+import threading
 import pandas as pd
 from .database_manager import DatabaseManager
+from . import progress_propagation
 
 
 class DeliveryProgressRepository:
     """納入進度データアクセス"""
     
+    # 計画進度・実績進度の計算元になる列（これらが変わったときだけ差分を伝播する）
+    PROGRESS_SOURCE_COLUMNS = ('order_quantity', 'planned_quantity', 'shipped_quantity',
+                               'product_id', 'delivery_date')
+    
+    # コミット済みの書き込みで計画入力が変わった (product_id, delivery_date) の履歴（積載計画の差分再計算用）
+    # リポジトリはセッション間で共有されるため取り出しはせず、各セッションが読んだ位置（連番）を持つ
+    CHANGE_LOG_SIZE = 10000
+    _change_log = deque(maxlen=CHANGE_LOG_SIZE)    # (連番, (product_id, delivery_date))
+    _change_seq = 0
+    _change_lock = threading.Lock()
+    
     def __init__(self, db_manager: DatabaseManager):
         self.db = db_manager
     
+    @classmethod
+    def _record_changes(cls, keys):
+        with cls._change_lock:
+            for key in keys:
+                cls._change_seq += 1
+                cls._change_log.append((cls._change_seq, key))
+    
+    @classmethod
+    def change_cursor(cls) -> int:
+        """変更履歴の現在位置"""
+        with cls._change_lock:
+            return cls._change_seq
+    
+    @classmethod
+    def changed_keys_since(cls, cursor: int) -> Tuple[Optional[set], int]:
+        """
+        cursor 以降に変わった (product_id, delivery_date) と、読み終えた位置を返す
+
+        履歴の保持件数を超えて古い位置を指定した場合、変更キーは None（全体の再計算が必要）。
+        """
+        with cls._change_lock:
+            latest = cls._change_seq
+            if cursor < latest and (not cls._change_log or cls._change_log[0][0] > cursor + 1):
+                return None, latest
+            return {key for seq, key in cls._change_log if seq > cursor}, latest
+    
+    @staticmethod
+    def _progress_key(session, progress_id: int):
+        """進度IDの (product_id, delivery_date) を行ロック付きで取得"""
+        row = session.execute(text("""
+            SELECT product_id, delivery_date FROM delivery_progress
+            WHERE id = :progress_id
+            FOR UPDATE
+        """), {'progress_id': progress_id}).fetchone()
+        if not row or row[0] is None or row[1] is None:
+            return None
+        return int(row[0]), progress_propagation.to_date(row[1])
+    
+    @staticmethod
+    def _day_deltas_for_keys(session, keys, for_update: bool = False) -> Dict:
+        deltas = {}
+        for product_id, delivery_date in keys:
+            deltas.update(progress_propagation.day_deltas(
+                session, delivery_date, delivery_date, [product_id], for_update=for_update
+            ))
+        return deltas
+    
     def get_delivery_progress(self, start_date: date = None, end_date: date = None) -> pd.DataFrame:
         """
         納入進度データ取得
@@ -123,14 +185,19 @@ class DeliveryProgressRepository:
                 SELECT *
                 FROM delivery_progress
                 WHERE product_id = :product_id
-                  AND DATE(delivery_date) = :delivery_date
+                  AND delivery_date >= :delivery_date
+                  AND delivery_date < :next_date
                 ORDER BY delivery_date, id
                 LIMIT 1
             """)
 
+            # DATE(delivery_date) = :d だと索引が使えないため半開区間で絞り込む
+            if isinstance(delivery_date, datetime):
+                delivery_date = delivery_date.date()
             result = session.execute(query, {
                 'product_id': product_id,
-                'delivery_date': delivery_date
+                'delivery_date': delivery_date,
+                'next_date': delivery_date + timedelta(days=1)
             }).fetchone()
 
             if result:
@@ -203,6 +270,11 @@ class DeliveryProgressRepository:
                 'notes': shipment_data.get('notes', '')
             }
             
+            # 出荷で変わる日の累積値を後で差分更新するため、更新前の日別増分を取得
+            key = self._progress_key(session, shipment_data['progress_id'])
+            keys = [key] if key else []
+            before = self._day_deltas_for_keys(session, keys, for_update=True)
+            
             session.execute(query, params)
             
             # 納入進度の出荷済み数量を更新（remaining_quantityを除外）
@@ -222,7 +294,11 @@ class DeliveryProgressRepository:
                 'shipped_quantity': shipment_data['shipped_quantity']
             })
             
+            # 計画進度・実績進度を同製品の同日以降へ差分伝播
+            progress_propagation.propagate(session, before, self._day_deltas_for_keys(session, keys))
+            
             session.commit()
+            self._record_changes(keys)
             return True
             
         except SQLAlchemyError as e:
@@ -323,8 +399,40 @@ class DeliveryProgressRepository:
                 WHERE id = :progress_id
             """)
             
+            # 数量・製品・納期が変わる場合は更新前後の日（移動元・移動先）の増分を比較する
+            affects_progress = any(col in update_data for col in self.PROGRESS_SOURCE_COLUMNS)
+            keys = []
+            if affects_progress:
+                old_key = self._progress_key(session, progress_id)
+                if old_key:
+                    new_key = (
+                        int(update_data.get('product_id', old_key[0])),
+                        progress_propagation.to_date(update_data.get('delivery_date', old_key[1]))
+                    )
+                    keys = [old_key] if new_key == old_key else [old_key, new_key]
+            before = self._day_deltas_for_keys(session, keys, for_update=True)
+            # 製品・納期が変わる行は、移動先の日の累積値（書き込み前）から始め直す
+            # （create_delivery_progress の新規行と同じ。移動元・移動先の増分は差分伝播で加算）
+            moved_carry = progress_propagation.carry_over(session, *keys[1]) if len(keys) == 2 else None
+            
             session.execute(query, params)
+            
+            if moved_carry is not None:
+                session.execute(text("""
+                    UPDATE delivery_progress
+                    SET planned_progress_quantity = :planned_progress_quantity,
+                        shipped_remaining_quantity = :shipped_remaining_quantity
+                    WHERE id = :progress_id
+                """), {
+                    'progress_id': progress_id,
+                    'planned_progress_quantity': moved_carry[0],
+                    'shipped_remaining_quantity': moved_carry[1]
+                })
+            if keys:
+                progress_propagation.propagate(session, before, self._day_deltas_for_keys(session, keys))
+            
             session.commit()
+            self._record_changes(keys)
             return True
             
         except SQLAlchemyError as e:
@@ -350,14 +458,27 @@ class DeliveryProgressRepository:
             query = text("""
                 INSERT INTO delivery_progress
                 (order_id, product_id, order_date, delivery_date, order_quantity,
-                 customer_code, customer_name, delivery_location, priority, notes)
+                 customer_code, customer_name, delivery_location, priority, notes,
+                 planned_progress_quantity, shipped_remaining_quantity)
                 VALUES
                 (:order_id, :product_id, :order_date, :delivery_date, :order_quantity,
-                 :customer_code, :customer_name, :delivery_location, :priority, :notes)
+                 :customer_code, :customer_name, :delivery_location, :priority, :notes,
+                 :planned_progress_quantity, :shipped_remaining_quantity)
             """)
             
-            result = session.execute(query, progress_data)
+            # 新規行は直前の累積値を引き継ぎ、当日分の増分は差分伝播で加算する
+            key = (int(progress_data['product_id']), progress_propagation.to_date(progress_data['delivery_date']))
+            before = self._day_deltas_for_keys(session, [key], for_update=True)
+            carried_pp, carried_sr = progress_propagation.carry_over(session, *key)
+            
+            result = session.execute(query, {
+                **progress_data,
+                'planned_progress_quantity': carried_pp,
+                'shipped_remaining_quantity': carried_sr
+            })
+            progress_propagation.propagate(session, before, self._day_deltas_for_keys(session, [key]))
             session.commit()
+            self._record_changes([key])
             
             return result.lastrowid
             
@@ -385,8 +506,11 @@ class DeliveryProgressRepository:
                 DELETE FROM delivery_progress WHERE id = :progress_id
             """)
             
+            key = self._progress_key(session, progress_id)
             session.execute(query, {'progress_id': progress_id})
             session.commit()
+            if key:
+                self._record_changes([key])
             return True
             
         except SQLAlchemyError as e:
@@ -396,6 +520,97 @@ class DeliveryProgressRepository:
         finally:
             session.close()
     
+    def recompute_planned_progress_all(self, start_date: date, end_date: date) -> Dict[str, Any]:
+        """
+        全製品の計画進度（planned_progress_quantity）を1文で再計算
+
+        ストアド recompute_planned_progress_by_product を製品ごとに呼ぶのと同じ結果になるよう、
+        - 製品×納期で order/planned/shipped を合算
+        - 日ごとの増分: shipped > 0 なら shipped − order、それ以外は planned − order
+        - 開始前日の先頭レコード（id最小）の値を初期値として、ウィンドウ関数で累積
+        - その日の全レコードに同じ値を反映
+        を集合演算で行う。対象は products に登録済みの製品のみ（従来の全製品ループと同じ）。
+
+        Returns:
+            Dict: products（対象製品数）, rows_changed（値が変わった行数）, elapsed_ms
+        """
+        session = self.db.get_session()
+        started = perf_counter()
+        params = {
+            'start_date': start_date,
+            'end_date': end_date,
+            'prev_date': start_date - timedelta(days=1)
+        }
+        
+        try:
+            day_totals_sql = """
+                SELECT
+                    dp.product_id,
+                    dp.delivery_date,
+                    CASE
+                        WHEN COALESCE(SUM(dp.shipped_quantity), 0) > 0
+                            THEN COALESCE(SUM(dp.shipped_quantity), 0) - COALESCE(SUM(dp.order_quantity), 0)
+                        ELSE COALESCE(SUM(dp.planned_quantity), 0) - COALESCE(SUM(dp.order_quantity), 0)
+                    END AS day_delta
+                FROM delivery_progress dp
+                JOIN products p ON p.id = dp.product_id
+                WHERE dp.delivery_date BETWEEN :start_date AND :end_date
+                GROUP BY dp.product_id, dp.delivery_date
+            """
+            
+            # 値が変わる行だけを更新（rowcount が変更行数になる）
+            update_sql = text(f"""
+                UPDATE delivery_progress dp
+                JOIN (
+                    SELECT
+                        d.product_id,
+                        d.delivery_date,
+                        COALESCE(s.seed_pp, 0) + SUM(d.day_delta) OVER (
+                            PARTITION BY d.product_id
+                            ORDER BY d.delivery_date
+                            ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW
+                        ) AS day_pp
+                    FROM ({day_totals_sql}) d
+                    LEFT JOIN (
+                        SELECT prev.product_id, COALESCE(prev.planned_progress_quantity, 0) AS seed_pp
+                        FROM delivery_progress prev
+                        JOIN (
+                            SELECT product_id, MIN(id) AS first_id
+                            FROM delivery_progress
+                            WHERE delivery_date = :prev_date
+                            GROUP BY product_id
+                        ) first_row ON first_row.first_id = prev.id
+                    ) s ON s.product_id = d.product_id
+                ) t
+                  ON dp.product_id = t.product_id
+                 AND dp.delivery_date = t.delivery_date
+                SET dp.planned_progress_quantity = t.day_pp
+                WHERE dp.delivery_date BETWEEN :start_date AND :end_date
+                  AND NOT (dp.planned_progress_quantity <=> t.day_pp)
+            """)
+            
+            product_count = session.execute(text(f"""
+                SELECT COUNT(DISTINCT product_id) FROM ({day_totals_sql}) d
+            """), params).scalar() or 0
+            rows_changed = session.execute(update_sql, params).rowcount
+            session.commit()
+            
+            report = {
+                'products': product_count,
+                'rows_changed': rows_changed,
+                'elapsed_ms': round((perf_counter() - started) * 1000, 2)
+            }
+            print(f"✅ 計画進度一括再計算: {start_date}〜{end_date}, 製品 {product_count}件, "
+                  f"変更 {rows_changed}行 ({report['elapsed_ms']}ms)")
+            return report
+            
+        except SQLAlchemyError as e:
+            session.rollback()
+            print(f"計画進度一括再計算エラー: {e}")
+            raise
+        finally:
+            session.close()
+    
     def get_progress_summary(self) -> Dict[str, Any]:
         """
         納入進度サマリーを取得
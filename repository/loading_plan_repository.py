@@ -1,9 +1,13 @@
 # app/repository/loading_plan_repository.py
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy import text
-from typing import Dict, Any, List, Optional
-from datetime import date
+import time
+from typing import Dict, Any, List, Optional, Tuple
+from datetime import date, datetime, timedelta
+import pandas as pd
+from domain.calculators.plan_frame import PlanFrame
 from .database_manager import DatabaseManager
+from . import progress_propagation
 
 
 class LoadingPlanRepository:
@@ -11,9 +15,27 @@ class LoadingPlanRepository:
     
     def __init__(self, db_manager: DatabaseManager):
         self.db = db_manager
+
     def save_loading_plan(self, plan_result: Dict[str, Any], plan_name: str = None) -> int:
-        """積載計画を保存 + delivery_progressに計画数を登録"""
+        """積載計画を保存 + delivery_progressに計画数を登録（件数・処理時間は save_loading_plan_with_report）"""
+        plan_id, _ = self.save_loading_plan_with_report(plan_result, plan_name)
+        return plan_id
+
+    def save_loading_plan_with_report(self, plan_result: Dict[str, Any],
+                                      plan_name: str = None) -> Tuple[int, Dict[str, Any]]:
+        """
+        積載計画を保存 + delivery_progressに計画数を登録
+
+        明細・警告・積載不可アイテムは executemany でまとめて INSERT し、
+        delivery_progress への計画数反映は一時テーブル経由の集合演算で行う。
+        すべて1トランザクションで実行する。
+
+        Returns:
+            (plan_id, 件数と処理時間のレポート)
+        """
         session = self.db.get_session()
+        started = time.perf_counter()
+        timings = {}
         
         try:
             # 計画名の自動生成
@@ -44,229 +66,299 @@ class LoadingPlanRepository:
             session.flush()
             plan_id = result.lastrowid
             
-            # 2. 明細保存 + delivery_progress更新用のデータを収集
+            # 2. 明細・警告・積載不可アイテムの行を組み立て、delivery_progress用に計画数を集計
             daily_plans = plan_result.get('daily_plans', {})
-            progress_updates = {}    # {product_id: {delivery_date: planned_quantity}}
-            
-            for date_str, plan in daily_plans.items():
-                for truck_plan in plan.get('trucks', []):
-                    trip_number = 1
-                    
-                    for item in truck_plan.get('loaded_items', []):
-                        # 明細保存
-                        detail_sql = text("""
-                            INSERT INTO loading_plan_detail
-                            (plan_id, loading_date, truck_id, truck_name, trip_number,
-                            product_id, product_code, product_name, container_id,
-                            num_containers, total_quantity, delivery_date,
-                            is_advanced, original_date, volume_utilization, weight_utilization)
-                            VALUES 
-                            (:plan_id, :loading_date, :truck_id, :truck_name, :trip_number,
-                            :product_id, :product_code, :product_name, :container_id,
-                            :num_containers, :total_quantity, :delivery_date,
-                            :is_advanced, :original_date, :volume_util, :weight_util)
-                        """)
-                        
-                        is_advanced = item.get('original_date') and \
-                                    item['original_date'].strftime('%Y-%m-%d') != date_str
-                        
-                        session.execute(detail_sql, {
-                            'plan_id': plan_id,
-                            'loading_date': date_str,
-                            'truck_id': truck_plan['truck_id'],
-                            'truck_name': truck_plan['truck_name'],
-                            'trip_number': trip_number,
-                            'product_id': item['product_id'],
-                            'product_code': item.get('product_code', ''),
-                            'product_name': item.get('product_name', ''),
-                            'container_id': item['container_id'],
-                            'num_containers': item['num_containers'],
-                            'total_quantity': item['total_quantity'],
-                            'delivery_date': item['delivery_date'],
-                            'is_advanced': is_advanced,
-                            'original_date': item.get('original_date'),
-                            'volume_util': truck_plan['utilization']['volume_rate'],
-                            'weight_util': truck_plan['utilization']['weight_rate']
-                        })
-                        
-                        # ✅ delivery_progress更新用データを収集
-                        product_id = item['product_id']
-                        # ✅ delivery_dateをdate型に正規化（文字列/日時の可能性に対応）
-                        delivery_date = item['delivery_date']
-                        try:
-                            from datetime import datetime as _dt
-                            if isinstance(delivery_date, str) and delivery_date:
-                                delivery_date = _dt.strptime(delivery_date, '%Y-%m-%d').date()
-                            elif hasattr(delivery_date, 'date'):
-                                delivery_date = delivery_date.date()
-                        except Exception:
-                            pass
-                        # ✅ 納期が未設定/Noneのときは loading_date（日付文字列）を使用
-                        if not delivery_date:
-                            try:
-                                from datetime import datetime as _dt
-                                delivery_date = _dt.strptime(date_str, '%Y-%m-%d').date()
-                            except Exception:
-                                delivery_date = None
-                        quantity = item['total_quantity']
-                        
-                        key = (product_id, delivery_date)
-                        if key not in progress_updates:
-                            progress_updates[key] = {
-                                'product_id': product_id,
-                                'delivery_date': delivery_date,
-                                'planned_quantity': 0,
-                                'loading_date': date_str,
-                                'truck_id': truck_plan['truck_id']
-                            }
-                        # デバッグ: 各アイテムの集計前の数量を出力
-                        print(f"[DEBUG] accumulate item - product_id={product_id}, delivery_date={delivery_date}, quantity={quantity}")
-                        progress_updates[key]['planned_quantity'] += quantity
-
-            # デバッグ: 収集した progress_updates の内容を出力
-            print(f"[DEBUG] progress_updates collected: {progress_updates}")
-
-            # ✅ 3. 計画期間内のplanned_quantityを一旦0にリセット（今回未計画分を0化）
-            try:
-                reset_sql = text("""
-                    UPDATE delivery_progress
-                    SET planned_quantity = 0,
-                        status = CASE 
-                            WHEN shipped_quantity >= order_quantity THEN '出荷完了'
-                            WHEN shipped_quantity > 0 THEN '一部出荷'
-                            ELSE status
-                        END
-                    WHERE DATE(delivery_date) BETWEEN :start_date AND :end_date
-                """)
-                session.execute(reset_sql, {
-                    'start_date': start_date,
-                    'end_date': end_date
-                })
-                print(f"[DEBUG] reset planned_quantity to 0 between {start_date} and {end_date}")
-            except Exception as _:
-                pass
-
-            # ✅ 4. delivery_progressに計画数を登録/更新
-            for (product_id, delivery_date), update_data in progress_updates.items():
-                # 既存のdelivery_progressレコードを検索（納期が未設定なら積載日で照合）
-                check_sql = text("""
-                    SELECT id, order_quantity, planned_quantity 
-                    FROM delivery_progress
-                    WHERE product_id = :product_id 
-                    AND DATE(delivery_date) = :delivery_date
-                """)
-                
-                existing_rows = session.execute(check_sql, {
-                    'product_id': product_id,
-                    'delivery_date': delivery_date
-                }).fetchall()
-
-                # デバッグ: 検索結果を出力
-                print(f"[DEBUG] existing_rows for product_id={product_id}, delivery_date={delivery_date}: {existing_rows}")
-                
-                if existing_rows:
-                    # 既存レコードを更新
-                    update_sql = text("""
-                        UPDATE delivery_progress
-                        SET planned_quantity = :planned_quantity,
-                            order_quantity = CASE 
-                                WHEN (order_quantity IS NULL OR order_quantity = 0) THEN :planned_quantity
-                                ELSE order_quantity
-                            END,
-                            status = CASE 
-                                WHEN shipped_quantity >= order_quantity THEN '出荷完了'
-                                WHEN shipped_quantity > 0 THEN '一部出荷'
-                                ELSE '計画済'
-                            END
-                        WHERE id = :progress_id
-                    """)
-                    session.execute(update_sql, {
-                        'progress_id': existing_rows[0][0],
-                        'planned_quantity': update_data['planned_quantity']
-                    })
-
-                    # デバッグ: 更新処理の内容を出力
-                    # existing_rows[0] = (id, order_quantity, planned_quantity)
-                    try:
-                        old_planned = existing_rows[0][2]
-                    except Exception:
-                        old_planned = None
-                    print(f"[DEBUG] update progress id={existing_rows[0][0]}: old_planned_quantity={old_planned} -> new_planned_quantity={update_data['planned_quantity']}")
-                else:
-                    # 新規レコードを作成（オーダーIDを自動生成）
-                    order_id = f"PLAN-{delivery_date.strftime('%Y%m%d')}-{product_id:04d}"
-                    
-                    insert_sql = text("""
-                        INSERT INTO delivery_progress
-                        (order_id, product_id, delivery_date, order_quantity, 
-                        planned_quantity, shipped_quantity, status, notes)
-                        VALUES
-                        (:order_id, :product_id, :delivery_date, :order_quantity,
-                        :planned_quantity, 0, '計画済', :notes)
-                    """)
-                    
-                    session.execute(insert_sql, {
-                        'order_id': order_id,
-                        'product_id': product_id,
-                        'delivery_date': delivery_date,
-                        'order_quantity': update_data['planned_quantity'],
-                        'planned_quantity': update_data['planned_quantity'],
-                        'notes': f"積載計画ID:{plan_id} より自動登録"
-                    })
-
-                    # デバッグ: 新規作成の内容を出力
-                    print(f"[DEBUG] insert new progress: order_id={order_id}, product_id={product_id}, delivery_date={delivery_date}, order_quantity={update_data['planned_quantity']}, planned_quantity={update_data['planned_quantity']}")
-            
-            # 4. 警告保存
-            for date_str, plan in daily_plans.items():
-                for warning in plan.get('warnings', []):
-                    warning_sql = text("""
-                        INSERT INTO loading_plan_warnings
-                        (plan_id, warning_date, warning_type, warning_message)
-                        VALUES (:plan_id, :warning_date, :warning_type, :warning_message)
-                    """)
-                    
-                    warning_type = '前倒し' if '前倒し' in warning else '容量不足'
-                    
-                    session.execute(warning_sql, {
-                        'plan_id': plan_id,
-                        'warning_date': date_str,
-                        'warning_type': warning_type,
-                        'warning_message': warning
-                    })
-            
-            # 5. 積載不可アイテム保存
-            unloaded_tasks = plan_result.get('unloaded_tasks', [])
-            for task in unloaded_tasks:
-                unloaded_sql = text("""
+            detail_rows, progress_updates = self._build_detail_rows(plan_id, PlanFrame.of(plan_result))
+            warning_rows = self._build_warning_rows(plan_id, daily_plans)
+            unloaded_rows = self._build_unloaded_rows(plan_id, plan_result.get('unloaded_tasks', []))
+            timings['build_ms'] = self._elapsed_ms(started)
+            
+            # 3. 明細保存（複数行INSERT）
+            step_started = time.perf_counter()
+            if detail_rows:
+                session.execute(text("""
+                    INSERT INTO loading_plan_detail
+                    (plan_id, loading_date, truck_id, truck_name, trip_number,
+                    product_id, product_code, product_name, container_id,
+                    num_containers, total_quantity, delivery_date,
+                    is_advanced, original_date, volume_utilization, weight_utilization)
+                    VALUES 
+                    (:plan_id, :loading_date, :truck_id, :truck_name, :trip_number,
+                    :product_id, :product_code, :product_name, :container_id,
+                    :num_containers, :total_quantity, :delivery_date,
+                    :is_advanced, :original_date, :volume_util, :weight_util)
+                """), detail_rows)
+            timings['detail_ms'] = self._elapsed_ms(step_started)
+            
+            # 4. delivery_progressに計画数を登録/更新（一時テーブル経由）
+            step_started = time.perf_counter()
+            progress_counts = self._upsert_planned_progress(
+                session, plan_id, progress_updates, start_date, end_date
+            )
+            timings['progress_ms'] = self._elapsed_ms(step_started)
+            
+            # 5. 警告保存
+            step_started = time.perf_counter()
+            if warning_rows:
+                session.execute(text("""
+                    INSERT INTO loading_plan_warnings
+                    (plan_id, warning_date, warning_type, warning_message)
+                    VALUES (:plan_id, :warning_date, :warning_type, :warning_message)
+                """), warning_rows)
+            
+            # 6. 積載不可アイテム保存
+            if unloaded_rows:
+                session.execute(text("""
                     INSERT INTO loading_plan_unloaded
                     (plan_id, product_id, product_code, product_name, container_id,
                     num_containers, total_quantity, delivery_date, reason)
                     VALUES
                     (:plan_id, :product_id, :product_code, :product_name, :container_id,
                     :num_containers, :total_quantity, :delivery_date, '積載容量不足')
-                """)
-                
-                session.execute(unloaded_sql, {
-                    'plan_id': plan_id,
-                    'product_id': task['product_id'],
-                    'product_code': task.get('product_code', ''),
-                    'product_name': task.get('product_name', ''),
-                    'container_id': task.get('container_id'),
-                    'num_containers': task.get('num_containers'),
-                    'total_quantity': task.get('total_quantity'),
-                    'delivery_date': task.get('delivery_date')
-                })
+                """), unloaded_rows)
+            timings['warning_unloaded_ms'] = self._elapsed_ms(step_started)
             
             session.commit()
-            return plan_id
+            timings['total_ms'] = self._elapsed_ms(started)
+            
+            report = {
+                'plan_id': plan_id,
+                'detail_rows': len(detail_rows),
+                'warning_rows': len(warning_rows),
+                'unloaded_rows': len(unloaded_rows),
+                **progress_counts,
+                'timings': timings,
+            }
+            print(
+                f"✅ 積載計画保存: plan_id={plan_id}, 明細 {len(detail_rows)}件, "
+                f"警告 {len(warning_rows)}件, 積載不可 {len(unloaded_rows)}件, "
+                f"進度 更新 {progress_counts['progress_updated']}件/新規 {progress_counts['progress_inserted']}件 "
+                f"({timings['total_ms']}ms)"
+            )
+            return plan_id, report
             
         except SQLAlchemyError as e:
             session.rollback()
             print(f"積載計画保存エラー: {e}")
             raise
         finally:
-            session.close()    
+            session.close()
+
+    @staticmethod
+    def _elapsed_ms(started: float) -> float:
+        return round((time.perf_counter() - started) * 1000, 2)
+
+    @staticmethod
+    def _normalize_date(value) -> Optional[date]:
+        """文字列/日時をdate型に正規化（変換できなければそのまま返す）"""
+        try:
+            if isinstance(value, str) and value:
+                return datetime.strptime(value, '%Y-%m-%d').date()
+            if isinstance(value, datetime):
+                return value.date()
+            if hasattr(value, 'date') and not isinstance(value, date):
+                return value.date()
+        except Exception:
+            pass
+        return value
+
+    def _build_detail_rows(self, plan_id: int, plan_frame: PlanFrame):
+        """loading_plan_detail の行と、(product_id, delivery_date) 別の計画数を作成"""
+        items = plan_frame.items
+        if items.empty:
+            return [], {}
+        
+        original_dates = items['original_date_str']
+        detail_df = pd.DataFrame({
+            'plan_id': plan_id,
+            'loading_date': items['loading_date'],
+            'truck_id': items['truck_id'],
+            'truck_name': items['truck_name'],
+            'trip_number': 1,
+            'product_id': items['product_id'],
+            'product_code': items['product_code'],
+            'product_name': items['product_name'],
+            'container_id': items['container_id'],
+            'num_containers': items['num_containers'],
+            'total_quantity': items['total_quantity'],
+            'delivery_date': items['delivery_date'],
+            'is_advanced': (original_dates != '') & (original_dates != items['loading_date']),
+            'original_date': items['original_date'],
+            'volume_util': items['volume_rate'],
+            'weight_util': items['weight_rate']
+        })
+        detail_rows = detail_df.to_dict('records')
+        
+        # ✅ 納期が未設定/Noneのときは loading_date（日付文字列）を使用
+        delivery_keys = items['delivery_date'].map(self._normalize_date)
+        delivery_keys = delivery_keys.where(
+            delivery_keys.astype(bool), items['loading_date'].map(self._normalize_date)
+        )
+        planned = items['total_quantity'].groupby(
+            [items['product_id'], delivery_keys], sort=False, dropna=False
+        ).sum()
+        # {(product_id, delivery_date): planned_quantity}
+        progress_updates = dict(zip(planned.index.tolist(), planned.tolist()))
+        
+        return detail_rows, progress_updates
+
+    @staticmethod
+    def _build_warning_rows(plan_id: int, daily_plans: Dict[str, Any]) -> List[Dict[str, Any]]:
+        rows = []
+        for date_str, plan in daily_plans.items():
+            for warning in plan.get('warnings', []):
+                rows.append({
+                    'plan_id': plan_id,
+                    'warning_date': date_str,
+                    'warning_type': '前倒し' if '前倒し' in warning else '容量不足',
+                    'warning_message': warning
+                })
+        return rows
+
+    @staticmethod
+    def _build_unloaded_rows(plan_id: int, unloaded_tasks: List[Dict]) -> List[Dict[str, Any]]:
+        return [{
+            'plan_id': plan_id,
+            'product_id': task['product_id'],
+            'product_code': task.get('product_code', ''),
+            'product_name': task.get('product_name', ''),
+            'container_id': task.get('container_id'),
+            'num_containers': task.get('num_containers'),
+            'total_quantity': task.get('total_quantity'),
+            'delivery_date': task.get('delivery_date')
+        } for task in unloaded_tasks]
+
+    def _upsert_planned_progress(self, session, plan_id: int, progress_updates: Dict,
+                                 start_date: str, end_date: str) -> Dict[str, int]:
+        """
+        計画数を delivery_progress に反映（呼び出し元のトランザクション内で実行）
+
+        1. 計画期間内の planned_quantity を0にリセット（今回未計画分を0化）
+        2. 集計済みの計画数を一時テーブルに複数行INSERT
+        3. 既存レコード（製品×納期で最小のid）を一時テーブルに紐付けてJOIN UPDATE
+        4. 紐付かなかった分を INSERT ... SELECT で新規登録
+        5. 変化した日の計画進度・実績進度を同製品の同日以降へ差分伝播
+        """
+        # 差分伝播用に、書き込み前の日別増分を取得（リセット範囲＋今回の計画の納期）
+        range_start = self._normalize_date(start_date)
+        range_end = self._normalize_date(end_date)
+        if progress_updates:
+            planned_dates = [delivery_date for _, delivery_date in progress_updates]
+            range_start = min([range_start] + planned_dates)
+            range_end = max([range_end] + planned_dates)
+        before = progress_propagation.day_deltas(session, range_start, range_end, for_update=True)
+        
+        reset_result = session.execute(text("""
+            UPDATE delivery_progress
+            SET planned_quantity = 0,
+                status = CASE 
+                    WHEN shipped_quantity >= order_quantity THEN '出荷完了'
+                    WHEN shipped_quantity > 0 THEN '一部出荷'
+                    ELSE status
+                END
+            WHERE delivery_date >= :start_date
+              AND delivery_date < :end_date_exclusive
+        """), {
+            'start_date': start_date,
+            'end_date_exclusive': self._normalize_date(end_date) + timedelta(days=1)
+        })
+        counts = {
+            'progress_reset': reset_result.rowcount,
+            'progress_updated': 0,
+            'progress_inserted': 0,
+        }
+        if progress_updates:
+            self._stage_planned_progress(session, plan_id, progress_updates, counts)
+        
+        propagated = progress_propagation.propagate(
+            session, before, progress_propagation.day_deltas(session, range_start, range_end)
+        )
+        counts['progress_propagated_days'] = propagated['changed_days']
+        return counts
+
+    @staticmethod
+    def _stage_planned_progress(session, plan_id: int, progress_updates: Dict, counts: Dict[str, int]):
+        """一時テーブル経由で計画数を既存レコードへ反映し、未登録分を新規作成"""
+        # 一時テーブルは接続単位なので、プール再利用時の残骸を先に消しておく
+        session.execute(text("DROP TEMPORARY TABLE IF EXISTS tmp_plan_progress"))
+        session.execute(text("""
+            CREATE TEMPORARY TABLE tmp_plan_progress (
+                product_id INT NOT NULL,
+                delivery_date DATE NOT NULL,
+                planned_quantity INT NOT NULL,
+                order_id VARCHAR(50) NOT NULL,
+                progress_id INT NULL,
+                PRIMARY KEY (product_id, delivery_date)
+            )
+        """))
+        
+        staging_rows = [{
+            'product_id': product_id,
+            'delivery_date': delivery_date,
+            'planned_quantity': planned_quantity,
+            # 新規レコード用のオーダーIDは従来どおりPython側で生成
+            'order_id': f"PLAN-{delivery_date.strftime('%Y%m%d')}-{product_id:04d}"
+        } for (product_id, delivery_date), planned_quantity in progress_updates.items()]
+        session.execute(text("""
+            INSERT INTO tmp_plan_progress
+            (product_id, delivery_date, planned_quantity, order_id)
+            VALUES (:product_id, :delivery_date, :planned_quantity, :order_id)
+        """), staging_rows)
+        
+        # 既存レコードの紐付け（同じ製品×納期が複数あるときは従来どおり先頭の1件）
+        session.execute(text("""
+            UPDATE tmp_plan_progress t
+            SET t.progress_id = (
+                SELECT MIN(dp.id)
+                FROM delivery_progress dp
+                WHERE dp.product_id = t.product_id
+                  AND dp.delivery_date >= t.delivery_date
+                  AND dp.delivery_date < t.delivery_date + INTERVAL 1 DAY
+            )
+        """))
+        
+        update_result = session.execute(text("""
+            UPDATE delivery_progress dp
+            JOIN tmp_plan_progress t ON dp.id = t.progress_id
+            SET dp.planned_quantity = t.planned_quantity,
+                dp.order_quantity = CASE 
+                    WHEN (dp.order_quantity IS NULL OR dp.order_quantity = 0) THEN t.planned_quantity
+                    ELSE dp.order_quantity
+                END,
+                -- 複数テーブルUPDATEは代入順が保証されないため、更新後の受注数を式で求めて判定する
+                dp.status = CASE 
+                    WHEN dp.shipped_quantity >= COALESCE(NULLIF(dp.order_quantity, 0), t.planned_quantity) THEN '出荷完了'
+                    WHEN dp.shipped_quantity > 0 THEN '一部出荷'
+                    ELSE '計画済'
+                END
+        """))
+        
+        insert_result = session.execute(text("""
+            INSERT INTO delivery_progress
+            (order_id, product_id, delivery_date, order_quantity, 
+            planned_quantity, shipped_quantity, status, notes,
+            planned_progress_quantity, shipped_remaining_quantity)
+            SELECT t.order_id, t.product_id, t.delivery_date, t.planned_quantity,
+                   t.planned_quantity, 0, '計画済', :notes,
+                   -- 直前の累積値を引き継ぐ（当日分は差分伝播で加算）
+                   COALESCE((
+                       SELECT c.planned_progress_quantity FROM delivery_progress c
+                       WHERE c.product_id = t.product_id AND c.delivery_date <= t.delivery_date
+                       ORDER BY c.delivery_date DESC, c.id LIMIT 1
+                   ), 0),
+                   COALESCE((
+                       SELECT c.shipped_remaining_quantity FROM delivery_progress c
+                       WHERE c.product_id = t.product_id AND c.delivery_date <= t.delivery_date
+                       ORDER BY c.delivery_date DESC, c.id LIMIT 1
+                   ), 0)
+            FROM tmp_plan_progress t
+            WHERE t.progress_id IS NULL
+        """), {'notes': f"積載計画ID:{plan_id} より自動登録"})
+        
+        session.execute(text("DROP TEMPORARY TABLE IF EXISTS tmp_plan_progress"))
+        
+        counts['progress_updated'] = update_result.rowcount
+        counts['progress_inserted'] = insert_result.rowcount
 
     
    
@@ -493,7 +585,8 @@ class LoadingPlanRepository:
             plan_id = latest_plan[0]
             params = {
                 'plan_id': plan_id,
-                'loading_date': loading_date.strftime('%Y-%m-%d')
+                'loading_date': loading_date.strftime('%Y-%m-%d'),
+                'next_loading_date': (loading_date + timedelta(days=1)).strftime('%Y-%m-%d')
             }
 
             detail_sql = """
@@ -514,7 +607,8 @@ class LoadingPlanRepository:
                     original_date
                 FROM loading_plan_detail
                 WHERE plan_id = :plan_id
-                  AND DATE(loading_date) = :loading_date
+                  AND loading_date >= :loading_date
+                  AND loading_date < :next_loading_date
             """
 
             if truck_id:
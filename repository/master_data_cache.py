@@ -0,0 +1,181 @@
+# app/repository/master_data_cache.py
+"""
+マスタデータ（製品・容器・トラック・トラック×容器ルール）のスナップショットキャッシュ
+
+ページ表示や計画実行のたびに同じマスタを読み直さないよう、プロセス内で1つの
+スナップショットを共有する。スナップショットにはテーブルごとのデータ版数
+（DatabaseManager.data_versions）を付けておき、版数が進んだ部分だけを読み直す。
+版数は create/update/delete などのコミット済みの書き込みで進む。
+版数はこのプロセス内の書き込みしか数えないため、他プロセスやDBを直接更新した
+変更は、スナップショットの有効期限（APP_CONFIG.master_snapshot_ttl_sec）切れで全体を読み直して反映する。
+
+スナップショットは読み取り専用:
+- 容器は属性を変更できない名前空間、ルール・トラック・製品の行は MappingProxyType
+- DataFrame は共有しているため、変更する場合は copy() してから使う
+  （ProductRepository.get_all_products などの従来の取得メソッドはコピーを返す）
+"""
+import threading
+import time
+from dataclasses import dataclass
+from types import MappingProxyType, SimpleNamespace
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+import pandas as pd
+
+from config import APP_CONFIG
+from .database_manager import DatabaseManager
+
+# スナップショットの各部分と、その読み込み元テーブル
+MASTER_TABLES = ('products', 'container_capacity', 'truck_master', 'truck_container_rules')
+
+
+class FrozenContainer(SimpleNamespace):
+    """属性を変更できない容器（get_containers の SimpleNamespace と同じ属性を持つ）"""
+
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"マスタのスナップショットは変更できません: {name}")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"マスタのスナップショットは変更できません: {name}")
+
+
+@dataclass(frozen=True)
+class MasterDataSnapshot:
+    """マスタデータのスナップショットと参照用マップ（読み取り専用）"""
+    versions: Tuple[int, ...]
+    products_df: pd.DataFrame
+    containers: Tuple[FrozenContainer, ...]
+    trucks_df: pd.DataFrame
+    truck_container_rules: Tuple[Mapping[str, Any], ...]
+    container_by_id: Mapping[int, FrozenContainer]
+    truck_by_id: Mapping[int, Mapping[str, Any]]
+    product_by_id: Mapping[int, Mapping[str, Any]]
+    product_by_code: Mapping[str, Mapping[str, Any]]
+
+    def truck_name_by_id(self) -> Dict[int, Any]:
+        return {truck_id: truck.get('name') for truck_id, truck in self.truck_by_id.items()}
+
+    def container_name_by_id(self) -> Dict[int, Any]:
+        return {container_id: container.name for container_id, container in self.container_by_id.items()}
+
+
+# キャッシュキー → (全体を読み込んだ時刻, スナップショット)
+_snapshots: Dict[str, Tuple[float, MasterDataSnapshot]] = {}
+_lock = threading.Lock()
+
+
+def _cache_key(db_manager) -> str:
+    engine = getattr(db_manager, 'engine', None)
+    return str(engine.url) if engine is not None else str(id(db_manager))
+
+
+def _rows_by_id(df: pd.DataFrame) -> Dict[int, Mapping[str, Any]]:
+    rows = {}
+    if df is None or df.empty or 'id' not in df.columns:
+        return rows
+    for row in df.to_dict('records'):
+        if pd.isna(row['id']):
+            continue
+        rows[int(row['id'])] = MappingProxyType(row)
+    return rows
+
+
+def get_snapshot(db_manager) -> MasterDataSnapshot:
+    """
+    最新のマスタスナップショットを取得
+
+    前回のスナップショットから版数が進んだテーブルの部分だけを読み直す。
+    版数は読み込み前に取得するため、読み込み中の書き込みは次回の取得で反映される。
+    有効期限を過ぎたスナップショットは版数にかかわらず全体を読み直す。
+    """
+    # リポジトリがこのモジュールを使うため、読み込み側はここで import する
+    from .product_repository import ProductRepository
+    from .transport_repository import TransportRepository
+
+    key = _cache_key(db_manager)
+    versions = DatabaseManager.data_versions(MASTER_TABLES)
+    now = time.monotonic()
+    with _lock:
+        entry = _snapshots.get(key)
+    previous: Optional[MasterDataSnapshot] = None
+    loaded_at = now
+    if entry is not None and now - entry[0] <= APP_CONFIG.master_snapshot_ttl_sec:
+        loaded_at, previous = entry
+    if previous is not None and previous.versions == versions:
+        return previous
+
+    def unchanged(index):
+        # versions[0] は全テーブル共通の版数
+        return (previous is not None and previous.versions[0] == versions[0]
+                and previous.versions[index + 1] == versions[index + 1])
+
+    complete = True
+
+    def load(label, loader, empty):
+        # 読み込みに失敗した部分は空で返し、スナップショットは保存しない（次回読み直す）
+        nonlocal complete
+        try:
+            return loader()
+        except Exception as e:
+            print(f"⚠️ マスタ取得エラー（{label}）: {e}")
+            complete = False
+            return empty
+
+    transport_repo = TransportRepository(db_manager)
+    if unchanged(0):
+        products_df = previous.products_df
+        product_by_id = previous.product_by_id
+        product_by_code = previous.product_by_code
+    else:
+        products_df = load('製品', ProductRepository(db_manager).load_all_products, pd.DataFrame())
+        product_by_id = MappingProxyType(_rows_by_id(products_df))
+        product_by_code = MappingProxyType({
+            str(row['product_code']): row for row in product_by_id.values() if row.get('product_code') is not None
+        })
+    if unchanged(1):
+        containers = previous.containers
+        container_by_id = previous.container_by_id
+    else:
+        containers = tuple(FrozenContainer(**vars(c)) for c in load('容器', transport_repo.load_containers, []))
+        container_by_id = MappingProxyType({c.id: c for c in containers})
+    if unchanged(2):
+        trucks_df = previous.trucks_df
+        truck_by_id = previous.truck_by_id
+    else:
+        trucks_df = load('トラック', transport_repo.load_trucks, pd.DataFrame())
+        truck_by_id = MappingProxyType(_rows_by_id(trucks_df))
+    if unchanged(3):
+        truck_container_rules = previous.truck_container_rules
+    else:
+        truck_container_rules = tuple(
+            MappingProxyType(rule)
+            for rule in load('トラック×容器ルール', transport_repo.load_truck_container_rules, [])
+        )
+
+    snapshot = MasterDataSnapshot(
+        versions=versions,
+        products_df=products_df,
+        containers=containers,
+        trucks_df=trucks_df,
+        truck_container_rules=truck_container_rules,
+        container_by_id=container_by_id,
+        truck_by_id=truck_by_id,
+        product_by_id=product_by_id,
+        product_by_code=product_by_code
+    )
+    if complete:
+        with _lock:
+            # 一部だけ読み直した場合、残りの部分は前回の読み込み時刻のまま
+            _snapshots[key] = (loaded_at, snapshot)
+    return snapshot
+
+
+def invalidate(db_manager=None):
+    """スナップショットを破棄（DBを直接更新した場合など、版数で検知できない変更の反映用）"""
+    with _lock:
+        if db_manager is None:
+            _snapshots.clear()
+        else:
+            _snapshots.pop(_cache_key(db_manager), None)
@@ -6,6 +6,7 @@ from sqlalchemy.orm import declarative_base
 import pandas as pd
 from typing import Optional
 from .database_manager import DatabaseManager
+from . import master_data_cache
 
 Base = declarative_base()
 
@@ -52,20 +53,9 @@ class ProductRepository:
         self.db = db_manager
 
     def get_all_products(self):
-        """全製品を取得"""
+        """全製品を取得（マスタスナップショットのコピー）"""
         try:
-            query = """
-            SELECT 
-                id, product_code, product_name, 
-                used_container_id, used_truck_ids,
-                capacity, inspection_category, can_advance
-            FROM products
-            ORDER BY product_code
-            """
-            
-            result = self.db.execute_query(query)
-            
-            print(f"🔍 デバッグ: 製品データ取得 - {len(result)}件")
+            result = master_data_cache.get_snapshot(self.db).products_df.copy()
             
             if result.empty:
                 print("⚠️ 警告: 製品データが0件")
@@ -75,6 +65,26 @@ class ProductRepository:
         except Exception as e:
             print(f"❌ 製品データ取得エラー: {e}")
             return pd.DataFrame()
+
+    def load_all_products(self) -> pd.DataFrame:
+        """全製品をDBから取得（エラーは呼び出し元へ）"""
+        session = self.db.get_session()
+        try:
+            result = session.execute(text("""
+            SELECT 
+                id, product_code, product_name, 
+                used_container_id, used_truck_ids,
+                capacity, inspection_category, can_advance
+            FROM products
+            ORDER BY product_code
+            """))
+            rows = result.fetchall()
+            
+            print(f"🔍 デバッグ: 製品データ取得 - {len(rows)}件")
+            
+            return pd.DataFrame(rows, columns=list(result.keys()))
+        finally:
+            session.close()
     
     def get_product_constraints(self) -> pd.DataFrame:
         """製品制約取得"""
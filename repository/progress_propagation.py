@@ -0,0 +1,145 @@
+# app/repository/progress_propagation.py
+"""
+計画進度・実績進度の差分伝播
+
+planned_progress_quantity / shipped_remaining_quantity は製品ごとの日別累積値
+（ストアド recompute_*_by_product と同じ定義）:
+    計画進度の増分 = (shipped > 0 なら shipped、それ以外は planned) − order
+    実績進度の増分 = shipped − order
+    （いずれも製品×納期で合算した値）
+
+1行の更新で変わるのはその日の増分だけなので、書き込み前後の日別増分を比較し、
+差分を同じ製品の同日以降の全レコードに加算すれば全期間の再計算は不要になる。
+呼び出し元のトランザクション内で使う（commit は呼び出し元）。
+
+前提: 既存の累積値が一度は再計算ボタンで整合していること。
+"""
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import text
+
+DayKey = Tuple[int, date]
+
+
+def to_date(value) -> Optional[date]:
+    """文字列/日時をdate型に正規化"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, str) and value:
+        return datetime.strptime(value[:10], '%Y-%m-%d').date()
+    return value
+
+
+def day_deltas(session, start_date, end_date, product_ids: Iterable[int] = None,
+               for_update: bool = False) -> Dict[DayKey, Tuple[int, int]]:
+    """
+    製品×納期ごとの (計画進度の増分, 実績進度の増分) を取得
+
+    for_update=True のときは対象行をロックする（書き込み前の取得で使用）
+    """
+    start_date = to_date(start_date)
+    end_date = to_date(end_date)
+    params = {'start_date': start_date, 'end_date_exclusive': end_date + timedelta(days=1)}
+    product_filter = ''
+    if product_ids is not None:
+        product_ids = sorted({int(pid) for pid in product_ids if pid is not None})
+        if not product_ids:
+            return {}
+        placeholders = ', '.join(f":pid_{i}" for i in range(len(product_ids)))
+        product_filter = f"AND product_id IN ({placeholders})"
+        params.update({f"pid_{i}": pid for i, pid in enumerate(product_ids)})
+
+    if for_update:
+        # 集計クエリには FOR UPDATE を付けられないため、先に対象行をロックする
+        session.execute(text(f"""
+            SELECT id FROM delivery_progress
+            WHERE delivery_date >= :start_date
+              AND delivery_date < :end_date_exclusive
+              {product_filter}
+            FOR UPDATE
+        """), params)
+
+    rows = session.execute(text(f"""
+        SELECT
+            product_id,
+            delivery_date,
+            COALESCE(SUM(order_quantity), 0) AS order_total,
+            COALESCE(SUM(planned_quantity), 0) AS planned_total,
+            COALESCE(SUM(shipped_quantity), 0) AS shipped_total
+        FROM delivery_progress
+        WHERE delivery_date >= :start_date
+          AND delivery_date < :end_date_exclusive
+          {product_filter}
+        GROUP BY product_id, delivery_date
+    """), params).fetchall()
+
+    deltas = {}
+    for product_id, delivery_date, order_total, planned_total, shipped_total in rows:
+        order_total = int(order_total)
+        shipped_total = int(shipped_total)
+        progress = shipped_total if shipped_total > 0 else int(planned_total)
+        deltas[(int(product_id), to_date(delivery_date))] = (
+            progress - order_total,
+            shipped_total - order_total
+        )
+    return deltas
+
+
+def carry_over(session, product_id: int, delivery_date) -> Tuple[int, int]:
+    """
+    新規行の初期値（同製品で納期がその日以前の直近レコードの累積値、なければ0）
+
+    新規行を INSERT する前に取得し、その後 propagate() で当日分の増分を加算する。
+    """
+    row = session.execute(text("""
+        SELECT
+            COALESCE(planned_progress_quantity, 0),
+            COALESCE(shipped_remaining_quantity, 0)
+        FROM delivery_progress
+        WHERE product_id = :product_id
+          AND delivery_date < :next_date
+        ORDER BY delivery_date DESC, id
+        LIMIT 1
+    """), {
+        'product_id': product_id,
+        'next_date': to_date(delivery_date) + timedelta(days=1)
+    }).fetchone()
+    if not row:
+        return 0, 0
+    return int(row[0]), int(row[1])
+
+
+def propagate(session, before: Dict[DayKey, Tuple[int, int]],
+              after: Dict[DayKey, Tuple[int, int]]) -> Dict[str, int]:
+    """
+    書き込み前後の日別増分の差を、同製品の同日以降のレコードに加算
+
+    Returns:
+        Dict: changed_days（差分のあった製品×日数）, rows_updated（加算した延べ行数）
+    """
+    params = []
+    for key in set(before) | set(after):
+        old_pp, old_sr = before.get(key, (0, 0))
+        new_pp, new_sr = after.get(key, (0, 0))
+        if new_pp == old_pp and new_sr == old_sr:
+            continue
+        product_id, delivery_date = key
+        params.append({
+            'product_id': product_id,
+            'delivery_date': delivery_date,
+            'pp_diff': new_pp - old_pp,
+            'sr_diff': new_sr - old_sr
+        })
+
+    if not params:
+        return {'changed_days': 0, 'rows_updated': 0}
+
+    result = session.execute(text("""
+        UPDATE delivery_progress
+        SET planned_progress_quantity = COALESCE(planned_progress_quantity, 0) + :pp_diff,
+            shipped_remaining_quantity = COALESCE(shipped_remaining_quantity, 0) + :sr_diff
+        WHERE product_id = :product_id
+          AND delivery_date >= :delivery_date
+    """), params)
+    return {'changed_days': len(params), 'rows_updated': max(result.rowcount, 0)}
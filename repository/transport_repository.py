@@ -1,6 +1,7 @@
 from sqlalchemy.exc import SQLAlchemyError
 from typing import Optional, List, Dict, Any
 from repository.database_manager import DatabaseManager
+from repository import master_data_cache
 from domain.models.transport import Container, Truck, TruckContainerRule , TransportConstraint
 import pandas as pd
 from datetime import datetime, date, timedelta
@@ -14,7 +15,18 @@ class TransportRepository:
 
 
     def get_containers(self):
-        """容器一覧取得 - 全カラムを確実に取得"""
+        """容器一覧取得（マスタスナップショットから、変更可能なコピーを返す）"""
+        try:
+            from types import SimpleNamespace
+            return [SimpleNamespace(**vars(c)) for c in master_data_cache.get_snapshot(self.db_manager).containers]
+        except Exception as e:
+            print(f"Container取得エラー: {e}")
+            import traceback
+            traceback.print_exc()
+            return []
+
+    def load_containers(self):
+        """容器一覧をDBから取得 - 全カラムを確実に取得（エラーは呼び出し元へ）"""
         session = self.db_manager.get_session()
         try:
             query = text("""
@@ -50,11 +62,6 @@ class TransportRepository:
             
             return containers
             
-        except Exception as e:
-            print(f"Container取得エラー: {e}")
-            import traceback
-            traceback.print_exc()
-            return []
         finally:
             session.close()
    
@@ -76,7 +83,15 @@ class TransportRepository:
 
 
     def get_trucks(self) -> pd.DataFrame:
-        """トラック一覧取得 - DataFrame で返す"""
+        """トラック一覧取得 - DataFrame で返す（マスタスナップショットのコピー）"""
+        try:
+            return master_data_cache.get_snapshot(self.db_manager).trucks_df.copy()
+        except Exception as e:
+            print(f"truck_masterテーブル取得エラー: {e}")
+            return pd.DataFrame()
+
+    def load_trucks(self) -> pd.DataFrame:
+        """トラック一覧をDBから取得（エラーは呼び出し元へ）"""
         session = self.db_manager.get_session()
         try:
             trucks = session.query(Truck).all()
@@ -94,9 +109,6 @@ class TransportRepository:
                 # 追加：優先積載製品コードを含める
                 "priority_product_codes": t.priority_product_codes
             } for t in trucks])
-        except SQLAlchemyError as e:
-            print(f"truck_masterテーブル取得エラー: {e}")
-            return pd.DataFrame()
         finally:
             session.close()
 
@@ -203,46 +215,46 @@ class TransportRepository:
     # トラックと容器はサイズベースで計算するため、ルールは必須ではない
     # そのため、ルールが無くてもエラーにしないように修正
     def get_truck_container_rules(self):
-        """トラック×容器ルールを取得 - 安全な実装"""
+        """トラック×容器ルールを取得 - 安全な実装（マスタスナップショットのコピー）"""
         try:
-            query = """
-            SELECT 
-                id,
-                truck_id,
-                container_id,
-                max_quantity,
-                stack_count,
-                priority,
-                created_at
-            FROM truck_container_rules
-            ORDER BY truck_id, container_id
-            """
-            
-            # ✅ 修正
-            result = self.db_manager.execute_query(query)
-            
-            if result.empty:
+            rules = [dict(rule) for rule in master_data_cache.get_snapshot(self.db_manager).truck_container_rules]
+            if not rules:
                 print("ℹ️ トラック容器ルールが未設定（サイズベースで計算します）")
-                return []
-            
-            rules = []
-            for _, row in result.iterrows():
-                rules.append({
-                    'id': row['id'],
-                    'truck_id': row['truck_id'],
-                    'container_id': row['container_id'],
-                    'max_quantity': row['max_quantity'],
-                    'stack_count': row.get('stack_count'),
-                    'priority': row.get('priority', 0),
-                    'created_at': row.get('created_at')
-                })
-            
-            print(f"✅ {len(rules)}件のトラック容器ルールを取得")
             return rules
             
         except Exception as e:
             print(f"⚠️ トラック容器ルール取得エラー（サイズベース計算を使用）: {e}")
             return []
+
+    def load_truck_container_rules(self):
+        """トラック×容器ルールをDBから取得（エラーは呼び出し元へ）"""
+        session = self.db_manager.get_session()
+        try:
+            result = session.execute(text("""
+                SELECT 
+                    id,
+                    truck_id,
+                    container_id,
+                    max_quantity,
+                    stack_count,
+                    priority,
+                    created_at
+                FROM truck_container_rules
+                ORDER BY truck_id, container_id
+            """))
+            rules = [{
+                'id': row.id,
+                'truck_id': row.truck_id,
+                'container_id': row.container_id,
+                'max_quantity': row.max_quantity,
+                'stack_count': row.stack_count,
+                'priority': row.priority if row.priority is not None else 0,
+                'created_at': row.created_at
+            } for row in result]
+            print(f"✅ {len(rules)}件のトラック容器ルールを取得")
+            return rules
+        finally:
+            session.close()
     def save_truck_container_rule(self, rule_data: dict) -> bool:
         """トラック×容器ルールを保存（UPSERT）。TruckContainerRule は dataclass のため raw SQL を使用"""
         session = self.db_manager.get_session()
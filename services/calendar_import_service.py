@@ -88,6 +88,9 @@ class CalendarImportService:
                     skipped_count += 1
                     continue
             
+            # 営業日インデックスを破棄（次回参照時に再読み込み）
+            self.calendar_repo.invalidate_working_day_index()
+            
             if imported_count > 0:
                 return True, f"✅ {imported_count}件のカレンダーデータをインポートしました（スキップ: {skipped_count}件）"
             else:
@@ -103,6 +106,7 @@ class CalendarImportService:
             from sqlalchemy import text
             session.execute(text("DELETE FROM company_calendar"))
             session.commit()
+            self.calendar_repo.invalidate_working_day_index()
             print("✅ 既存カレンダーデータをクリアしました")
         except Exception as e:
             session.rollback()
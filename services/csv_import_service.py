@@ -1,178 +1,539 @@
 # app/services/csv_import_service.py
+import hashlib
+import numpy as np
 import pandas as pd
-from datetime import datetime
-from typing import Tuple, List, Dict
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from typing import Callable, Tuple, List, Dict, Optional
+
+from repository import progress_propagation
+
+
+@dataclass
+class CSVImportRun:
+    """インポート1回分の状態（サービスはセッション間で共有されるため、呼び出しごとに作る）"""
+    # ハッシュ判定結果（履歴に記録する）
+    stats: Dict
+    # 対応が取れなかったV2/V3行のキー
+    unmatched: Dict[str, List[Tuple]] = field(
+        default_factory=lambda: {'v3_without_v2': [], 'v2_without_v3': [], 'v3_without_product': []}
+    )
+    # 書き込んだ指示日の範囲 (最小日, 最大日)
+    instruction_range: Optional[Tuple[date, date]] = None
+    # 納入進度も作成するか（取込済み判定にも使う）
+    create_progress: bool = True
+    # 取り込んだ製品の行ハッシュ（納入進度の統合まで完了してから保存する）
+    row_hashes: Dict[Tuple[str, str], str] = field(default_factory=dict)
+
 
 class CSVImportService:
     """CSV受注インポートサービス"""
     
+    # 月度ブロック: (month_type, 開始列, 終了列（含まない）, 指示数合計の列名)
+    MONTH_BLOCKS = (
+        ('first', 27, 58, '初月度（指示）数合計'),
+        ('next', 58, 89, '次月度(指示）数合計'),
+        ('next_next', 89, 120, '次々月度(指示)数合計'),
+    )
+    # production_instructions_detail へのREPLACEを1回に送る行数
+    INSTRUCTION_BATCH_SIZE = 2000
+    # 行ハッシュから除外する列（ファイル作成日ごとに変わるが、既存製品の取込内容には影響しない）
+    HASH_EXCLUDED_COLUMNS = ('計算日',)
+    # ストリーミング取込で1回に読み込む行数
+    STREAM_CHUNK_ROWS = 2000
+    # ファイルハッシュ計算時の読み込みブロックサイズ
+    SCAN_BLOCK_BYTES = 1024 * 1024
+    
     def __init__(self, db_manager):
         self.db = db_manager
     
     def import_csv_data(self, uploaded_file, 
-                       create_progress: bool = True) -> Tuple[bool, str]:
-        """CSVファイルからデータを読み込み、データベースにインポート"""
+                       create_progress: bool = True,
+                       force: bool = False,
+                       streaming: bool = False,
+                       progress_callback: Optional[Callable[[int, int, str], None]] = None) -> Tuple[bool, str, Dict]:
+        """
+        CSVファイルからデータを読み込み、データベースにインポート
+
+        - ファイル全体のハッシュが取込済みのものと同じならスキップ
+        - 製品（品番×検査区分）ごとのV2/V3行のハッシュを比較し、変わった製品だけを取り込む
+        - create_progress=True のときは、納入進度まで作成済みのファイル・製品だけをスキップする
+        - ファイル・行ハッシュは納入進度の統合まで成功してから記録される
+        - force=True のときはハッシュ判定をせずに全件取り込む
+        - streaming=True のときは STREAM_CHUNK_ROWS 行ずつ読み込み、V2/V3の揃った製品から
+          バッチごとにコミットする（ファイルサイズによらずメモリ使用量は一定）
+        - progress_callback(処理済み行数, 総行数, メッセージ) で進捗を通知
+
+        Returns:
+            (成否, メッセージ, ハッシュ判定結果 stats（log_import_history に渡す）)
+        """
+        run = CSVImportRun(stats={
+            'file_hash': None,
+            'file_skipped': False,
+            'changed_products': 0,
+            'skipped_products': 0,
+            'create_progress': create_progress
+        }, create_progress=create_progress)
+        success, message = self._import(
+            uploaded_file, create_progress, force, streaming, progress_callback, run
+        )
+        return success, message, run.stats
+    
+    def _import(self, uploaded_file, create_progress: bool, force: bool, streaming: bool,
+                progress_callback: Optional[Callable[[int, int, str], None]],
+                run: CSVImportRun) -> Tuple[bool, str]:
+        """import_csv_data の本体（インポート1回分の状態は run に持つ）"""
         try:
-            # ファイルを読み込み
-            df = pd.read_csv(uploaded_file, encoding='shift_jis', dtype=str)
-            df = df.fillna('')
+            file_hash, total_rows = self._scan_file(uploaded_file)
+            run.stats['file_hash'] = file_hash
             
-            # 数値カラムを変換
-            for col in ['データＮＯ', '取引先', '収容数', 'リードタイム', '定点日数']:
-                if col in df.columns:
-                    df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(int)
+            if not force and self._is_imported_file(file_hash, create_progress):
+                run.stats['file_skipped'] = True
+                return True, "同じ内容のファイルは取込済みのため、0件の指示データを登録しました（スキップ）"
             
-            # V2行（日付）とV3行（数量）を分離
-            v2_rows = df[df['レコード識別'] == 'V2']
-            v3_rows = df[df['レコード識別'] == 'V3']
+            stored_hashes = {} if force else self._load_row_hashes()
             
-            if len(v3_rows) == 0:
-                return False, "V3行（数量データ）が見つかりませんでした"
+            if streaming:
+                return self._import_streaming(
+                    uploaded_file, create_progress, stored_hashes, force, total_rows, progress_callback, run
+                )
             
-            # 製品情報をインポート（新しいproductsテーブルを使用）
-            product_ids = self._import_basic_data(v3_rows)
+            # ファイルを読み込み
+            df = pd.read_csv(self._rewind(uploaded_file), encoding='shift_jis', dtype=str)
+            df = df.fillna('')
             
-            if not product_ids:
-                return False, "製品情報のインポートに失敗しました"
+            if len(df[df['レコード識別'] == 'V3']) == 0:
+                return False, "V3行（数量データ）が見つかりませんでした"
             
-            # 生産指示データを処理
-            success, count = self._process_instruction_data(v2_rows, v3_rows, product_ids)
+            row_hashes = self._compute_row_hashes(df)
+            changed_keys = self._changed_keys(row_hashes, stored_hashes, force, run)
+            batch = self._import_batch(df, row_hashes, changed_keys, run)
+            if progress_callback:
+                progress_callback(len(df), total_rows, "取込完了")
             
-            if not success:
+            if batch['products'] == 0:
+                return True, (f"変更された製品がないため、0件の指示データを登録しました"
+                              f"（{run.stats['skipped_products']}製品スキップ）")
+            if not batch['product_ids']:
+                return False, "製品情報のインポートに失敗しました"
+            if not batch['success']:
                 return False, "データインポートに失敗しました"
             
-            # 納入進度データを作成（製品コードで統合）
-            if create_progress:
-                progress_count = self._create_delivery_progress_consolidated(v2_rows, v3_rows, product_ids)
-                return True, f"{count}件の指示データと{progress_count}件の進度データを登録しました"
-            else:
-                return True, f"{count}件の指示データを登録しました"
+            return self._finish_import(run, batch['product_ids'], batch['count'], create_progress)
         
         except Exception as e:
             error_msg = f"CSVインポートエラー: {str(e)}"
             return False, error_msg
     
-    def _import_basic_data(self, df: pd.DataFrame) -> Dict:
-        """製品基本情報をインポート（新しいproductsテーブルを使用）"""
+    def _import_streaming(self, uploaded_file, create_progress: bool, stored_hashes: Dict,
+                          force: bool, total_rows: int,
+                          progress_callback: Optional[Callable[[int, int, str], None]],
+                          run: CSVImportRun) -> Tuple[bool, str]:
+        """
+        チャンク読み込み → V2/V3の揃った製品からバッチ取込（バッチごとにコミット）
+
+        製品の行がチャンクをまたいでも判定がぶれないよう、行ハッシュは先にファイル全体で求める。
+        """
+        # 製品ごとの行ハッシュ（ファイル全体）と変更のあった製品
+        row_hashes = self._stream_row_hashes(uploaded_file)
+        changed_keys = self._changed_keys(row_hashes, stored_hashes, force, run)
+        if not changed_keys and row_hashes:
+            if progress_callback:
+                progress_callback(total_rows, total_rows, "取込完了")
+            return True, (f"変更された製品がないため、0件の指示データを登録しました"
+                          f"（{run.stats['skipped_products']}製品スキップ）")
+        
         product_ids = {}
-        session = self.db.get_session()
+        instruction_count = 0
+        rows_read = 0
+        pending = None    # 対になる行がまだ来ていない行・取込中の製品の行（次のチャンクへ持ち越し）
+        
+        reader = pd.read_csv(
+            self._rewind(uploaded_file), encoding='shift_jis', dtype=str, chunksize=self.STREAM_CHUNK_ROWS
+        )
+        chunks = iter(reader)
+        while True:
+            chunk = next(chunks, None)
+            if chunk is not None:
+                rows_read += len(chunk)
+                frame = chunk.fillna('')
+                if pending is not None and not pending.empty:
+                    frame = pd.concat([pending, frame], ignore_index=True)
+                frame, pending = self._split_complete_pairs(frame)
+            else:
+                # 最後まで対にならなかった行も従来どおり取り込む（製品登録・未対応の報告）
+                frame, pending = pending, None
+            
+            if frame is not None and not frame.empty:
+                batch = self._import_batch(frame, row_hashes, changed_keys, run)
+                if batch['products'] and not batch['success']:
+                    return False, f"データインポートに失敗しました（{rows_read}行目付近まで取込済み）"
+                product_ids.update(batch['product_ids'])
+                instruction_count += batch['count']
+            
+            if progress_callback:
+                progress_callback(rows_read, total_rows, f"{instruction_count}件の指示データを登録済み")
+            if chunk is None:
+                break
+        
+        if not product_ids:
+            if run.stats['changed_products'] == 0 and run.stats['skipped_products']:
+                return True, (f"変更された製品がないため、0件の指示データを登録しました"
+                              f"（{run.stats['skipped_products']}製品スキップ）")
+            return False, "V3行（数量データ）が見つかりませんでした"
         
+        return self._finish_import(run, product_ids, instruction_count, create_progress)
+    
+    def _changed_keys(self, row_hashes: Dict[Tuple[str, str], str], stored_hashes: Dict,
+                      force: bool, run: CSVImportRun) -> set:
+        """保存済みハッシュと比べて取り込む製品（品番×検査区分）を決め、件数を stats に記録"""
+        changed_keys = set(row_hashes)
+        if not force:
+            changed_keys = {
+                key for key, value in row_hashes.items()
+                if not self._is_unchanged(stored_hashes.get(key), value, run.create_progress)
+            }
+        run.stats['changed_products'] += len(changed_keys)
+        run.stats['skipped_products'] += len(row_hashes) - len(changed_keys)
+        return changed_keys
+    
+    def _import_batch(self, df: pd.DataFrame, row_hashes: Dict[Tuple[str, str], str],
+                      changed_keys: set, run: CSVImportRun) -> Dict:
+        """
+        V2/V3行のまとまりを取り込む（製品マスタ → 生産指示、それぞれ1トランザクション）
+
+        Args:
+            row_hashes: 製品ごとの行ハッシュ（ファイル全体で計算したもの）
+            changed_keys: 取り込む製品（_changed_keys の結果）
+
+        Returns:
+            Dict: products（このまとまりに含まれる変更ありの製品数）, product_ids, count（指示データ件数）, success
+        """
+        result = {'products': 0, 'product_ids': {}, 'count': 0, 'success': True}
+        
+        # 変更のあった製品の行だけを残す
+        row_keys = list(zip(df['品番'], df['検査区分']))
+        mask = [key in changed_keys for key in row_keys]
+        batch_keys = {key for key, flag in zip(row_keys, mask) if flag}
+        if not batch_keys:
+            return result
+        result['products'] = len(batch_keys)
+        if len(batch_keys) < len(set(row_keys)):
+            df = df[mask]
+        
+        # 数値カラムを変換
+        df = df.copy()
+        for col in ['データＮＯ', '取引先', '収容数', 'リードタイム', '定点日数']:
+            if col in df.columns:
+                df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(int)
+        
+        # V2行（日付）とV3行（数量）を分離
+        v2_rows = df[df['レコード識別'] == 'V2']
+        v3_rows = df[df['レコード識別'] == 'V3']
+        if len(v3_rows) == 0:
+            # V3行のない製品（V2行のみ）は未対応として報告だけ行う
+            run.unmatched['v2_without_v3'].extend(self._row_keys(v2_rows))
+            return result
+        
+        # 製品情報をインポート（新しいproductsテーブルを使用）
+        product_ids = self._import_basic_data(v3_rows)
+        if not product_ids:
+            result['success'] = False
+            return result
+        result['product_ids'] = product_ids
+        
+        # 生産指示データを処理（未対応行・指示日の範囲は run に追加される）
+        success, count = self._process_instruction_data(v2_rows, v3_rows, product_ids, run)
+        result['success'] = success
+        result['count'] = count
+        
+        # 取り込んだ製品の行ハッシュ（保存は _finish_import で納入進度の統合後に行う）
+        if success:
+            run.row_hashes.update({key: row_hashes[key] for key in batch_keys})
+        return result
+    
+    @staticmethod
+    def _is_unchanged(stored: Optional[Tuple[str, bool]], row_hash: str, create_progress: bool) -> bool:
+        """保存済みの (行ハッシュ, 納入進度作成済み) から、取込を省略できるか"""
+        if stored is None:
+            return False
+        stored_hash, progress_created = stored
+        return stored_hash == row_hash and (progress_created or not create_progress)
+    
+    def _finish_import(self, run: CSVImportRun, product_ids: Dict, count: int,
+                       create_progress: bool) -> Tuple[bool, str]:
+        """納入進度の統合・行ハッシュの保存と結果メッセージの作成"""
+        # 対応の取れなかった行があればメッセージに添える
+        unmatched_note = self._format_unmatched_note(run.unmatched)
+        
+        skip_note = ''
+        if run.stats['skipped_products']:
+            skip_note = (f"（変更 {run.stats['changed_products']}製品 / "
+                         f"変更なし {run.stats['skipped_products']}製品スキップ）")
+        
+        # 納入進度データを作成（製品コードで統合）
+        if create_progress:
+            progress_count = self._create_delivery_progress_consolidated(
+                None, None, product_ids, run.instruction_range
+            )
+            if progress_count is None:
+                # 行ハッシュは保存しない（次回の取込で同じ製品を再処理する）
+                return False, f"{count}件の指示データを登録しましたが、納入進度の作成に失敗しました"
+            self._save_row_hashes(run.row_hashes, progress_created=True)
+            return True, f"{count}件の指示データと{progress_count}件の進度データを登録しました{skip_note}{unmatched_note}"
+        self._save_row_hashes(run.row_hashes, progress_created=False)
+        return True, f"{count}件の指示データを登録しました{skip_note}{unmatched_note}"
+    
+    def _split_complete_pairs(self, frame: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """V2行・V3行の両方が揃ったキーの行と、まだ揃っていない行に分ける"""
+        keys = self._row_keys(frame)
+        record_types = frame['レコード識別'].tolist()
+        v2_keys = {key for key, record_type in zip(keys, record_types) if record_type == 'V2'}
+        v3_keys = {key for key, record_type in zip(keys, record_types) if record_type == 'V3'}
+        complete = v2_keys & v3_keys
+        if keys:
+            # 最後の製品（品番×検査区分）は次のチャンクにV2/V3行が続くことがあるので、
+            # 製品が切り替わるかファイルが終わるまで持ち越す（後から来たV3行もV2行と対にする）
+            current_product = keys[-1][1:]
+            complete = {key for key in complete if key[1:] != current_product}
+        mask = [key in complete for key in keys]
+        return frame[mask], frame[[not flag for flag in mask]]
+    
+    @staticmethod
+    def _merge_range(current: Optional[Tuple[date, date]], other: Tuple[date, date]) -> Tuple[date, date]:
+        if current is None:
+            return other
+        return min(current[0], other[0]), max(current[1], other[1])
+    
+    @staticmethod
+    def _rewind(uploaded_file):
+        """read_csv に渡す読み込み元（ファイルオブジェクトは先頭に戻す）"""
+        if hasattr(uploaded_file, 'seek'):
+            uploaded_file.seek(0)
+        return uploaded_file
+    
+    def _scan_file(self, uploaded_file) -> Tuple[str, int]:
+        """ファイル全体のハッシュとデータ行数を、ブロック単位で読みながら求める"""
+        digest = hashlib.sha256()
+        line_count = 0
+        last_block = b''
+        source = self._rewind(uploaded_file)
+        handle = source if hasattr(source, 'read') else open(source, 'rb')
+        try:
+            while True:
+                block = handle.read(self.SCAN_BLOCK_BYTES)
+                if not block:
+                    break
+                digest.update(block)
+                line_count += block.count(b'\n')
+                last_block = block
+        finally:
+            if handle is not source:
+                handle.close()
+        if last_block and not last_block.endswith(b'\n'):
+            line_count += 1
+        # ヘッダー行を除いた行数
+        return digest.hexdigest(), max(line_count - 1, 0)
+    
+    def _compute_row_hashes(self, df: pd.DataFrame) -> Dict[Tuple[str, str], str]:
+        """
+        製品（品番×検査区分）ごとのV2/V3行のハッシュ
+
+        日々変わるだけで取込内容に影響しない列（HASH_EXCLUDED_COLUMNS）は除外する。
+        """
+        digests = self._update_row_digests(df, {})
+        return {key: digest.hexdigest() for key, digest in digests.items()}
+    
+    def _stream_row_hashes(self, uploaded_file) -> Dict[Tuple[str, str], str]:
+        """ファイル全体をチャンクで読み、製品ごとの行ハッシュを求める（_compute_row_hashes と同じ値）"""
+        digests = {}
+        reader = pd.read_csv(
+            self._rewind(uploaded_file), encoding='shift_jis', dtype=str, chunksize=self.STREAM_CHUNK_ROWS
+        )
+        for chunk in reader:
+            self._update_row_digests(chunk.fillna(''), digests)
+        return {key: digest.hexdigest() for key, digest in digests.items()}
+    
+    def _update_row_digests(self, df: pd.DataFrame, digests: Dict) -> Dict:
+        """製品ごとのハッシュに df の行を順に追加（行の区切りは '\x1e'、列の区切りは '\x1f'）"""
+        if df.empty:
+            return digests
+        payload_columns = [col for col in df.columns if col not in self.HASH_EXCLUDED_COLUMNS]
+        payload = df[payload_columns].astype(str).agg('\x1f'.join, axis=1)
+        for key, lines in payload.groupby([df['品番'], df['検査区分']], sort=False):
+            text_block = '\x1e'.join(lines)
+            digest = digests.get(key)
+            if digest is None:
+                digests[key] = hashlib.sha256(text_block.encode('utf-8'))
+            else:
+                digest.update(('\x1e' + text_block).encode('utf-8'))
+        return digests
+    
+    def _is_imported_file(self, file_hash: str, create_progress: bool) -> bool:
+        """
+        同じ内容のファイルが最後に成功した取込か（create_progress=True なら納入進度まで作成済みのもの）
+
+        それより前の取込と同じ内容でも、間に別のファイルを取り込んでいれば内容が変わっているので
+        スキップしない（製品ごとの行ハッシュで変わった製品だけを取り込む）。
+        """
+        session = self.db.get_session()
+        try:
+            from sqlalchemy import text
+            row = session.execute(text("""
+                SELECT file_hash, progress_created FROM csv_import_history
+                WHERE status = '成功'
+                ORDER BY import_date DESC, id DESC
+                LIMIT 1
+            """)).fetchone()
+            if row is None or row[0] != file_hash:
+                return False
+            return bool(row[1]) or not create_progress
+        except Exception as e:
+            print(f"⚠️ 取込済みファイルの確認に失敗しました（migrations/add_csv_import_hashes.py 未実行？）: {e}")
+            return False
+        finally:
+            session.close()
+    
+    def _load_row_hashes(self) -> Dict[Tuple[str, str], Tuple[str, bool]]:
+        """保存済みの製品別行ハッシュ {(品番, 検査区分): (行ハッシュ, 納入進度作成済み)}"""
+        session = self.db.get_session()
         try:
             from sqlalchemy import text
+            result = session.execute(text("""
+                SELECT product_code, inspection_category, row_hash, progress_created FROM csv_import_row_hashes
+            """)).fetchall()
+            return {(r[0], r[1]): (r[2], bool(r[3])) for r in result}
+        except Exception as e:
+            print(f"⚠️ 行ハッシュの取得に失敗しました（全製品を取り込みます）: {e}")
+            return {}
+        finally:
+            session.close()
+    
+    def _save_row_hashes(self, row_hashes: Dict[Tuple[str, str], str], progress_created: bool):
+        """取り込んだ製品の行ハッシュを保存（progress_created: 納入進度まで作成したか）"""
+        if not row_hashes:
+            return
+        session = self.db.get_session()
+        try:
+            from sqlalchemy import text
+            session.execute(text("""
+                INSERT INTO csv_import_row_hashes
+                (product_code, inspection_category, row_hash, progress_created, updated_at)
+                VALUES (:product_code, :inspection_category, :row_hash, :progress_created, :updated_at)
+                ON DUPLICATE KEY UPDATE row_hash = VALUES(row_hash),
+                    progress_created = VALUES(progress_created), updated_at = VALUES(updated_at)
+            """), [{
+                'product_code': product_code,
+                'inspection_category': inspection_category,
+                'row_hash': row_hash,
+                'progress_created': int(progress_created),
+                'updated_at': datetime.now()
+            } for (product_code, inspection_category), row_hash in row_hashes.items()])
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            print(f"⚠️ 行ハッシュの保存に失敗しました: {e}")
+        finally:
+            session.close()
+    
+    def _import_basic_data(self, df: pd.DataFrame) -> Dict:
+        """
+        製品基本情報をインポート（新しいproductsテーブルを使用）
+
+        既存キーを1クエリずつ先読みし、未登録分だけを複数行INSERTする。
+        - products: product_code で識別（ファイル内で最初に出た行の内容で登録）
+        - products_syosai: (product_code, inspection_category) で識別（同上）
+        - 戻り値: {(製品コード, 検査区分): {'product_id', 'data_no'}}（data_no は最後に出た行）
+        """
+        session = self.db.get_session()
+        
+        try:
+            from sqlalchemy import text, bindparam
+            
+            rows = df.to_dict('records')
+            product_codes = list(dict.fromkeys(row['品番'] for row in rows))
+            if not product_codes:
+                return {}
+            
+            # ✅ 1. 既存キーの先読み（products / products_syosai それぞれ1クエリ）
+            code_to_id = self._load_product_ids(session, product_codes)
+            existing_syosai = {
+                (code, category)
+                for code, category in session.execute(
+                    text("""
+                        SELECT product_code, inspection_category FROM products_syosai
+                        WHERE product_code IN :product_codes
+                    """).bindparams(bindparam('product_codes', expanding=True)),
+                    {'product_codes': product_codes}
+                ).fetchall()
+            }
             
-            for _, row in df.iterrows():
+            # ✅ 2. 未登録分だけを集める（ファイル内の重複は最初の行を採用）
+            new_products = {}
+            new_syosai = {}
+            for row in rows:
                 product_code = row['品番']
-                
-                # ✅ 1. 新しいproductsテーブルに保存（product_codeのみで識別）
-                result = session.execute(text("""
-                    SELECT id FROM products 
-                    WHERE product_code = :product_code
-                """), {'product_code': product_code}).fetchone()
-                
-                if result:
-                    simple_product_id = result[0]
-                else:
-                    # 新規登録（新しいproductsテーブル）
-                    result = session.execute(text("""
-                        INSERT INTO products (
-                            product_code, product_name, delivery_location,
-                            box_type, capacity
-                        ) VALUES (
-                            :product_code, :product_name, :delivery_location,
-                            :box_type, :capacity
-                        )
-                    """), {
+                if product_code not in code_to_id and product_code not in new_products:
+                    new_products[product_code] = {
                         'product_code': product_code,
                         'product_name': row['品名'],
                         'delivery_location': row['納入場所'],
                         'box_type': row['箱種'],
                         'capacity': int(row['収容数']) if str(row['収容数']).strip() else 1
-                    })
-                    simple_product_id = result.lastrowid
-                
-                # ✅ 2. 既存のproducts_syosaiテーブルにも保存（全データ）
-                data_no = int(row['データＮＯ']) if str(row['データＮＯ']).strip() else None
-                inspection_category = row['検査区分']
-                unique_key = (product_code, inspection_category)
-                result = session.execute(text("""
-                    SELECT id FROM products_syosai 
-                    WHERE product_code = :product_code 
-                    AND inspection_category = :inspection_category
-                """), {
-                    'product_code': product_code,
-                    'inspection_category': inspection_category
-                }).fetchone()
-                
-                if not result:
-                    # 既存の詳細登録ロジックでproducts_syosaiに保存（全列）
-                    sql = text("""
-                        INSERT INTO products_syosai (
-                            data_no, factory, client_code, calculation_date, production_complete_date,
-                            modified_factory, product_category, product_code, ac_code, processing_content,
-                            product_name, delivery_location, box_type, capacity, grouping_category,
-                            form_category, inspection_category, ordering_category, regular_replenishment_category,
-                            lead_time, fixed_point_days, shipping_factory, client_product_code,
-                            purchasing_org, item_group, processing_type, inventory_transfer_category,
-                            container_width, container_depth, container_height, stackable, can_advance,
-                            used_container_id, used_truck_ids
-                        ) VALUES (
-                            :data_no, :factory, :client_code, :calculation_date, :production_complete_date,
-                            :modified_factory, :product_category, :product_code, :ac_code, :processing_content,
-                            :product_name, :delivery_location, :box_type, :capacity, :grouping_category,
-                            :form_category, :inspection_category, :ordering_category, :regular_replenishment_category,
-                            :lead_time, :fixed_point_days, :shipping_factory, :client_product_code,
-                            :purchasing_org, :item_group, :processing_type, :inventory_transfer_category,
-                            :container_width, :container_depth, :container_height, :stackable, :can_advance,
-                            :used_container_id, :used_truck_ids
-                        )
-                    """)
-                    
-                    params = {
-                        'data_no': int(row['データＮＯ']),
-                        'factory': row['工場'],
-                        'client_code': int(row['取引先']) if str(row['取引先']).strip() else 0,
-                        'calculation_date': self._parse_japanese_date(str(row['計算日'])),
-                        'production_complete_date': self._parse_japanese_date(str(row['生産完了日'])),
-                        'modified_factory': row['工場（変更対応）'],
-                        'product_category': row['品区'],
-                        'product_code': product_code,
-                        'ac_code': row['A/C'],
-                        'processing_content': row['加工内容'],
-                        'product_name': row['品名'],
-                        'delivery_location': row['納入場所'],
-                        'box_type': row['箱種'],
-                        'capacity': int(row['収容数']) if str(row['収容数']).strip() else 0,
-                        'grouping_category': row['まとめ区分'],
-                        'form_category': row['形態区分'],
-                        'inspection_category': row['検査区分'],
-                        'ordering_category': row['手配区分'],
-                        'regular_replenishment_category': row['定期補充区分'],
-                        'lead_time': int(row['リードタイム']) if str(row['リードタイム']).strip() else 0,
-                        'fixed_point_days': int(row['定点日数']) if str(row['定点日数']).strip() else 0,
-                        'shipping_factory': row['出荷工場'],
-                        'client_product_code': row['取引先品番'],
-                        'purchasing_org': row['購買組織'],
-                        'item_group': row['品目グループ'],
-                        'processing_type': row['加工区分'],
-                        'inventory_transfer_category': row['在庫転送区分'],
-                        'container_width': None,
-                        'container_depth': None,
-                        'container_height': None,
-                        'stackable': 1,
-                        'can_advance': 0,
-                        'used_container_id': None,
-                        'used_truck_ids': None
                     }
-                    
-                    session.execute(sql, params)
-                
-                # ✅ 3. マッピング（製品コード+検査区分）→ product_id と data_no を保持
-                product_ids[unique_key] = {
-                    'product_id': simple_product_id,
+                unique_key = (product_code, row['検査区分'])
+                if unique_key not in existing_syosai and unique_key not in new_syosai:
+                    new_syosai[unique_key] = self._build_syosai_params(row)
+            
+            # ✅ 3. 新しいproductsテーブルへ複数行INSERTし、採番されたIDを1クエリで取得
+            if new_products:
+                session.execute(text("""
+                    INSERT INTO products (
+                        product_code, product_name, delivery_location,
+                        box_type, capacity
+                    ) VALUES (
+                        :product_code, :product_name, :delivery_location,
+                        :box_type, :capacity
+                    )
+                """), list(new_products.values()))
+                code_to_id.update(self._load_product_ids(session, list(new_products)))
+            
+            # ✅ 4. 既存のproducts_syosaiテーブルにも保存（全列・複数行INSERT）
+            if new_syosai:
+                session.execute(text("""
+                    INSERT INTO products_syosai (
+                        data_no, factory, client_code, calculation_date, production_complete_date,
+                        modified_factory, product_category, product_code, ac_code, processing_content,
+                        product_name, delivery_location, box_type, capacity, grouping_category,
+                        form_category, inspection_category, ordering_category, regular_replenishment_category,
+                        lead_time, fixed_point_days, shipping_factory, client_product_code,
+                        purchasing_org, item_group, processing_type, inventory_transfer_category,
+                        container_width, container_depth, container_height, stackable, can_advance,
+                        used_container_id, used_truck_ids
+                    ) VALUES (
+                        :data_no, :factory, :client_code, :calculation_date, :production_complete_date,
+                        :modified_factory, :product_category, :product_code, :ac_code, :processing_content,
+                        :product_name, :delivery_location, :box_type, :capacity, :grouping_category,
+                        :form_category, :inspection_category, :ordering_category, :regular_replenishment_category,
+                        :lead_time, :fixed_point_days, :shipping_factory, :client_product_code,
+                        :purchasing_org, :item_group, :processing_type, :inventory_transfer_category,
+                        :container_width, :container_depth, :container_height, :stackable, :can_advance,
+                        :used_container_id, :used_truck_ids
+                    )
+                """), list(new_syosai.values()))
+            
+            # ✅ 5. マッピング（製品コード+検査区分）→ product_id と data_no を1パスで作成
+            product_ids = {}
+            for row in rows:
+                data_no = int(row['データＮＯ']) if str(row['データＮＯ']).strip() else None
+                product_ids[(row['品番'], row['検査区分'])] = {
+                    'product_id': code_to_id[row['品番']],
                     'data_no': data_no
                 }
             
             session.commit()
+            print(f"✅ 製品基本情報: 新規製品 {len(new_products)}件, 新規詳細 {len(new_syosai)}件, "
+                  f"マッピング {len(product_ids)}件")
             return product_ids
         
         except Exception as e:
@@ -181,55 +542,106 @@ class CSVImportService:
         finally:
             session.close()
     
+    @staticmethod
+    def _load_product_ids(session, product_codes: List[str]) -> Dict[str, int]:
+        """product_code → products.id（同じコードが複数あれば最小のid）"""
+        from sqlalchemy import text, bindparam
+        
+        result = session.execute(
+            text("""
+                SELECT product_code, MIN(id) FROM products
+                WHERE product_code IN :product_codes
+                GROUP BY product_code
+            """).bindparams(bindparam('product_codes', expanding=True)),
+            {'product_codes': product_codes}
+        ).fetchall()
+        return {product_code: product_id for product_code, product_id in result}
+    
+    def _build_syosai_params(self, row: Dict) -> Dict:
+        """V3行から products_syosai のINSERTパラメータを作成"""
+        return {
+            'data_no': int(row['データＮＯ']),
+            'factory': row['工場'],
+            'client_code': int(row['取引先']) if str(row['取引先']).strip() else 0,
+            'calculation_date': self._parse_japanese_date(str(row['計算日'])),
+            'production_complete_date': self._parse_japanese_date(str(row['生産完了日'])),
+            'modified_factory': row['工場（変更対応）'],
+            'product_category': row['品区'],
+            'product_code': row['品番'],
+            'ac_code': row['A/C'],
+            'processing_content': row['加工内容'],
+            'product_name': row['品名'],
+            'delivery_location': row['納入場所'],
+            'box_type': row['箱種'],
+            'capacity': int(row['収容数']) if str(row['収容数']).strip() else 0,
+            'grouping_category': row['まとめ区分'],
+            'form_category': row['形態区分'],
+            'inspection_category': row['検査区分'],
+            'ordering_category': row['手配区分'],
+            'regular_replenishment_category': row['定期補充区分'],
+            'lead_time': int(row['リードタイム']) if str(row['リードタイム']).strip() else 0,
+            'fixed_point_days': int(row['定点日数']) if str(row['定点日数']).strip() else 0,
+            'shipping_factory': row['出荷工場'],
+            'client_product_code': row['取引先品番'],
+            'purchasing_org': row['購買組織'],
+            'item_group': row['品目グループ'],
+            'processing_type': row['加工区分'],
+            'inventory_transfer_category': row['在庫転送区分'],
+            'container_width': None,
+            'container_depth': None,
+            'container_height': None,
+            'stackable': 1,
+            'can_advance': 0,
+            'used_container_id': None,
+            'used_truck_ids': None
+        }
+    
     def _process_instruction_data(self, v2_rows: pd.DataFrame, 
                                   v3_rows: pd.DataFrame, 
-                                  product_ids: Dict) -> Tuple[bool, int]:
-        """生産指示データを処理"""
+                                  product_ids: Dict,
+                                  run: CSVImportRun) -> Tuple[bool, int]:
+        """生産指示データを処理（未対応行と書き込んだ指示日の範囲を run に追加）"""
         session = self.db.get_session()
         instruction_count = 0
         
         try:
             from sqlalchemy import text
             
-            for idx, v3_row in v3_rows.iterrows():
-                # ✅ 検査区分を含むユニークキー（マッピング用）
-                product_code = v3_row['品番']
-                inspection_category = v3_row['検査区分']
-                unique_key = (product_code, inspection_category)
-                mapping = product_ids.get(unique_key)
-                
-                if not mapping:
-                    continue
-                
-                product_id = mapping['product_id']
-                
-                # V2行とマッチング
-                v2_match = v2_rows[
-                    (v2_rows['データＮＯ'].astype(int) == int(v3_row['データＮＯ'])) & 
-                    (v2_rows['品番'].astype(str) == str(v3_row['品番'])) & 
-                    (v2_rows['検査区分'].astype(str) == str(v3_row['検査区分']))
-                ]
-                
-                if len(v2_match) == 0:
-                    continue
-                
-                v2_row = v2_match.iloc[0]
-                start_month = v3_row['スタート月度']
-                
-                # 3ヶ月分のデータを処理
-                count_first = self._process_month_data(
-                    session, product_id, v2_row, v3_row, 'first', 27, 58, start_month
-                )
-                count_next = self._process_month_data(
-                    session, product_id, v2_row, v3_row, 'next', 58, 89, start_month
-                )
-                count_next_next = self._process_month_data(
-                    session, product_id, v2_row, v3_row, 'next_next', 89, 120, start_month
-                )
-                
-                instruction_count += count_first + count_next + count_next_next
+            # V2/V3の対応付けは (データＮＯ, 品番, 検査区分) のキーで1回だけ行う
+            pairs, unmatched = self._pair_v2_v3(v2_rows, v3_rows, product_ids)
+            for key, keys in unmatched.items():
+                run.unmatched[key].extend(keys)
+            
+            # 3ヶ月分の日別列を縦持ちにして、月次サマリーと日次データをまとめて書き込む
+            summary_rows = self._build_monthly_summary_rows(v3_rows, pairs)
+            detail_rows = self._build_instruction_rows(v2_rows, v3_rows, pairs)
+            
+            if summary_rows:
+                session.execute(text("""
+                    INSERT INTO monthly_summary (product_id, month_type, total_quantity, month_year)
+                    VALUES (:product_id, :month_type, :total_quantity, :month_year)
+                    ON DUPLICATE KEY UPDATE total_quantity = VALUES(total_quantity)
+                """), summary_rows)
+            
+            # ✅ 数量0でもREPLACEで保持（削除はしない）
+            for chunk_start in range(0, len(detail_rows), self.INSTRUCTION_BATCH_SIZE):
+                session.execute(text("""
+                    REPLACE INTO production_instructions_detail 
+                    (product_id, record_type, start_month, total_first_month, 
+                    total_next_month, total_next_next_month, instruction_date, 
+                    instruction_quantity, month_type, day_number, inspection_category)
+                    VALUES (:product_id, :record_type, :start_month, :total_first, 
+                    :total_next, :total_next_next, :instruction_date, 
+                    :quantity, :month_type, :day_number, :inspection_category)
+                """), detail_rows[chunk_start:chunk_start + self.INSTRUCTION_BATCH_SIZE])
+            instruction_count = len(detail_rows)
+            instruction_dates = [row['instruction_date'] for row in detail_rows]
             
             session.commit()
+            if instruction_dates:
+                run.instruction_range = self._merge_range(
+                    run.instruction_range, (min(instruction_dates), max(instruction_dates))
+                )
             return True, instruction_count
         
         except Exception as e:
@@ -238,189 +650,331 @@ class CSVImportService:
         finally:
             session.close()
     
-    def _process_month_data(self, session, product_id, v2_row, v3_row, 
-                           month_type, start_col, end_col, start_month) -> int:
-        """月度ごとのデータを処理"""
-        from sqlalchemy import text
-        instruction_count = 0
+    @staticmethod
+    def _row_keys(rows: pd.DataFrame) -> List[Tuple]:
+        """(データＮＯ, 品番, 検査区分) のキー列（型変換は列単位で1回だけ）"""
+        return list(zip(
+            pd.to_numeric(rows['データＮＯ'], errors='coerce').fillna(0).astype(int),
+            rows['品番'].astype(str),
+            rows['検査区分'].astype(str)
+        ))
+    
+    def _pair_v2_v3(self, v2_rows: pd.DataFrame, v3_rows: pd.DataFrame,
+                    product_ids: Dict) -> Tuple[List[Tuple], Dict[str, List[Tuple]]]:
+        """
+        V3行（数量）と対応するV2行（日付）をキーで突き合わせる
+
+        Returns:
+            (pairs, unmatched)
+            pairs: [(v2行の位置, v3行の位置, product_id), ...]（V3行の順）
+            unmatched: {'v3_without_v2': [...], 'v2_without_v3': [...], 'v3_without_product': [...]}
+                       いずれも (データＮＯ, 品番, 検査区分) のリスト
+        """
+        # 同じキーのV2行が複数ある場合は従来どおり先頭の行を使う
+        v2_index = {}
+        for position, key in enumerate(self._row_keys(v2_rows)):
+            v2_index.setdefault(key, position)
         
-        total_col = {
-            'first': '初月度（指示）数合計',
-            'next': '次月度(指示）数合計',
-            'next_next': '次々月度(指示)数合計'
-        }[month_type]
-        
-        total_quantity = int(v3_row[total_col]) if str(v3_row[total_col]).strip() else 0
-        
-        # 月次サマリー
-        session.execute(text("""
-            INSERT INTO monthly_summary (product_id, month_type, total_quantity, month_year)
-            VALUES (:product_id, :month_type, :total_quantity, :month_year)
-            ON DUPLICATE KEY UPDATE total_quantity = VALUES(total_quantity)
-        """), {
-            'product_id': product_id,
-            'month_type': month_type,
-            'total_quantity': total_quantity,
-            'month_year': start_month
-        })
+        pairs = []
+        matched_v2 = set()
+        unmatched = {'v3_without_v2': [], 'v2_without_v3': [], 'v3_without_product': []}
         
-        # 日次データ（数量0でも記録するルール）
-        day_count = 1
+        for position, key in enumerate(self._row_keys(v3_rows)):
+            v3_row = v3_rows.iloc[position]
+            mapping = product_ids.get((v3_row['品番'], v3_row['検査区分']))
+            if not mapping:
+                unmatched['v3_without_product'].append(key)
+                continue
+            
+            v2_position = v2_index.get(key)
+            if v2_position is None:
+                unmatched['v3_without_v2'].append(key)
+                continue
+            
+            matched_v2.add(key)
+            pairs.append((v2_position, position, mapping['product_id']))
         
-        for i in range(start_col, min(end_col, len(v2_row))):
-            try:
-                date_str = str(v2_row.iloc[i]).strip()
-                quantity_str = str(v3_row.iloc[i]).strip()
-                
-                if not date_str or date_str in ['', 'nan']:
-                    continue
-                instruction_date = self._parse_japanese_date(date_str)
-                if not instruction_date:
-                    continue
-
-                quantity = 0
-                if quantity_str and quantity_str not in ['nan', '']:
-                    try:
-                        quantity = int(float(quantity_str))
-                    except ValueError:
-                        quantity = 0
-
-                # ✅ 数量0でもREPLACEで保持（削除はしない）
-                session.execute(text("""
-                    REPLACE INTO production_instructions_detail 
-                    (product_id, record_type, start_month, total_first_month, 
-                    total_next_month, total_next_next_month, instruction_date, 
-                    instruction_quantity, month_type, day_number, inspection_category)
-                    VALUES (:product_id, :record_type, :start_month, :total_first, 
-                    :total_next, :total_next_next, :instruction_date, 
-                    :quantity, :month_type, :day_number, :inspection_category)
-                """), {
+        unmatched['v2_without_v3'] = [key for key in v2_index if key not in matched_v2]
+        
+        for label, keys in (('V2行のないV3行', unmatched['v3_without_v2']),
+                            ('V3行のないV2行', unmatched['v2_without_v3']),
+                            ('製品未登録のV3行', unmatched['v3_without_product'])):
+            if keys:
+                print(f"⚠️ {label}: {len(keys)}件 (例: {keys[:5]})")
+        
+        return pairs, unmatched
+    
+    @staticmethod
+    def _format_unmatched_note(unmatched: Dict[str, List[Tuple]]) -> str:
+        parts = []
+        if unmatched.get('v3_without_v2'):
+            parts.append(f"V2行なし {len(unmatched['v3_without_v2'])}行")
+        if unmatched.get('v2_without_v3'):
+            parts.append(f"V3行なし {len(unmatched['v2_without_v3'])}行")
+        if unmatched.get('v3_without_product'):
+            parts.append(f"製品未登録 {len(unmatched['v3_without_product'])}行")
+        return f"（未対応: {', '.join(parts)}）" if parts else ''
+    
+    @staticmethod
+    def _to_int(value) -> int:
+        return int(value) if str(value).strip() else 0
+    
+    def _build_monthly_summary_rows(self, v3_rows: pd.DataFrame, pairs: List[Tuple]) -> List[Dict]:
+        """月次サマリー（製品×月度の指示数合計）の行"""
+        rows = []
+        for _, v3_position, product_id in pairs:
+            v3_row = v3_rows.iloc[v3_position]
+            for month_type, _, _, total_col in self.MONTH_BLOCKS:
+                rows.append({
                     'product_id': product_id,
-                    'record_type': v3_row['レコード識別'],
-                    'start_month': start_month,
-                    'total_first': int(v3_row['初月度（指示）数合計']) if str(v3_row['初月度（指示）数合計']).strip() else 0,
-                    'total_next': int(v3_row['次月度(指示）数合計']) if str(v3_row['次月度(指示）数合計']).strip() else 0,
-                    'total_next_next': int(v3_row['次々月度(指示)数合計']) if str(v3_row['次々月度(指示)数合計']).strip() else 0,
-                    'instruction_date': instruction_date,
-                    'quantity': quantity,
                     'month_type': month_type,
-                    'day_number': day_count,
-                    'inspection_category': v3_row['検査区分']
+                    'total_quantity': self._to_int(v3_row[total_col]),
+                    'month_year': v3_row['スタート月度']
                 })
-                
-                instruction_count += 1
-                day_count += 1
-            
-            except Exception:
-                continue
+        return rows
+    
+    def _build_instruction_rows(self, v2_rows: pd.DataFrame, v3_rows: pd.DataFrame,
+                                pairs: List[Tuple]) -> List[Dict]:
+        """
+        日次の生産指示行を作成（横持ちの日別列 → 縦持ち）
+
+        V2行の日付セルとV3行の数量セルを (ペア, 列) の縦持ちに展開し、
+        空欄・変換できない日付を除いて月度ごとに day_number を振り直す。
+        """
+        if not pairs:
+            return []
+        
+        first_col = self.MONTH_BLOCKS[0][1]
+        last_col = min(self.MONTH_BLOCKS[-1][2], v2_rows.shape[1], v3_rows.shape[1])
+        if last_col <= first_col:
+            return []
+        
+        v2_positions = [pair[0] for pair in pairs]
+        v3_positions = [pair[1] for pair in pairs]
+        columns = np.arange(first_col, last_col)
         
-        return instruction_count
+        date_cells = v2_rows.iloc[v2_positions, first_col:last_col].to_numpy(dtype=str)
+        quantity_cells = v3_rows.iloc[v3_positions, first_col:last_col].to_numpy(dtype=str)
+        
+        long_df = pd.DataFrame({
+            'pair': np.repeat(np.arange(len(pairs)), len(columns)),
+            'col': np.tile(columns, len(pairs)),
+            'date_str': pd.Series(date_cells.ravel()).str.strip(),
+            'quantity_str': pd.Series(quantity_cells.ravel()).str.strip(),
+        })
+        long_df = long_df[~long_df['date_str'].isin(['', 'nan'])]
+        
+        # 日付は種類ごとに1回だけ変換
+        parsed_dates = {value: self._parse_japanese_date(value) for value in long_df['date_str'].unique()}
+        long_df['instruction_date'] = long_df['date_str'].map(parsed_dates)
+        long_df = long_df[long_df['instruction_date'].notna()]
+        if long_df.empty:
+            return []
+        
+        # 数量: 数値にできなければ0（int(float(x)) と同じ切り捨て）
+        long_df['quantity'] = (
+            pd.to_numeric(long_df['quantity_str'], errors='coerce').fillna(0).astype(int)
+        )
+        
+        # 月度と、月度内での連番（有効な日付だけを数える）
+        month_types = [block[0] for block in self.MONTH_BLOCKS]
+        month_bounds = [block[1] for block in self.MONTH_BLOCKS[1:]]
+        long_df['month_type'] = np.array(month_types)[np.searchsorted(month_bounds, long_df['col'], side='right')]
+        long_df['day_number'] = long_df.groupby(['pair', 'month_type'], sort=False).cumcount() + 1
+        
+        # ペア単位の共通項目
+        pair_info = []
+        for _, v3_position, product_id in pairs:
+            v3_row = v3_rows.iloc[v3_position]
+            pair_info.append({
+                'product_id': product_id,
+                'record_type': v3_row['レコード識別'],
+                'start_month': v3_row['スタート月度'],
+                'total_first': self._to_int(v3_row['初月度（指示）数合計']),
+                'total_next': self._to_int(v3_row['次月度(指示）数合計']),
+                'total_next_next': self._to_int(v3_row['次々月度(指示)数合計']),
+                'inspection_category': v3_row['検査区分']
+            })
+        
+        return [
+            {
+                **pair_info[pair],
+                'instruction_date': instruction_date,
+                'quantity': int(quantity),
+                'month_type': month_type,
+                'day_number': int(day_number)
+            }
+            for pair, instruction_date, quantity, month_type, day_number in zip(
+                long_df['pair'], long_df['instruction_date'], long_df['quantity'],
+                long_df['month_type'], long_df['day_number']
+            )
+        ]
     
-    def _create_delivery_progress_consolidated(self, v2_rows, v3_rows, product_ids) -> int:
+    def _create_delivery_progress_consolidated(self, v2_rows, v3_rows, product_ids,
+                                               instruction_range: Optional[Tuple[date, date]] = None) -> Optional[int]:
         """
         納入進度データを作成（製品コード統合版）
         ✅ 同じ製品コード×日付なら、検査区分が違っても数量を合計して1レコードにする
         ✅ 修正：生産指示データも製品コードベースで集約して重複計上を防ぐ
+        ✅ 集約対象は今回のファイルの製品コード×指示日の範囲に限定
+           （集約自体は製品コード単位なので、範囲内の合計値は全件集約と同じ）
+        ✅ 受注数を変えた日の計画進度・実績進度は同製品の同日以降へ差分伝播する
+           （新規行は直前の累積値を引き継ぐ。再計算ボタンを押さなくても累積値が合う）
+        ✅ 失敗した場合は None（取込全体を失敗として扱い、ハッシュを記録しない）
         """
         session = self.db.get_session()
         progress_count = 0
         
         try:
-            from sqlalchemy import text
+            from sqlalchemy import text, bindparam
+            
+            # ✅ ステップ1: 代表product_idのマッピングを作成
+            product_code_to_id = {}
+            for product_key, product_info in product_ids.items():
+                product_code, inspection_category = product_key
+                if product_code not in product_code_to_id:
+                    product_code_to_id[product_code] = product_info
             
-            # ✅ ステップ1: 生産指示データを製品コード×日付で直接集約
-            consolidated_instructions = {}
+            if not product_code_to_id:
+                return 0
             
-            # 全ての生産指示データを製品コードベースで集約
-            all_instructions = session.execute(text("""
+            # ✅ ステップ2: 今回の製品コード×日付範囲だけ生産指示データを集約
+            scope_sql = """
                 SELECT 
                     p.product_code,
                     pid.instruction_date,
                     SUM(pid.instruction_quantity) as total_quantity
                 FROM production_instructions_detail pid
                 JOIN products p ON pid.product_id = p.id
+                WHERE p.product_code IN :product_codes
+            """
+            params = {'product_codes': list(product_code_to_id)}
+            if instruction_range:
+                scope_sql += """
+                  AND pid.instruction_date >= :start_date
+                  AND pid.instruction_date <= :end_date
+                """
+                params['start_date'], params['end_date'] = instruction_range
+            scope_sql += """
                 GROUP BY p.product_code, pid.instruction_date
                 ORDER BY p.product_code, pid.instruction_date
-            """)).fetchall()
-            
-            for instruction in all_instructions:
-                product_code = instruction[0]
-                instruction_date = instruction[1]
-                total_quantity = instruction[2]
-                
-                key = (product_code, instruction_date)
-                consolidated_instructions[key] = total_quantity
+            """
+            all_instructions = session.execute(
+                text(scope_sql).bindparams(bindparam('product_codes', expanding=True)), params
+            ).fetchall()
             
-            # ✅ ステップ2: 代表product_idのマッピングを作成
-            product_code_to_id = {}
-            for product_key, product_info in product_ids.items():
-                product_code, inspection_category = product_key
-                if product_code not in product_code_to_id:
-                    product_code_to_id[product_code] = product_info
-            
-            # ✅ ステップ3: 集約したデータをdelivery_progressに登録
-            for (product_code, instruction_date), total_quantity in consolidated_instructions.items():
-                if product_code not in product_code_to_id:
-                    continue
-                    
+            # ✅ ステップ3: オーダーID（製品コード×日付でユニーク）ごとの登録内容を作成
+            consolidated = {}
+            for product_code, instruction_date, total_quantity in all_instructions:
                 product_info = product_code_to_id[product_code]
-                representative_product_id = product_info['product_id']
-                
-                # データNOを取得（最初に見つかったもの）
                 data_no = product_info.get('data_no')
-                
                 if data_no is None:
                     continue
                 
-                # オーダーIDを生成（製品コードベース）
                 order_id = f"ORD-{instruction_date.strftime('%Y%m%d')}-{product_code}"
+                consolidated[order_id] = {
+                    'order_id': order_id,
+                    'product_code': product_code,
+                    'product_id': product_info['product_id'],
+                    'instruction_date': instruction_date,
+                    'total_quantity': total_quantity,
+                    'data_no': data_no
+                }
+            
+            if not consolidated:
+                session.commit()
+                return 0
+            
+            # ✅ ステップ4: 既存レコードを1クエリで取得
+            existing = {}
+            for progress_id, order_id, order_quantity, product_id, delivery_date in session.execute(
+                text("""
+                    SELECT id, order_id, order_quantity, product_id, delivery_date FROM delivery_progress
+                    WHERE order_id IN :order_ids
+                    ORDER BY id
+                """).bindparams(bindparam('order_ids', expanding=True)),
+                {'order_ids': list(consolidated)}
+            ).fetchall():
+                existing.setdefault(order_id, (progress_id, order_quantity, product_id, delivery_date))
+            
+            # ✅ ステップ5: 数量が変わったものだけ更新し、未登録分はまとめて新規登録
+            update_rows = []
+            insert_rows = []
+            changed_keys = set()
+            for order_id, item in consolidated.items():
+                total_quantity = item['total_quantity']
+                product_code = item['product_code']
+                progress_count += 1
                 
-                # ✅ 既存チェック（製品コード×日付でユニーク）
-                existing = session.execute(text("""
-                    SELECT id, order_quantity FROM delivery_progress
-                    WHERE order_id = :order_id
-                """), {'order_id': order_id}).fetchone()
-                
-                if existing:
-                    # ✅ 既存レコードがあれば常に更新（数量0や同値でも更新）
-                    existing_id = existing[0]
-                    existing_quantity = existing[1]
-                    session.execute(text("""
-                        UPDATE delivery_progress
-                        SET order_quantity = :new_quantity,
-                            notes = :notes
-                        WHERE id = :progress_id
-                    """), {
+                if order_id in existing:
+                    existing_id, existing_quantity, existing_product_id, existing_date = existing[order_id]
+                    if existing_quantity is not None and existing_quantity == total_quantity:
+                        continue
+                    changed_keys.add((int(existing_product_id), progress_propagation.to_date(existing_date)))
+                    update_rows.append({
                         'progress_id': existing_id,
                         'new_quantity': total_quantity,
                         'notes': f'製品コード: {product_code} (数量更新: {existing_quantity}→{total_quantity})'
                     })
-                    progress_count += 1
                 else:
-                    # ✅ 新規登録
-                    session.execute(text("""
-                        INSERT INTO delivery_progress
-                        (order_id, product_id, order_date, delivery_date, 
-                        order_quantity, shipped_quantity, status, 
-                        customer_code, customer_name, priority, notes)
-                        VALUES
-                        (:order_id, :product_id, :order_date, :delivery_date,
-                        :order_quantity, 0, '未出荷',
-                        :customer_code, :customer_name, 5, :notes)
-                    """), {
+                    data_no = item['data_no']
+                    changed_keys.add((int(item['product_id']), progress_propagation.to_date(item['instruction_date'])))
+                    insert_rows.append({
                         'order_id': order_id,
-                        'product_id': representative_product_id,
-                        'order_date': instruction_date,
-                        'delivery_date': instruction_date,
+                        'product_id': item['product_id'],
+                        'order_date': item['instruction_date'],
+                        'delivery_date': item['instruction_date'],
                         'order_quantity': total_quantity,
                         'customer_code': f'C{data_no:03d}',
                         'customer_name': f'取引先{data_no}',
                         'notes': f'製品コード: {product_code} (検査区分統合済み)'
                     })
-                    
-                    progress_count += 1
+            
+            # ✅ ステップ6: 書き込み前の日別増分と、新規行が引き継ぐ累積値を取得
+            before = {}
+            if changed_keys:
+                changed_dates = [delivery_date for _, delivery_date in changed_keys]
+                changed_products = {product_id for product_id, _ in changed_keys}
+                before = progress_propagation.day_deltas(
+                    session, min(changed_dates), max(changed_dates), changed_products, for_update=True
+                )
+            for row in insert_rows:
+                row['planned_progress_quantity'], row['shipped_remaining_quantity'] = \
+                    progress_propagation.carry_over(session, row['product_id'], row['delivery_date'])
+            
+            if update_rows:
+                session.execute(text("""
+                    UPDATE delivery_progress
+                    SET order_quantity = :new_quantity,
+                        notes = :notes
+                    WHERE id = :progress_id
+                """), update_rows)
+            
+            if insert_rows:
+                session.execute(text("""
+                    INSERT INTO delivery_progress
+                    (order_id, product_id, order_date, delivery_date, 
+                    order_quantity, shipped_quantity, status, 
+                    customer_code, customer_name, priority, notes,
+                    planned_progress_quantity, shipped_remaining_quantity)
+                    VALUES
+                    (:order_id, :product_id, :order_date, :delivery_date,
+                    :order_quantity, 0, '未出荷',
+                    :customer_code, :customer_name, 5, :notes,
+                    :planned_progress_quantity, :shipped_remaining_quantity)
+                """), insert_rows)
+            
+            # ✅ ステップ7: 受注数が変わった日の差分を同製品の同日以降へ伝播
+            propagated = {'changed_days': 0}
+            if changed_keys:
+                propagated = progress_propagation.propagate(session, before, progress_propagation.day_deltas(
+                    session, min(changed_dates), max(changed_dates), changed_products
+                ))
             
             session.commit()
+            print(f"✅ 納入進度統合: 対象 {progress_count}件 (更新 {len(update_rows)}件, "
+                  f"新規 {len(insert_rows)}件, 変更なし {progress_count - len(update_rows) - len(insert_rows)}件, "
+                  f"進度伝播 {propagated['changed_days']}日)")
             return progress_count
         
         except Exception as e:
@@ -428,7 +982,7 @@ class CSVImportService:
             print(f"納入進度作成エラー: {e}")
             import traceback
             traceback.print_exc()
-            return 0
+            return None
         finally:
             session.close()
     
@@ -467,46 +1021,83 @@ class CSVImportService:
             return None
     
     def get_import_history(self) -> List[Dict]:
-        """インポート履歴を取得"""
+        """インポート履歴を取得（ハッシュ管理の列がなければ従来の列だけ）"""
         session = self.db.get_session()
         try:
             from sqlalchemy import text
-            result = session.execute(text("""
-                SELECT id, filename, import_date, record_count, status, message
-                FROM csv_import_history
-                ORDER BY import_date DESC
-                LIMIT 50
-            """)).fetchall()
+            try:
+                result = session.execute(text("""
+                    SELECT id, filename, import_date, record_count, status,
+                           changed_products, skipped_products, file_hash, message
+                    FROM csv_import_history
+                    ORDER BY import_date DESC
+                    LIMIT 50
+                """)).fetchall()
+            except Exception as e:
+                print(f"⚠️ ハッシュ管理の列を取得できません（migrations/add_csv_import_hashes.py 未実行？）: {e}")
+                session.rollback()
+                result = session.execute(text("""
+                    SELECT id, filename, import_date, record_count, status, message
+                    FROM csv_import_history
+                    ORDER BY import_date DESC
+                    LIMIT 50
+                """)).fetchall()
+                return [{'ID': r[0], 'ファイル名': r[1], 'インポート日時': r[2], 
+                        '登録件数': r[3], 'ステータス': r[4], 'メッセージ': r[5]} for r in result]
             
             return [{'ID': r[0], 'ファイル名': r[1], 'インポート日時': r[2], 
-                    '登録件数': r[3], 'ステータス': r[4], 'メッセージ': r[5]} for r in result]
+                    '登録件数': r[3], 'ステータス': r[4],
+                    '変更製品数': r[5], 'スキップ製品数': r[6],
+                    'ファイルハッシュ': (r[7] or '')[:12], 'メッセージ': r[8]} for r in result]
         except Exception:
             return []
         finally:
             session.close()
     
-    def log_import_history(self, filename: str, message: str):
-        """インポート履歴を記録"""
+    def log_import_history(self, filename: str, message: str, stats: Dict = None):
+        """
+        インポート履歴を記録（stats: import_csv_data のハッシュ判定結果）
+
+        ハッシュ管理の列がなければ従来の列だけを記録する。
+        """
         session = self.db.get_session()
         try:
             from sqlalchemy import text
             import re
             match = re.search(r'(\d+)件', message)
             record_count = int(match.group(1)) if match else 0
-            
-            session.execute(text("""
-                INSERT INTO csv_import_history 
-                (filename, import_date, record_count, status, message)
-                VALUES (:filename, :import_date, :record_count, :status, :message)
-            """), {
+            stats = stats or {}
+            params = {
                 'filename': filename,
                 'import_date': datetime.now(),
                 'record_count': record_count,
-                'status': '成功',
-                'message': message
-            })
+                'status': 'スキップ' if stats.get('file_skipped') else '成功',
+                'message': message,
+                'file_hash': stats.get('file_hash'),
+                'changed_products': stats.get('changed_products'),
+                'skipped_products': stats.get('skipped_products'),
+                'progress_created': int(bool(stats.get('create_progress'))) if stats else None
+            }
+            
+            try:
+                session.execute(text("""
+                    INSERT INTO csv_import_history 
+                    (filename, import_date, record_count, status, message,
+                     file_hash, changed_products, skipped_products, progress_created)
+                    VALUES (:filename, :import_date, :record_count, :status, :message,
+                     :file_hash, :changed_products, :skipped_products, :progress_created)
+                """), params)
+            except Exception as e:
+                print(f"⚠️ ハッシュ管理の列に記録できません（migrations/add_csv_import_hashes.py 未実行？）: {e}")
+                session.rollback()
+                session.execute(text("""
+                    INSERT INTO csv_import_history 
+                    (filename, import_date, record_count, status, message)
+                    VALUES (:filename, :import_date, :record_count, :status, :message)
+                """), params)
             session.commit()
-        except Exception:
+        except Exception as e:
             session.rollback()
+            print(f"❌ インポート履歴の記録エラー: {e}")
         finally:
             session.close()
\ No newline at end of file
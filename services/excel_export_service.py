@@ -10,6 +10,7 @@ from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
 from openpyxl.utils.dataframe import dataframe_to_rows
 from io import BytesIO
 from typing import Dict, Any
+from domain.calculators.plan_frame import PlanFrame
 
 class ExcelExportService:
     """Excel出力サービス"""
@@ -99,6 +100,7 @@ class ExcelExportService:
     def _create_daily_plan_sheets(self, wb: Workbook, plan_result: Dict):
         """日別計画シート作成"""
         daily_plans = plan_result['daily_plans']
+        rows_by_date = PlanFrame.of(plan_result).by_date()
         
         for date_str in sorted(daily_plans.keys()):
             plan = daily_plans[date_str]
@@ -123,30 +125,23 @@ class ExcelExportService:
                 cell.alignment = Alignment(horizontal='center')
             
             # データ行
-            row_idx = 5
-            for truck_idx, truck_plan in enumerate(plan['trucks'], start=1):
-                truck_name = truck_plan['truck_name']
-                utilization = truck_plan['utilization']
-                
-                for item in truck_plan['loaded_items']:
+            rows = rows_by_date.get(date_str)
+            if rows is not None:
+                columns = ['truck_index', 'truck_name', 'product_code', 'product_name', 'num_containers',
+                           'total_quantity', 'delivery_date_str', 'volume_rate', 'weight_rate']
+                for row_idx, (truck_idx, truck_name, product_code, product_name, num_containers, total_quantity,
+                              delivery_date, volume_rate, weight_rate) in enumerate(
+                        rows[columns].itertuples(index=False, name=None), start=5):
                     ws.cell(row=row_idx, column=1, value=truck_idx)
                     ws.cell(row=row_idx, column=2, value=truck_name)
-                    ws.cell(row=row_idx, column=3, value=item.get('product_code', ''))
-                    ws.cell(row=row_idx, column=4, value=item.get('product_name', ''))
-                    ws.cell(row=row_idx, column=5, value=item.get('num_containers', 0))
-                    ws.cell(row=row_idx, column=6, value=item.get('total_quantity', 0))
-                    
-                    delivery_date = item.get('delivery_date')
+                    ws.cell(row=row_idx, column=3, value=product_code)
+                    ws.cell(row=row_idx, column=4, value=product_name)
+                    ws.cell(row=row_idx, column=5, value=num_containers)
+                    ws.cell(row=row_idx, column=6, value=total_quantity)
                     if delivery_date:
-                        if hasattr(delivery_date, 'strftime'):
-                            ws.cell(row=row_idx, column=7, value=delivery_date.strftime('%Y-%m-%d'))
-                        else:
-                            ws.cell(row=row_idx, column=7, value=str(delivery_date))
-                    
-                    ws.cell(row=row_idx, column=8, value=f"{utilization['volume_rate']}%")
-                    ws.cell(row=row_idx, column=9, value=f"{utilization['weight_rate']}%")
-                    
-                    row_idx += 1
+                        ws.cell(row=row_idx, column=7, value=delivery_date)
+                    ws.cell(row=row_idx, column=8, value=f"{volume_rate}%")
+                    ws.cell(row=row_idx, column=9, value=f"{weight_rate}%")
             
             # 列幅調整
             for col in ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'I']:
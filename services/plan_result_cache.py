@@ -0,0 +1,65 @@
+# app/services/plan_result_cache.py
+"""
+積載計画結果のキャッシュ
+
+同じ期間・同じデータで「積載計画を作成」を押し直したときに計画を再計算しないよう、
+入力の指紋（期間・計画パラメータ・入力テーブルのデータ版数）をキーに結果を保持する。
+データ版数は DatabaseManager がコミットされた書き込みごとに進めるため、
+サービス・リポジトリ経由の書き込みがあれば古いキーには二度と一致しない（LRU で追い出される）。
+"""
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+
+class PlanResultCache:
+    """入力の指紋 → 計画結果 の LRU キャッシュ（件数上限・有効期限付き）"""
+
+    def __init__(self, max_entries: int = 16, ttl_sec: float = 600):
+        self.max_entries = max_entries
+        # DB を直接更新された場合に備えた有効期限（秒）
+        self.ttl_sec = ttl_sec
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Dict[str, Any]]:
+        """キャッシュ済みの計画結果を取得（呼び出し側が変更しても良いよう毎回復元した別オブジェクトを返す）"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl_sec:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            payload = entry[1]
+        return pickle.loads(payload)
+
+    def put(self, key: Hashable, result: Dict[str, Any]):
+        """計画結果を保存（件数上限を超えたら最も古く使われたものを削除）"""
+        payload = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'bytes': sum(len(payload) for _, payload in self._entries.values())
+            }
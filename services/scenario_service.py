@@ -0,0 +1,237 @@
+# app/services/scenario_service.py
+"""
+配送便計画の what-if シナリオ一括実行
+
+受注・製品・容器・トラック・会社カレンダーを MySQL から一度だけ読み込んで
+スナップショットにし、シナリオごとの上書きを適用した計画をワーカープロセスで並列に計算する。
+結果は便数・積載率・警告・積み残しをシナリオ別に並べた比較表で返す。
+
+シナリオの指定（すべて省略可）:
+    {
+        'name': '4台目のデフォルト便',
+        'add_trucks': [{'copy_of': 1, 'name': '追加便', 'default_use': 1}],
+        'truck_updates': {3: {'default_use': 1}},              # トラックID → 列の上書き
+        'product_updates': {'V012345678': {'can_advance': 1}},  # 製品コード → 列の上書き
+        'holidays': ['2025-10-23'],                            # 休日にする日
+        'working_days': ['2025-10-25'],                        # 営業日にする日
+    }
+"""
+import contextlib
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+from domain.calculators.transport_planner import TransportPlanner
+from repository.calendar_repository import WorkingDayIndex
+from services.transport_service import TransportService
+
+BASE_SCENARIO_NAME = 'ベース'
+
+
+@dataclass
+class PlanningSnapshot:
+    """シナリオ比較の基準入力（営業日の絞り込み前の受注とマスタ一式）"""
+    start_date: date
+    days: int
+    orders_df: pd.DataFrame
+    products_df: pd.DataFrame
+    containers: List[Any]
+    trucks_df: pd.DataFrame
+    truck_container_rules: List[Any]
+    calendar: Optional[WorkingDayIndex] = None
+
+
+class ScenarioService:
+    """what-if シナリオの一括実行"""
+
+    def __init__(self, transport_service: TransportService):
+        self.transport_service = transport_service
+
+    def load_snapshot(self, start_date: date, days: int = 7, use_delivery_progress: bool = True,
+                      use_calendar: bool = True) -> PlanningSnapshot:
+        """計画入力を一度だけ読み込む（全シナリオで共有）"""
+        service = self.transport_service
+        orders_df = service.load_planning_orders(start_date, days, use_delivery_progress)
+        products_df, containers, trucks_df, truck_container_rules = service.load_planning_masters()
+        calendar = None
+        if use_calendar and service.calendar_repo:
+            # 営業日で days 日分を数えるため、期間の2倍＋前後の余裕を含めて読み込む
+            calendar = service.calendar_repo.get_working_day_index(
+                start_date - timedelta(days=31), start_date + timedelta(days=days * 2 + 31)
+            )
+        return PlanningSnapshot(
+            start_date=start_date,
+            days=days,
+            orders_df=orders_df,
+            products_df=products_df,
+            containers=containers,
+            trucks_df=trucks_df,
+            truck_container_rules=truck_container_rules,
+            calendar=calendar
+        )
+
+    def run_scenarios(self, snapshot: PlanningSnapshot, scenarios: List[Dict[str, Any]],
+                      max_workers: int = None, include_base: bool = True) -> Dict[str, Any]:
+        """
+        シナリオを並列実行して比較表を作成
+
+        Returns:
+            Dict: table（比較表 DataFrame）, results（シナリオ名 → 計画結果）
+        """
+        scenarios = list(scenarios)
+        if include_base and not any(s.get('name') == BASE_SCENARIO_NAME for s in scenarios):
+            scenarios.insert(0, {'name': BASE_SCENARIO_NAME})
+        for index, scenario in enumerate(scenarios, start=1):
+            scenario.setdefault('name', f"シナリオ{index}")
+
+        workers = min(max_workers or os.cpu_count() or 1, len(scenarios))
+        outcomes = None
+        if workers > 1:
+            try:
+                with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                         initargs=(snapshot,)) as executor:
+                    outcomes = list(executor.map(_run_scenario, scenarios))
+            except Exception as e:
+                print(f"⚠️ シナリオの並列実行に失敗したため逐次実行します: {e}")
+        if outcomes is None:
+            outcomes = [run_scenario(snapshot, scenario) for scenario in scenarios]
+
+        rows = [outcome['metrics'] for outcome in outcomes]
+        table = pd.DataFrame(rows)
+        base_row = next((row for row in rows if row['シナリオ'] == BASE_SCENARIO_NAME), None)
+        if base_row is not None and not table.empty:
+            table.insert(2, '便数差', table['便数'] - base_row['便数'])
+        print(f"✅ シナリオ {len(scenarios)}件を実行しました（{workers}プロセス）")
+        return {
+            'table': table,
+            'results': {outcome['metrics']['シナリオ']: outcome['result'] for outcome in outcomes}
+        }
+
+
+def apply_scenario(snapshot: PlanningSnapshot, scenario: Dict[str, Any]) -> Dict[str, Any]:
+    """スナップショットにシナリオの上書きを適用した計画入力を作成（スナップショット自体は変更しない）"""
+    products_df = snapshot.products_df.copy()
+    for product_code, updates in (scenario.get('product_updates') or {}).items():
+        mask = products_df['product_code'].astype(str) == str(product_code)
+        if not mask.any():
+            raise ValueError(f"製品コード {product_code} が見つかりません")
+        for column, value in updates.items():
+            products_df.loc[mask, column] = value
+
+    trucks_df = snapshot.trucks_df.copy()
+    for truck_id, updates in (scenario.get('truck_updates') or {}).items():
+        mask = trucks_df['id'] == int(truck_id)
+        if not mask.any():
+            raise ValueError(f"トラックID {truck_id} が見つかりません")
+        for column, value in updates.items():
+            trucks_df.loc[mask, column] = value
+    for truck in scenario.get('add_trucks') or []:
+        truck = dict(truck)
+        copy_of = truck.pop('copy_of', None)
+        row = {}
+        if copy_of is not None:
+            source = trucks_df[trucks_df['id'] == int(copy_of)]
+            if source.empty:
+                raise ValueError(f"複製元のトラックID {copy_of} が見つかりません")
+            row = source.iloc[0].to_dict()
+        row.update(truck)
+        row['id'] = int(trucks_df['id'].max()) + 1 if not trucks_df.empty else 1
+        trucks_df = pd.concat([trucks_df, pd.DataFrame([row])], ignore_index=True)
+
+    calendar = snapshot.calendar
+    holidays = [_to_date(value) for value in scenario.get('holidays') or []]
+    working_days = [_to_date(value) for value in scenario.get('working_days') or []]
+    if calendar is not None and (holidays or working_days):
+        calendar = calendar.with_overrides(holidays, working_days)
+
+    return {
+        'products_df': products_df,
+        'trucks_df': trucks_df,
+        'calendar': calendar
+    }
+
+
+def summarize_plan(result: Dict[str, Any]) -> Dict[str, Any]:
+    """計画結果から比較用の指標を集計"""
+    utilizations = []
+    remaining_count = 0
+    remaining_quantity = 0
+    special_items = 0
+    for plan in result.get('daily_plans', {}).values():
+        for truck_plan in plan.get('trucks', []):
+            utilizations.append(truck_plan.get('utilization', {}).get('floor_area_rate', 0) or 0)
+            special_items += sum(
+                1 for item in truck_plan.get('loaded_items', []) if item.get('is_special_delivery')
+            )
+        for demand in plan.get('remaining_demands') or []:
+            remaining_count += 1
+            remaining_quantity += demand.get('total_quantity', 0) or 0
+    summary = result.get('summary', {})
+    return {
+        '便数': summary.get('total_trips', 0),
+        '平均積載率(%)': round(sum(utilizations) / len(utilizations), 1) if utilizations else 0,
+        '警告数': summary.get('total_warnings', 0),
+        '積み残し件数': remaining_count,
+        '積み残し数量': remaining_quantity,
+        '特便明細数': special_items,
+    }
+
+
+def run_scenario(snapshot: PlanningSnapshot, scenario: Dict[str, Any]) -> Dict[str, Any]:
+    """1シナリオ分の計画を計算（プランナーのログは抑止）"""
+    started = time.perf_counter()
+    metrics = {'シナリオ': scenario['name']}
+    result = None
+    try:
+        inputs = apply_scenario(snapshot, scenario)
+        with contextlib.redirect_stdout(io.StringIO()):
+            orders_df = TransportService.prepare_planning_orders(snapshot.orders_df, inputs['calendar'])
+            if orders_df is None or orders_df.empty:
+                result = {'daily_plans': {}, 'summary': {'total_trips': 0, 'total_warnings': 0}}
+            else:
+                result = TransportPlanner().calculate_loading_plan_from_orders(
+                    orders_df=orders_df,
+                    products_df=inputs['products_df'],
+                    containers=snapshot.containers,
+                    trucks_df=inputs['trucks_df'],
+                    truck_container_rules=snapshot.truck_container_rules,
+                    start_date=snapshot.start_date,
+                    days=snapshot.days,
+                    calendar_repo=inputs['calendar']
+                )
+        metrics.update(summarize_plan(result))
+        metrics['エラー'] = ''
+    except Exception as e:
+        metrics.update({'便数': 0, '平均積載率(%)': 0, '警告数': 0, '積み残し件数': 0,
+                        '積み残し数量': 0, '特便明細数': 0, 'エラー': str(e)})
+    metrics['計算時間(秒)'] = round(time.perf_counter() - started, 2)
+    return {'metrics': metrics, 'result': result}
+
+
+def _to_date(value) -> date:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return pd.to_datetime(value).date()
+
+
+# ---- ワーカープロセス ----
+
+_worker_snapshot: Optional[PlanningSnapshot] = None
+
+
+def _init_worker(snapshot: PlanningSnapshot):
+    """スナップショットはワーカーごとに一度だけ受け取る"""
+    global _worker_snapshot
+    _worker_snapshot = snapshot
+
+
+def _run_scenario(scenario: Dict[str, Any]) -> Dict[str, Any]:
+    return run_scenario(_worker_snapshot, scenario)
@@ -1,5 +1,5 @@
 # app/services/transport_service.py（カレンダー統合版）
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from datetime import date, timedelta
 from repository.transport_repository import TransportRepository
 from repository.production_repository import ProductionRepository
@@ -8,10 +8,15 @@ from repository.loading_plan_repository import LoadingPlanRepository
 from repository.delivery_progress_repository import DeliveryProgressRepository
 from repository.calendar_repository import CalendarRepository  # ✅ 追加
 from domain.calculators.transport_planner import TransportPlanner
+from domain.calculators.plan_frame import PlanFrame
+from repository.database_manager import DatabaseManager
+from repository import master_data_cache
+from services.plan_result_cache import PlanResultCache
+from config import APP_CONFIG
 from domain.validators.loading_validator import LoadingValidator
 from domain.models.transport import LoadingItem
 import pandas as pd
-from datetime import datetime
+import time
 from io import BytesIO
 import json
 from sqlalchemy import text
@@ -19,6 +24,12 @@ from sqlalchemy import text
 class TransportService:
     """運送関連ビジネスロジック（カレンダー統合版）"""
     
+    # 積載計画の入力になるテーブル（いずれかに書き込みがあればキャッシュ済みの計画は使わない）
+    PLAN_INPUT_TABLES = (
+        'delivery_progress', 'production_instructions_detail', 'products',
+        'container_capacity', 'truck_master', 'truck_container_rules', 'company_calendar'
+    )
+    
     def __init__(self, db_manager):
         self.transport_repo = TransportRepository(db_manager)
         self.production_repo = ProductionRepository(db_manager)
@@ -27,8 +38,20 @@ class TransportService:
         self.delivery_progress_repo = DeliveryProgressRepository(db_manager)
         self.calendar_repo = CalendarRepository(db_manager)  # ✅ 追加
         
-        self.planner = TransportPlanner()
+        # プランナーは実行中の状態（フォールバック製品・グループ/差分レポート）を持つため、
+        # 計画ごとに new_planner() で作る（このサービスはセッション間で共有される）
+        self.planner_options = {
+            'use_columnar_demand': True,
+            'check_demand_parity': False,
+            'parallel_groups': APP_CONFIG.planner_parallel_groups,
+            'max_workers': APP_CONFIG.planner_max_workers
+        }
         self.db = db_manager
+        self.plan_cache = PlanResultCache(APP_CONFIG.plan_cache_size, APP_CONFIG.plan_cache_ttl_sec)
+
+    def new_planner(self) -> TransportPlanner:
+        """計画1回分のプランナー"""
+        return TransportPlanner(**self.planner_options)
     
     def get_containers(self):
         """容器一覧取得"""
@@ -38,6 +61,10 @@ class TransportService:
         """トラック一覧取得"""
         return self.transport_repo.get_trucks()
 
+    def get_master_snapshot(self) -> master_data_cache.MasterDataSnapshot:
+        """製品・容器・トラック・ルールの共有スナップショット（読み取り専用、参照用マップ付き）"""
+        return master_data_cache.get_snapshot(self.db)
+
     def delete_truck(self, truck_id: int) -> bool:
         """トラック削除"""
         return self.transport_repo.delete_truck(truck_id) 
@@ -102,7 +129,8 @@ class TransportService:
                                           start_date: date, 
                                           days: int = 7,
                                           use_delivery_progress: bool = True,
-                                          use_calendar: bool = True) -> Dict[str, Any]:  # ✅ use_calendar追加
+                                          use_calendar: bool = True,
+                                          profile: bool = False) -> Dict[str, Any]:  # ✅ use_calendar追加
         """
         オーダー情報から積載計画を自動作成（カレンダー対応）
         
@@ -111,84 +139,26 @@ class TransportService:
             days: 計画日数
             use_delivery_progress: 納入進度を使用するか
             use_calendar: 会社カレンダーを使用するか（営業日のみで計画）
+            profile: ステップ別の処理時間を計測して result['profile'] に格納するか
+
+        result['from_cache'] は前回の計算結果を使ったかどうか（キャッシュには含めない）
         """
         
         end_date = start_date + timedelta(days=days - 1)
-        
-        if use_delivery_progress:
-            orders_df = self.delivery_progress_repo.get_delivery_progress(start_date, end_date)
-            
-            if orders_df.empty:
-                orders_df = self.production_repo.get_production_instructions(start_date, end_date)
-                
-                if not orders_df.empty:
-                    orders_df = orders_df.rename(columns={
-                        'instruction_date': 'delivery_date',
-                        'instruction_quantity': 'order_quantity'
-                    })
-        else:
-            orders_df = self.production_repo.get_production_instructions(start_date, end_date)
-            
-            if not orders_df.empty:
-                orders_df = orders_df.rename(columns={
-                    'instruction_date': 'delivery_date',
-                    'instruction_quantity': 'order_quantity'
-                })
-        
-        if orders_df is not None and not orders_df.empty:
-            if 'delivery_date' in orders_df.columns:
-                orders_df['delivery_date'] = pd.to_datetime(orders_df['delivery_date']).dt.date
-
-            if use_calendar and self.calendar_repo:
-                orders_df = orders_df[
-                    orders_df['delivery_date'].apply(self.calendar_repo.is_working_day)
-                ].reset_index(drop=True)
-        
-        if orders_df is not None and not orders_df.empty:
-            if 'delivery_date' in orders_df.columns:
-                orders_df['delivery_date'] = pd.to_datetime(orders_df['delivery_date']).dt.date
-
-            if use_calendar and self.calendar_repo:
-                orders_df = orders_df[
-                    orders_df['delivery_date'].apply(self.calendar_repo.is_working_day)
-                ].reset_index(drop=True)
-
-            # 納入進捗・計画進度を加味した計画数量を算出
-            remaining_qty = None
-            if 'remaining_quantity' in orders_df.columns:
-                remaining_qty = orders_df['remaining_quantity']
-            elif {'order_quantity', 'shipped_quantity'}.issubset(orders_df.columns):
-                remaining_qty = orders_df['order_quantity'] - orders_df['shipped_quantity']
+        calendar = self.calendar_repo if use_calendar else None
 
-            if remaining_qty is not None:
-                orders_df['__remaining_qty'] = remaining_qty.fillna(0).clip(lower=0)
-            else:
-                if 'order_quantity' in orders_df.columns:
-                    remaining_base = orders_df['order_quantity'].fillna(0)
-                else:
-                    remaining_base = pd.Series(0, index=orders_df.index)
-                orders_df['__remaining_qty'] = remaining_base.clip(lower=0)
-
-            if 'planned_progress_quantity' in orders_df.columns:
-                orders_df['__progress_deficit'] = orders_df['planned_progress_quantity'].fillna(0).apply(
-                    lambda x: max(0, -x)
-                )
-            else:
-                orders_df['__progress_deficit'] = 0
-
-            # 計画数量は基本的に残数量。計画進度がマイナスの場合は不足分を優先しつつ残数量を上限とする
-            orders_df['planning_quantity'] = orders_df['__remaining_qty']
-            backlog_mask = orders_df['__progress_deficit'] > 0
-            if backlog_mask.any():
-                orders_df.loc[backlog_mask, 'planning_quantity'] = orders_df.loc[backlog_mask].apply(
-                    lambda row: min(row['__remaining_qty'], row['__progress_deficit']) if row['__remaining_qty'] > 0 else 0,
-                    axis=1
-                )
+        # 計測時は毎回計算する。キーは読み込み前に取るので、計算中の書き込みは次回の別キーになる
+        cache_key = None if profile else self._plan_cache_key(start_date, days, use_delivery_progress, use_calendar)
+        if cache_key is not None:
+            started = time.perf_counter()
+            cached = self.plan_cache.get(cache_key)
+            if cached is not None:
+                print(f"✅ 積載計画キャッシュを使用 ({(time.perf_counter() - started) * 1000:.1f} ms)")
+                cached['from_cache'] = True
+                return cached
 
-            # 残/不足ともに0の場合はスキップ
-            orders_df = orders_df[orders_df['planning_quantity'] > 0].reset_index(drop=True)
-
-            orders_df.drop(columns=['__remaining_qty', '__progress_deficit'], inplace=True, errors='ignore')
+        orders_df = self.load_planning_orders(start_date, days, use_delivery_progress)
+        orders_df = self.prepare_planning_orders(orders_df, calendar)
 
         if orders_df is None or orders_df.empty:
             return {
@@ -201,16 +171,84 @@ class TransportService:
                     'status': '正常'
                 },
                 'unloaded_tasks': [],
-                'period': f"{start_date.strftime('%Y-%m-%d')} ~ {end_date.strftime('%Y-%m-%d')}"
+                'period': f"{start_date.strftime('%Y-%m-%d')} ~ {end_date.strftime('%Y-%m-%d')}",
+                'from_cache': False
             }
         
-        products_df = self.product_repo.get_all_products()
-        containers = self.get_containers()
-        trucks_df = self.get_trucks()
-        truck_container_rules = self.transport_repo.get_truck_container_rules()
+        products_df, containers, trucks_df, truck_container_rules = self.load_planning_masters()
         
         # ✅ カレンダーリポジトリを渡す
-        result = self.planner.calculate_loading_plan_from_orders(
+        result = self.new_planner().calculate_loading_plan_from_orders(
+            orders_df=orders_df,
+            products_df=products_df,
+            containers=containers,
+            trucks_df=trucks_df,
+            truck_container_rules=truck_container_rules,
+            start_date=start_date,
+            days=days,
+            calendar_repo=calendar,  # カレンダー渡す
+            profile=profile
+        )
+
+        result['unplanned_orders'] = self._find_unplanned_orders(orders_df, result)
+        if cache_key is not None:
+            self.plan_cache.put(cache_key, result)
+        result['from_cache'] = False
+
+        return result
+
+    def _plan_cache_key(self, start_date: date, days: int, use_delivery_progress: bool,
+                        use_calendar: bool) -> tuple:
+        """計画結果キャッシュのキー（期間・計画パラメータ・入力テーブルのデータ版数）"""
+        return (
+            start_date,
+            days,
+            use_delivery_progress,
+            use_calendar,
+            self.planner_options['use_columnar_demand'],
+            self.planner_options['check_demand_parity'],
+            DatabaseManager.data_versions(self.PLAN_INPUT_TABLES)
+        )
+
+    def planning_input_versions(self) -> tuple:
+        """計画の入力テーブルのデータ版数（計画作成後に、どの経路で書き換わったかを問わず変更を検知する用）"""
+        return DatabaseManager.data_versions(self.PLAN_INPUT_TABLES)
+
+    def progress_change_cursor(self) -> int:
+        """納入進度の変更履歴の現在位置（計画作成時に保持し、差分再計算で使う）"""
+        return self.delivery_progress_repo.change_cursor()
+
+    def changed_progress_keys_since(self, cursor: int) -> Tuple[Optional[set], int]:
+        """cursor 以降に納入進度の書き込みで変わった (product_id, delivery_date) と新しい位置（追跡できなければ None）"""
+        return self.delivery_progress_repo.changed_keys_since(cursor)
+
+    def replan_loading_plan(self, previous_result: Dict[str, Any], changed_keys,
+                            start_date: date, days: int = 7,
+                            use_delivery_progress: bool = True,
+                            use_calendar: bool = True) -> Dict[str, Any]:
+        """
+        変更された受注だけを反映して積載計画を差分再計算
+
+        previous_result は同じ start_date / days / use_calendar で作成した計画結果。
+        変わった製品は前回結果に残した受注の指紋と比べて求める（changed_keys は分かっている変更の追加分、None 可）。
+        差分で計算できない場合は全体を再計算する。処理内容は result['replan_report'] に格納する。
+
+        差分再計算の結果は日ごとのトラックの並びが全体計算と異なることがあるため、計画キャッシュには入れない。
+        """
+        calendar = self.calendar_repo if use_calendar else None
+
+        orders_df = self.load_planning_orders(start_date, days, use_delivery_progress)
+        orders_df = self.prepare_planning_orders(orders_df, calendar)
+        if orders_df is None or orders_df.empty or not previous_result:
+            result = self.calculate_loading_plan_from_orders(start_date, days, use_delivery_progress, use_calendar)
+            result['replan_report'] = {'mode': 'full', 'reason': '受注または前回結果がありません'}
+            return result
+
+        products_df, containers, trucks_df, truck_container_rules = self.load_planning_masters()
+        planner = self.new_planner()
+        result = planner.replan_from_orders(
+            previous_result=previous_result,
+            changed_keys=changed_keys,
             orders_df=orders_df,
             products_df=products_df,
             containers=containers,
@@ -218,16 +256,115 @@ class TransportService:
             truck_container_rules=truck_container_rules,
             start_date=start_date,
             days=days,
-            calendar_repo=self.calendar_repo if use_calendar else None  # カレンダー渡す
+            calendar_repo=calendar
         )
 
         result['unplanned_orders'] = self._find_unplanned_orders(orders_df, result)
+        result['from_cache'] = False
+        result['replan_report'] = planner.last_replan_report
 
         return result
 
+    def load_planning_orders(self, start_date: date, days: int = 7,
+                             use_delivery_progress: bool = True) -> pd.DataFrame:
+        """計画対象の受注を取得（納入進度が無ければ生産指示、営業日の絞り込み前）"""
+        end_date = start_date + timedelta(days=days - 1)
+
+        if use_delivery_progress:
+            orders_df = self.delivery_progress_repo.get_delivery_progress(start_date, end_date)
+            
+            if orders_df.empty:
+                orders_df = self.production_repo.get_production_instructions(start_date, end_date)
+                
+                if not orders_df.empty:
+                    orders_df = orders_df.rename(columns={
+                        'instruction_date': 'delivery_date',
+                        'instruction_quantity': 'order_quantity'
+                    })
+        else:
+            orders_df = self.production_repo.get_production_instructions(start_date, end_date)
+            
+            if not orders_df.empty:
+                orders_df = orders_df.rename(columns={
+                    'instruction_date': 'delivery_date',
+                    'instruction_quantity': 'order_quantity'
+                })
+        return orders_df
+
+    def load_planning_masters(self):
+        """計画に使うマスタ（製品・容器・トラック・トラック×容器ルール）を取得"""
+        products_df = self.product_repo.get_all_products()
+        containers = self.get_containers()
+        trucks_df = self.get_trucks()
+        truck_container_rules = self.transport_repo.get_truck_container_rules()
+        return products_df, containers, trucks_df, truck_container_rules
+
+    @staticmethod
+    def prepare_planning_orders(orders_df: pd.DataFrame, calendar=None) -> pd.DataFrame:
+        """
+        受注を営業日で絞り込み、計画数量（planning_quantity）を算出
+
+        calendar は is_working_day(date) を持つもの（CalendarRepository / WorkingDayIndex）。
+        DBにアクセスしないため、シナリオ実行のワーカープロセスからも使う。
+        """
+        if orders_df is None or orders_df.empty:
+            return orders_df
+
+        orders_df = orders_df.copy()
+        if 'delivery_date' in orders_df.columns:
+            orders_df['delivery_date'] = pd.to_datetime(orders_df['delivery_date']).dt.date
+
+            if calendar is not None:
+                orders_df = orders_df[
+                    orders_df['delivery_date'].apply(calendar.is_working_day)
+                ].reset_index(drop=True)
+
+        # 納入進捗・計画進度を加味した計画数量を算出
+        remaining_qty = None
+        if 'remaining_quantity' in orders_df.columns:
+            remaining_qty = orders_df['remaining_quantity']
+        elif {'order_quantity', 'shipped_quantity'}.issubset(orders_df.columns):
+            remaining_qty = orders_df['order_quantity'] - orders_df['shipped_quantity']
+
+        if remaining_qty is not None:
+            orders_df['__remaining_qty'] = remaining_qty.fillna(0).clip(lower=0)
+        else:
+            if 'order_quantity' in orders_df.columns:
+                remaining_base = orders_df['order_quantity'].fillna(0)
+            else:
+                remaining_base = pd.Series(0, index=orders_df.index)
+            orders_df['__remaining_qty'] = remaining_base.clip(lower=0)
+
+        if 'planned_progress_quantity' in orders_df.columns:
+            orders_df['__progress_deficit'] = orders_df['planned_progress_quantity'].fillna(0).apply(
+                lambda x: max(0, -x)
+            )
+        else:
+            orders_df['__progress_deficit'] = 0
+
+        # 計画数量は基本的に残数量。計画進度がマイナスの場合は不足分を優先しつつ残数量を上限とする
+        orders_df['planning_quantity'] = orders_df['__remaining_qty']
+        backlog_mask = orders_df['__progress_deficit'] > 0
+        if backlog_mask.any():
+            orders_df.loc[backlog_mask, 'planning_quantity'] = orders_df.loc[backlog_mask].apply(
+                lambda row: min(row['__remaining_qty'], row['__progress_deficit']) if row['__remaining_qty'] > 0 else 0,
+                axis=1
+            )
+
+        # 残/不足ともに0の場合はスキップ
+        orders_df = orders_df[orders_df['planning_quantity'] > 0].reset_index(drop=True)
+
+        orders_df.drop(columns=['__remaining_qty', '__progress_deficit'], inplace=True, errors='ignore')
+        return orders_df
+
     def save_loading_plan(self, plan_result: Dict[str, Any], plan_name: str = None) -> int:
         """積載計画をDBに保存"""
         return self.loading_plan_repo.save_loading_plan(plan_result, plan_name)
+
+    def save_loading_plan_with_report(self, plan_result: Dict[str, Any],
+                                      plan_name: str = None) -> Tuple[int, Dict[str, Any]]:
+        """積載計画をDBに保存し、(plan_id, 件数・処理時間のレポート) を返す"""
+        return self.loading_plan_repo.save_loading_plan_with_report(plan_result, plan_name)
     
     def get_loading_plan(self, plan_id: int) -> Dict[str, Any]:
         """保存済み積載計画を取得"""
@@ -320,125 +457,70 @@ class TransportService:
         output.seek(0)
         return output
     
+    @staticmethod
+    def _plan_export_df(plan_frame: PlanFrame, with_utilization: bool = True) -> pd.DataFrame:
+        """PlanFrame から出力用の明細表（日本語列名）を作成"""
+        items = plan_frame.items
+        data = {
+            '積載日': items['loading_date'],
+            'トラック名': items['truck_name'],
+            '製品コード': items['product_code'],
+            '製品名': items['product_name'],
+            '容器数': items['num_containers'],
+            '合計数量': items['total_quantity'],
+            '納期': items['delivery_date_str'],
+        }
+        if with_utilization:
+            data['体積積載率(%)'] = items['volume_rate']
+            data['重量積載率(%)'] = items['weight_rate']
+        # 前倒しフラグ
+        data['前倒し配送'] = items['is_advanced'].map({True: '○', False: '×'})
+        return pd.DataFrame(data).reset_index(drop=True)
+
     def _export_daily_plan(self, writer, plan_result):
         """日別計画をExcelシートに出力"""
         
-        daily_data = []
-        prev_date = None
+        plan_frame = PlanFrame.of(plan_result)
+        if plan_frame.empty:
+            return
         
-        for date_str in sorted(plan_result['daily_plans'].keys()):
-            plan = plan_result['daily_plans'][date_str]
-            
-            # 日付が変わったら空白行を挿入
-            if prev_date is not None and prev_date != date_str:
-                daily_data.append({
-                    '積載日': '',
-                    'トラック名': '',
-                    '製品コード': '',
-                    '製品名': '',
-                    '容器数': '',
-                    '合計数量': '',
-                    '納期': '',
-                    '体積積載率': '',
-                    '重量積載率': ''
-                })
-            
-            prev_date = date_str
-            
-            for truck in plan.get('trucks', []):
-                truck_name = truck.get('truck_name', '不明なトラック')
-                truck_id = truck.get('truck_id', 0)
-            
-                print(f"🔍 デバッグ: {date_str} - truck_id={truck_id}, truck_name={truck_name}")
-                for item in truck.get('loaded_items', []):
-                    # 前倒しフラグを取得
-                    is_advanced = item.get('is_advanced', False)
-                    advanced_mark = '○' if is_advanced else '×'
-                    
-                    daily_data.append({
-                        '積載日': date_str,
-                        'トラック名': truck['truck_name'],
-                        '製品コード': item.get('product_code', ''),
-                        '製品名': item.get('product_name', ''),
-                        '容器数': item.get('num_containers', 0),
-                        '合計数量': item.get('total_quantity', 0),
-                        '納期': item['delivery_date'].strftime('%Y-%m-%d') if 'delivery_date' in item else '',
-                        '体積積載率(%)': truck['utilization']['volume_rate'],
-                        '重量積載率(%)': truck['utilization']['weight_rate'],
-                        '前倒し配送': advanced_mark
-                    })
+        daily_df = self._plan_export_df(plan_frame)
+        rows_by_date = {
+            date_str: rows for date_str, rows in daily_df.groupby('積載日', sort=False)
+        }
+        
+        # 日付が変わったら空白行を挿入
+        blank_row = pd.DataFrame([{column: '' for column in daily_df.columns}])
+        parts = []
+        for index, date_str in enumerate(plan_frame.dates):
+            if index > 0:
+                parts.append(blank_row)
+            if date_str in rows_by_date:
+                parts.append(rows_by_date[date_str])
         
-        if daily_data:
-            daily_df = pd.DataFrame(daily_data)
-            daily_df.to_excel(writer, sheet_name='日別計画', index=False)
+        daily_df = pd.concat(parts, ignore_index=True)
+        daily_df.to_excel(writer, sheet_name='日別計画', index=False)
     
     def _export_weekly_plan(self, writer, plan_result):
         """週別計画をExcelシートに出力"""
         
-        from datetime import datetime
-        
-        weekly_data = {}
+        plan_frame = PlanFrame.of(plan_result)
+        if plan_frame.empty:
+            return
         
-        for date_str in sorted(plan_result['daily_plans'].keys()):
-            date_obj = datetime.strptime(date_str, '%Y-%m-%d')
-            week_num = date_obj.isocalendar()[1]
-            week_key = f"{date_obj.year}年第{week_num}週"
-            
-            if week_key not in weekly_data:
-                weekly_data[week_key] = []
-            
-            plan = plan_result['daily_plans'][date_str]
-            
-            for truck in plan.get('trucks', []):
-                for item in truck.get('loaded_items', []):
-                    # 前倒しフラグを取得
-                    is_advanced = item.get('is_advanced', False)
-                    advanced_mark = '○' if is_advanced else '×'
-                    
-                    weekly_data[week_key].append({
-                        '週': week_key,
-                        '積載日': date_str,
-                        'トラック名': truck['truck_name'],
-                        '製品コード': item.get('product_code', ''),
-                        '製品名': item.get('product_name', ''),
-                        '容器数': item.get('num_containers', 0),
-                        '合計数量': item.get('total_quantity', 0),
-                        '納期': item['delivery_date'].strftime('%Y-%m-%d') if 'delivery_date' in item else '',
-                        '前倒し配送': advanced_mark
-                    })
+        weekly_df = self._plan_export_df(plan_frame, with_utilization=False)
+        loading_dates = pd.to_datetime(weekly_df['積載日'], format='%Y-%m-%d')
+        week_numbers = loading_dates.dt.isocalendar()['week']
+        weekly_df.insert(0, '週', loading_dates.dt.year.astype(str) + '年第' + week_numbers.astype(str) + '週')
         
-        for week_key, items in weekly_data.items():
-            if items:
-                week_df = pd.DataFrame(items)
-                sheet_name = week_key[:31]
-                week_df.to_excel(writer, sheet_name=sheet_name, index=False)
+        for week_key, week_df in weekly_df.groupby('週', sort=False):
+            sheet_name = week_key[:31]
+            week_df.to_excel(writer, sheet_name=sheet_name, index=False)
     
     def export_loading_plan_to_csv(self, plan_result: Dict[str, Any]) -> str:
         """積載計画をCSV形式で出力"""
         
-        daily_data = []
-        
-        for date_str in sorted(plan_result['daily_plans'].keys()):
-            plan = plan_result['daily_plans'][date_str]
-            
-            for truck in plan.get('trucks', []):
-                for item in truck.get('loaded_items', []):
-                    # 前倒しフラグを取得
-                    is_advanced = item.get('is_advanced', False)
-                    advanced_mark = '○' if is_advanced else '×'
-                    
-                    daily_data.append({
-                        '積載日': date_str,
-                        'トラック名': truck['truck_name'],
-                        '製品コード': item.get('product_code', ''),
-                        '製品名': item.get('product_name', ''),
-                        '容器数': item.get('num_containers', 0),
-                        '合計数量': item.get('total_quantity', 0),
-                        '納期': item['delivery_date'].strftime('%Y-%m-%d') if 'delivery_date' in item else '',
-                        '体積積載率(%)': truck['utilization']['volume_rate'],
-                        '重量積載率(%)': truck['utilization']['weight_rate'],
-                        '前倒し配送': advanced_mark
-                    })
+        plan_frame = PlanFrame.of(plan_result)
         
         # 警告情報も追加
         warning_data = []
@@ -450,8 +532,8 @@ class TransportService:
                     '警告内容': warning
                 })
         
-        if daily_data:
-            df = pd.DataFrame(daily_data)
+        if not plan_frame.empty:
+            df = self._plan_export_df(plan_frame)
             csv_output = df.to_csv(index=False, encoding='utf-8-sig')
             
             # 警告がある場合は追加
@@ -485,28 +567,21 @@ class TransportService:
         orders = orders.dropna(subset=['product_id', 'delivery_date'])
         orders['product_id'] = orders['product_id'].astype(int)
 
-        planned_rows = []
-        for plan in plan_result.get('daily_plans', {}).values():
-            for truck in plan.get('trucks', []):
-                for item in truck.get('loaded_items', []):
-                    product_id = item.get('product_id')
-                    delivery_date = item.get('delivery_date')
-                    if product_id is None or delivery_date is None:
-                        continue
-                    if isinstance(delivery_date, datetime):
-                        delivery_date = delivery_date.date()
-                    planned_rows.append({
-                        'product_id': product_id,
-                        'delivery_date': delivery_date,
-                        'loaded_quantity': item.get('total_quantity', 0)
-                    })
+        items = PlanFrame.of(plan_result).items
+        planned_df = items.loc[
+            items['product_id'].notna() & items['delivery_date'].notna(),
+            ['product_id', 'delivery_date', 'total_quantity']
+        ]
 
-        if planned_rows:
-            planned_df = pd.DataFrame(planned_rows)
-            planned_df['delivery_date'] = pd.to_datetime(planned_df['delivery_date']).dt.date
+        if not planned_df.empty:
             planned_summary = (
-                planned_df.groupby(['product_id', 'delivery_date'])['loaded_quantity']
+                planned_df.assign(
+                    product_id=planned_df['product_id'].astype(int),
+                    delivery_date=pd.to_datetime(planned_df['delivery_date']).dt.date
+                )
+                .groupby(['product_id', 'delivery_date'])['total_quantity']
                 .sum()
+                .rename('loaded_quantity')
                 .reset_index()
             )
             orders = orders.merge(planned_summary, how='left', on=['product_id', 'delivery_date'])
@@ -602,13 +677,9 @@ class TransportService:
         finally:
             session.close()
 
-    def recompute_planned_progress_all(self, start_date: date, end_date: date) -> None:
-        products = self.product_repo.get_all_products()
-        if products is None or products.empty or 'id' not in products.columns:
-            return
-        product_ids = products['id'].dropna().astype(int).tolist()
-        for pid in product_ids:
-            self.recompute_planned_progress(pid, start_date, end_date)
+    def recompute_planned_progress_all(self, start_date: date, end_date: date) -> Dict[str, Any]:
+        """全製品の計画進度を一括再計算（製品ごとのストアド呼び出しを集合演算1文に置き換え）"""
+        return self.delivery_progress_repo.recompute_planned_progress_all(start_date, end_date)
     # --- 実績進度（shipped_remaining_quantity）の再計算 ---
     def recompute_shipped_remaining(self, product_id: int, start_date: date, end_date: date) -> None:
         """
@@ -8,6 +8,9 @@ from services.transport_service import TransportService
 class CSVImportPage:
     """CSV受注インポートページ"""
     
+    # これより大きいファイルは分割読み込みを既定にする
+    STREAMING_THRESHOLD_BYTES = 5 * 1024 * 1024
+    
     def __init__(self, db_manager):
         self.import_service = CSVImportService(db_manager)
         self.service = TransportService(db_manager)    
@@ -54,8 +57,11 @@ class CSVImportPage:
 
             with col_recalc_all:
                 if st.button("全製品を再計算", key="recalc_all_upload"):
-                    self.service.recompute_planned_progress_all(recal_start_date, recal_end_date)
-                    st.success("全ての製品に対する再計算が完了しました")
+                    report = self.service.recompute_planned_progress_all(recal_start_date, recal_end_date)
+                    st.success(
+                        "全ての製品に対する再計算が完了しました"
+                        f"（{report['products']}製品, 変更 {report['rows_changed']}行, {report['elapsed_ms']}ms）"
+                    )
         # ファイルアップロード
         uploaded_file = st.file_uploader(
             "CSVファイルを選択",
@@ -95,6 +101,18 @@ class CSVImportPage:
                     help="生産指示データから納入進度データも自動生成します（製品コードで統合）"
                 )
                 
+                force_import = st.checkbox(
+                    "変更がなくても全件取り込む",
+                    value=False,
+                    help="通常は取込済みと同じ内容のファイル・製品をスキップします"
+                )
+                
+                streaming_import = st.checkbox(
+                    "分割読み込み（大きなファイル向け）",
+                    value=uploaded_file.size > self.STREAMING_THRESHOLD_BYTES,
+                    help="ファイルを少しずつ読み込み、製品ごとに順次登録します（メモリ使用量を抑えます）"
+                )
+                
                 st.info("""
                 **📌 インポート処理の詳細:**
                 - 製品マスタ: 検査区分ごとに別製品として登録
@@ -112,17 +130,28 @@ class CSVImportPage:
                         with st.spinner("データをインポート中..."):
                             try:
                                 uploaded_file.seek(0)
+                                progress_bar = st.progress(0.0, text="読み込み中...")
+                                
+                                def report_progress(done_rows, total_rows, text):
+                                    ratio = min(done_rows / total_rows, 1.0) if total_rows else 1.0
+                                    progress_bar.progress(ratio, text=f"{done_rows:,} / {total_rows:,}行 - {text}")
                                 
-                                success, message = self.import_service.import_csv_data(
+                                success, message, stats = self.import_service.import_csv_data(
                                     uploaded_file,
-                                    create_progress=create_progress
+                                    create_progress=create_progress,
+                                    force=force_import,
+                                    streaming=streaming_import,
+                                    progress_callback=report_progress
                                 )
                                 
-                                if success:
+                                if success and stats.get('file_skipped'):
+                                    st.info(f"⏭️ {message}")
+                                    self._log_import_history(uploaded_file.name, message, stats)
+                                elif success:
                                     st.success(f"✅ {message}")
                                     st.balloons()
                                     
-                                    self._log_import_history(uploaded_file.name, message)
+                                    self._log_import_history(uploaded_file.name, message, stats)
                                     
                                     # 検査対象製品を表示
                                     self._show_inspection_products_after_import()
@@ -164,8 +193,11 @@ class CSVImportPage:
 
             with col_recalc_all:
                 if st.button("全製品を再計算", key="recalc_all_inspection"):
-                    self.service.recompute_planned_progress_all(recal_start_date, recal_end_date)
-                    st.success("全ての製品に対する再計算が完了しました")
+                    report = self.service.recompute_planned_progress_all(recal_start_date, recal_end_date)
+                    st.success(
+                        "全ての製品に対する再計算が完了しました"
+                        f"（{report['products']}製品, 変更 {report['rows_changed']}行, {report['elapsed_ms']}ms）"
+                    )
         
         try:
             # 日付範囲を調整（当日～1ヶ月後）
@@ -308,6 +340,16 @@ class CSVImportPage:
             if history:
                 history_df = pd.DataFrame(history)
                 
+                # 直近の取込のスキップ状況
+                latest = history[0]
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    st.metric("直近のステータス", latest['ステータス'] or '-')
+                with col2:
+                    st.metric("変更製品数", latest['変更製品数'] if latest['変更製品数'] is not None else '-')
+                with col3:
+                    st.metric("スキップ製品数", latest['スキップ製品数'] if latest['スキップ製品数'] is not None else '-')
+                
                 st.dataframe(
                     history_df,
                     use_container_width=True,
@@ -378,9 +420,9 @@ class CSVImportPage:
         - 検査区分F/$を含む製品は自動的にハイライトされます
         """)
     
-    def _log_import_history(self, filename: str, message: str):
+    def _log_import_history(self, filename: str, message: str, stats: dict = None):
         """インポート履歴を記録"""
         try:
-            self.import_service.log_import_history(filename, message)
+            self.import_service.log_import_history(filename, message, stats)
         except Exception as e:
             print(f"履歴記録エラー: {e}")
\ No newline at end of file
@@ -1,5 +1,6 @@
 # app/ui/pages/delivery_progress_page.py
 import streamlit as st
+import numpy as np
 import pandas as pd
 from datetime import date, timedelta, datetime
 from typing import Dict, Optional, Any
@@ -93,8 +94,11 @@ class DeliveryProgressPage:
 
                 with col_recalc_all:
                     if st.button("全製品を再計算"):
-                        self.service.recompute_planned_progress_all(recal_start_date, recal_end_date)
-                        st.success("全ての製品に対する再計算が完了しました")
+                        report = self.service.recompute_planned_progress_all(recal_start_date, recal_end_date)
+                        st.success(
+                            "全ての製品に対する再計算が完了しました"
+                            f"（{report['products']}製品, 変更 {report['rows_changed']}行, {report['elapsed_ms']}ms）"
+                        )
             
             # ▼ ここから追加：実績進度（shipped_remaining_quantity）の再計算
             with st.expander("実績進度の再計算（shipped_remaining_quantity）"):
@@ -398,93 +402,92 @@ class DeliveryProgressPage:
         except Exception as e:
             st.error(f"進度一覧エラー: {e}")
     
-    def _show_matrix_view(self, progress_df: pd.DataFrame):
-        """マトリックス表示（横軸=日付、縦軸=製品コード×状態）- 編集可能"""
-        
-        # 製品名マッピング作成
-        product_names = progress_df.groupby('product_code')['product_name'].first().to_dict()
-        
-        # 製品コード一覧を取得
+    # マトリックスの1製品分の行（状態ラベル, row_type）。ーーー は区切り行（値なし）
+    MATRIX_ROW_TYPES = (
+        ('受注数', 'order'),
+        ('納入計画数', 'planned'),
+        ('計画進度', 'planned_progress'),
+        ('納入実績', 'shipped'),
+        ('進度', 'progress'),
+        ('___', 'ーーー'),
+    )
+
+    @classmethod
+    def _build_progress_matrix(cls, progress_df: pd.DataFrame) -> Dict[str, Any]:
+        """
+        日付×製品マトリックスをピボットと累積和で一括作成
+
+        同じ製品・納期の行が複数ある場合、表示値は最初の行、更新先の order_mapping は最後の行
+        （従来の行ループ版と同じ）。計画進度=累計計画-累計受注、進度=累計出荷-累計受注。
+
+        Returns:
+            Dict: result_df, order_mapping, product_codes, dates, date_columns,
+                  planned / shipped（製品×日付の元の値）, has_order（製品×日付にデータがあるか）
+        """
         product_codes = sorted(progress_df['product_code'].unique())
-        
-        # 日付一覧を取得（文字列形式）
         dates = sorted(progress_df['delivery_date'].unique())
         date_columns = [d.strftime('%m月%d日') for d in dates]
+
+        # オーダーIDマッピング（更新用）{(product_code, date_str): order_id}
+        date_strs = pd.to_datetime(progress_df['delivery_date']).dt.strftime('%m月%d日')
+        order_mapping = dict(zip(zip(progress_df['product_code'], date_strs), progress_df['id']))
+
+        first_rows = progress_df.drop_duplicates(['product_code', 'delivery_date'], keep='first')
+
+        def grid(column):
+            if column not in first_rows.columns:
+                return np.zeros((len(product_codes), len(dates)), dtype=np.int64)
+            values = first_rows.assign(**{column: pd.to_numeric(first_rows[column], errors='coerce')}).pivot(
+                index='product_code', columns='delivery_date', values=column
+            ).reindex(index=product_codes, columns=dates)
+            return values.fillna(0).to_numpy(dtype=np.float64).astype(np.int64)
+
+        order = grid('order_quantity')
+        planned = grid('planned_quantity')
+        shipped = grid('shipped_quantity')
+        has_order = first_rows.assign(_exists=1).pivot(
+            index='product_code', columns='delivery_date', values='_exists'
+        ).reindex(index=product_codes, columns=dates).notna().to_numpy()
+
+        cumulative_order = order.cumsum(axis=1)
+        blocks = np.stack([
+            order,
+            planned,
+            planned.cumsum(axis=1) - cumulative_order,
+            shipped,
+            shipped.cumsum(axis=1) - cumulative_order,
+            np.full(order.shape, np.nan)
+        ], axis=1).astype(np.float64)
+        values = blocks.reshape(len(product_codes) * len(cls.MATRIX_ROW_TYPES), len(dates))
+
+        labels = [label for label, _ in cls.MATRIX_ROW_TYPES]
+        row_types = [row_type for _, row_type in cls.MATRIX_ROW_TYPES]
+        result_df = pd.DataFrame(values, columns=date_columns)
+        result_df.insert(0, '製品コード', [
+            product_code if i == 0 else '' for product_code in product_codes for i in range(len(labels))
+        ])
+        result_df.insert(1, '状態', labels * len(product_codes))
+        result_df.insert(2, 'row_type', row_types * len(product_codes))
+        return {
+            'result_df': result_df,
+            'order_mapping': order_mapping,
+            'product_codes': product_codes,
+            'dates': dates,
+            'date_columns': date_columns,
+            'planned': planned,
+            'shipped': shipped,
+            'has_order': has_order
+        }
+
+    def _show_matrix_view(self, progress_df: pd.DataFrame):
+        """マトリックス表示（横軸=日付、縦軸=製品コード×状態）- 編集可能"""
         
-        st.write(f"**製品数**: {len(product_codes)}")
-        st.write(f"**日付数**: {len(dates)}")
-        
-        # オーダーIDマッピング（更新用）
-        order_mapping = {}  # {(product_code, date_str): order_id}
-        for _, row in progress_df.iterrows():
-            key = (row['product_code'], row['delivery_date'].strftime('%m月%d日'))
-            order_mapping[key] = row['id']
-        
-        # 結果を格納するリスト
-        result_rows = []
-        
-        for product_code in product_codes:
-            product_data = progress_df[progress_df['product_code'] == product_code]
-            
-            # 各指標の行を作成
-            order_row = {'製品コード': product_code, '状態': '受注数', 'row_type': 'order'}
-            planned_row = {'製品コード': '', '状態': '納入計画数', 'row_type': 'planned'}
-            planned_progress_row = {'製品コード': '', '状態': '計画進度', 'row_type': 'planned_progress'}
-            shipped_row = {'製品コード': '', '状態': '納入実績', 'row_type': 'shipped'}
-            progress_row = {'製品コード': '', '状態': '進度', 'row_type': 'progress'}
-            keisen_row = {'製品コード': '', '状態': '___', 'row_type': 'ーーー'}
-            
-            cumulative_order = 0
-            cumulative_planned = 0
-            cumulative_shipped = 0
-            
-            for idx, (date_obj, date_str) in enumerate(zip(dates, date_columns)):
-                # その日のデータを取得
-                day_data = product_data[product_data['delivery_date'] == date_obj]
-                
-                if not day_data.empty:
-                    row = day_data.iloc[0]
-                    
-                    order_qty = int(row['order_quantity']) if pd.notna(row['order_quantity']) else 0
-                    
-                    # planned_quantity の安全な取得
-                    if 'planned_quantity' in day_data.columns and pd.notna(row['planned_quantity']):
-                        planned_qty = int(row['planned_quantity'])
-                    else:
-                        planned_qty = 0
-                    
-                    # shipped_quantity の安全な取得
-                    if 'shipped_quantity' in day_data.columns and pd.notna(row['shipped_quantity']):
-                        shipped_qty = int(row['shipped_quantity'])
-                    else:
-                        shipped_qty = 0
-                    
-                    cumulative_order += order_qty
-                    cumulative_planned += planned_qty
-                    cumulative_shipped += shipped_qty
-                    
-                    order_row[date_str] = order_qty
-                    planned_row[date_str] = planned_qty
-                    planned_progress_row[date_str] = cumulative_planned - cumulative_order
-                    shipped_row[date_str] = shipped_qty
-                else:
-                    order_row[date_str] = 0
-                    planned_row[date_str] = 0
-                    planned_progress_row[date_str] = cumulative_planned - cumulative_order
-                    shipped_row[date_str] = 0
-                
-                # 進度 = 累計出荷 - 累計受注
-                progress = cumulative_shipped - cumulative_order
-                progress_row[date_str] = int(progress)
-            
-            result_rows.extend([order_row, planned_row, planned_progress_row, shipped_row, progress_row, keisen_row])
-        
-        # DataFrameに変換
-        result_df = pd.DataFrame(result_rows)
+        matrix = self._build_progress_matrix(progress_df)
+        result_df = matrix['result_df']
+        date_columns = matrix['date_columns']
         
-        # カラムの順序を整理
-        columns = ['製品コード', '状態', 'row_type'] + date_columns
-        result_df = result_df[columns]
+        st.write(f"**製品数**: {len(matrix['product_codes'])}")
+        st.write(f"**日付数**: {len(matrix['dates'])}")
         
         st.write("---")
         st.write("**日付×製品マトリックス（受注・計画・実績・進度）**")
@@ -518,15 +521,7 @@ class DeliveryProgressPage:
         with col_save1:
             if st.button("💾 変更を保存", type="primary", use_container_width=True):
                 # 変更を検出して保存
-                changes_saved = self._save_matrix_changes(
-                    original_df=result_df,
-                    edited_df=edited_df,
-                    order_mapping=order_mapping,
-                    product_codes=product_codes,
-                    dates=dates,
-                    date_columns=date_columns,
-                    progress_df=progress_df
-                )
+                changes_saved = self._save_matrix_changes(matrix, edited_df)
                 
                 if changes_saved:
                     st.success("✅ 変更を保存しました")
@@ -553,96 +548,63 @@ class DeliveryProgressPage:
             3. 「💾 変更を保存」ボタンをクリック
             """)
 
-    def _save_matrix_changes(self, original_df, edited_df, order_mapping, 
-                            product_codes, dates, date_columns, progress_df):
-        """マトリックスの変更をデータベースに保存"""
+    def _save_matrix_changes(self, matrix: Dict[str, Any], edited_df: pd.DataFrame) -> bool:
+        """マトリックスの変更をデータベースに保存（納入計画数・納入実績の行を配列で比較）"""
         
         changes_made = False
-        
-        for product_code in product_codes:
-            for date_obj, date_str in zip(dates, date_columns):
-                # オーダーIDを取得
-                order_key = (product_code, date_str)
-                if order_key not in order_mapping:
-                    continue
-                
-                order_id = order_mapping[order_key]
-                
-                # 元データを取得
-                original_data = progress_df[
-                    (progress_df['product_code'] == product_code) & 
-                    (progress_df['delivery_date'] == date_obj)
-                ]
-                
-                if original_data.empty:
-                    continue
-                
-                # NaN対応
-                original_planned = int(original_data['planned_quantity'].iloc[0]) if pd.notna(original_data['planned_quantity'].iloc[0]) else 0
-                original_shipped = int(original_data['shipped_quantity'].iloc[0]) if pd.notna(original_data['shipped_quantity'].iloc[0]) else 0
-                
-                # 編集後のデータを取得
-                planned_rows = edited_df[
-                    (edited_df['row_type'] == 'planned') &
-                    ((edited_df['製品コード'] == product_code) | (edited_df['製品コード'] == ''))
-                ]
-                
-                shipped_rows = edited_df[
-                    (edited_df['row_type'] == 'shipped') &
-                    ((edited_df['製品コード'] == product_code) | (edited_df['製品コード'] == ''))
-                ]
-                
-                # 納入計画数の変更チェック
-                if not planned_rows.empty and date_str in planned_rows.columns:
-                    product_planned_rows = planned_rows[
-                        (planned_rows.index > edited_df[edited_df['製品コード'] == product_code].index.min()) &
-                        (planned_rows.index < edited_df[edited_df['製品コード'] == product_code].index.min() + 4)
-                    ]
-                    
-                    if not product_planned_rows.empty:
-                        new_planned = int(product_planned_rows.iloc[0][date_str]) if pd.notna(product_planned_rows.iloc[0][date_str]) else 0
-                        
-                        if new_planned != original_planned:
-                            update_data = {'planned_quantity': new_planned}
-                            success = self.service.update_delivery_progress(order_id, update_data)
-                            if success:
-                                changes_made = True
-                                print(f"✅ 計画数更新: order_id={order_id}, {original_planned} → {new_planned}")
+        date_columns = matrix['date_columns']
+        
+        def edited_values(row_type):
+            rows = edited_df.loc[edited_df['row_type'] == row_type, date_columns]
+            values = rows.apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float64)
+            return np.nan_to_num(values, nan=0).astype(np.int64)
+        
+        new_planned = edited_values('planned')
+        new_shipped = edited_values('shipped')
+        has_order = matrix['has_order']
+        planned_changed = (new_planned != matrix['planned']) & has_order
+        shipped_changed = (new_shipped != matrix['shipped']) & has_order
+        
+        # 製品→日付の順に、同じセルは計画数→実績の順で更新（従来と同じ順序）
+        for i, j in zip(*np.nonzero(planned_changed | shipped_changed)):
+            product_code = matrix['product_codes'][i]
+            date_obj = matrix['dates'][j]
+            order_id = matrix['order_mapping'].get((product_code, date_columns[j]))
+            if order_id is None:
+                continue
+            
+            if planned_changed[i, j]:
+                original_planned = int(matrix['planned'][i, j])
+                planned_value = int(new_planned[i, j])
+                success = self.service.update_delivery_progress(order_id, {'planned_quantity': planned_value})
+                if success:
+                    changes_made = True
+                    print(f"✅ 計画数更新: order_id={order_id}, {original_planned} → {planned_value}")
+            
+            if shipped_changed[i, j]:
+                original_shipped = int(matrix['shipped'][i, j])
+                shipped_value = int(new_shipped[i, j])
+                # 1. delivery_progress.shipped_quantity を直接更新
+                success = self.service.update_delivery_progress(order_id, {'shipped_quantity': shipped_value})
                 
-                # 納入実績の変更チェック
-                if not shipped_rows.empty and date_str in shipped_rows.columns:
-                    product_shipped_rows = shipped_rows[
-                        (shipped_rows.index > edited_df[edited_df['製品コード'] == product_code].index.min()) &
-                        (shipped_rows.index < edited_df[edited_df['製品コード'] == product_code].index.min() + 4)
-                    ]
-                    
-                    if not product_shipped_rows.empty:
-                        new_shipped = int(product_shipped_rows.iloc[0][date_str]) if pd.notna(product_shipped_rows.iloc[0][date_str]) else 0
-                        
-                        # ✅ 修正: 直接 delivery_progress を更新
-                        if new_shipped != original_shipped:
-                            # 1. delivery_progress.shipped_quantity を直接更新
-                            update_data = {'shipped_quantity': new_shipped}
-                            success = self.service.update_delivery_progress(order_id, update_data)
-                            
-                            if success:
-                                changes_made = True
-                                print(f"✅ 実績更新: order_id={order_id}, {original_shipped} → {new_shipped}")
-                                
-                                # 2. 差分があれば出荷実績レコードも作成（履歴として）
-                                diff = new_shipped - original_shipped
-                                if diff > 0:
-                                    shipment_data = {
-                                        'progress_id': order_id,
-                                        'truck_id': 1,
-                                        'shipment_date': date_obj,
-                                        'shipped_quantity': diff,
-                                        'driver_name': 'マトリックス入力',
-                                        'actual_departure_time': None,
-                                        'actual_arrival_time': None,
-                                        'notes': f'マトリックスから直接入力（累計: {new_shipped}）'
-                                    }
-                                    self.service.create_shipment_record(shipment_data)
+                if success:
+                    changes_made = True
+                    print(f"✅ 実績更新: order_id={order_id}, {original_shipped} → {shipped_value}")
+                    
+                    # 2. 差分があれば出荷実績レコードも作成（履歴として）
+                    diff = shipped_value - original_shipped
+                    if diff > 0:
+                        shipment_data = {
+                            'progress_id': order_id,
+                            'truck_id': 1,
+                            'shipment_date': date_obj,
+                            'shipped_quantity': diff,
+                            'driver_name': 'マトリックス入力',
+                            'actual_departure_time': None,
+                            'actual_arrival_time': None,
+                            'notes': f'マトリックスから直接入力（累計: {shipped_value}）'
+                        }
+                        self.service.create_shipment_record(shipment_data)
         
         return changes_made
 
@@ -659,11 +621,11 @@ class DeliveryProgressPage:
                 
                 # 製品選択
                 try:
-                    products = self.service.product_repo.get_all_products()
-                    if not products.empty:
+                    products = self.service.get_master_snapshot().product_by_id
+                    if products:
                         product_options = {
-                            f"{row['product_code']} - {row['product_name']}": row['id']
-                            for _, row in products.iterrows()
+                            f"{row['product_code']} - {row['product_name']}": product_id
+                            for product_id, row in products.items()
                         }
                         selected_product = st.selectbox("製品 *", options=list(product_options.keys()))
                         product_id = product_options[selected_product]
@@ -30,20 +30,19 @@ class ProductPage:
         
         try:
             products = self.production_service.get_all_products()
-            containers = self.transport_service.get_containers()
-            trucks_df = self.transport_service.get_trucks()
+            masters = self.transport_service.get_master_snapshot()
             
             if not products:
                 st.info("登録されている製品がありません")
                 return
             
             # 容器マップ作成
-            container_map = {c.id: c.name for c in containers} if containers else {}
-            container_name_to_id = {c.name: c.id for c in containers} if containers else {}
+            container_map = masters.container_name_by_id()
+            container_name_to_id = {name: container_id for container_id, name in container_map.items()}
             
             # トラックマップ作成
-            truck_map = dict(zip(trucks_df['id'], trucks_df['name'])) if not trucks_df.empty else {}
-            truck_name_to_id = dict(zip(trucks_df['name'], trucks_df['id'])) if not trucks_df.empty else {}
+            truck_map = masters.truck_name_by_id()
+            truck_name_to_id = {name: truck_id for truck_id, name in truck_map.items()}
             
             # DataFrame作成 - デフォルト値の設定を強化
             products_data = []
@@ -168,7 +167,9 @@ class ProductPage:
                 product = next((p for p in products if p.id == product_id), None)
                 
                 if product:
-                    self._show_product_detail_editor_with_truck_select(product, containers, trucks_df, container_map)
+                    self._show_product_detail_editor_with_truck_select(
+                        product, masters.containers, masters.trucks_df, container_map
+                    )
         
         except Exception as e:
             st.error(f"製品一覧エラー: {e}")
@@ -362,10 +363,9 @@ class ProductPage:
         if not truck_ids_str:
             return []
         try:
-            trucks_df = self.transport_service.get_trucks()
-            if trucks_df.empty:
+            truck_map = self.transport_service.get_master_snapshot().truck_name_by_id()
+            if not truck_map:
                 return []
-            truck_map = dict(zip(trucks_df['id'], trucks_df['name']))
             truck_ids = [int(tid.strip()) for tid in str(truck_ids_str).split(',')]
             return [truck_map.get(tid, f"ID:{tid}") for tid in truck_ids]
         except:
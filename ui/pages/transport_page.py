@@ -6,6 +6,8 @@ from typing import Dict
 from ui.components.forms import FormComponents
 from ui.components.tables import TableComponents
 from services.transport_service import TransportService
+from services.scenario_service import ScenarioService
+from domain.calculators.plan_frame import PlanFrame
 import io
 from reportlab.lib.pagesizes import A4, landscape
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
@@ -20,6 +22,7 @@ class TransportPage:
     
     def __init__(self, transport_service):
         self.service = transport_service
+        self.scenario_service = ScenarioService(transport_service)
         self.tables = TableComponents()
     
     def show(self):
@@ -27,13 +30,14 @@ class TransportPage:
         st.title("🚚 配送便計画")
         st.write("オーダー情報から自動的にトラック積載計画を作成します。")
         
-        tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs([
+        tab1, tab2, tab3, tab4, tab5, tab6, tab7 = st.tabs([
             "📦 積載計画作成",
             "📊 計画確認", 
             "🧰 容器管理", 
             "🚛 トラック管理",
             "🔬 検査対象製品",
-            "🧱 トラック×容器ルール"  
+            "🧱 トラック×容器ルール",
+            "🧪 シナリオ比較"
         ])
         
         with tab1:
@@ -48,24 +52,20 @@ class TransportPage:
             self._show_inspection_products()# ✅ 新しいメソッド
         with tab6:
             self._show_truck_container_rules()
+        with tab7:
+            self._show_scenario_comparison()
     
     def _show_truck_container_rules(self):
         """トラック×容器ルール管理（このページ内のタブ）"""
         st.header("🧱 トラック×容器ルール")
         try:
-            trucks_df = self.service.get_trucks()
-            if trucks_df is None or getattr(trucks_df, 'empty', False):
-                trucks_df = pd.DataFrame()
-            containers = self.service.get_containers() or []
-            rules = self.service.get_truck_container_rules() or []
+            masters = self.service.get_master_snapshot()
+            rules = masters.truck_container_rules
 
-            truck_id_to_name = {}
-            truck_name_to_id = {}
-            if trucks_df is not None and not trucks_df.empty:
-                truck_id_to_name = dict(zip(trucks_df['id'], trucks_df['name']))
-                truck_name_to_id = dict(zip(trucks_df['name'], trucks_df['id']))
-            container_id_to_name = {c.id: c.name for c in containers}
-            container_name_to_id = {c.name: c.id for c in containers}
+            truck_id_to_name = masters.truck_name_by_id()
+            truck_name_to_id = {name: truck_id for truck_id, name in truck_id_to_name.items()}
+            container_id_to_name = masters.container_name_by_id()
+            container_name_to_id = {name: container_id for container_id, name in container_id_to_name.items()}
 
             # 入力フォーム
             st.subheader("➕ ルール追加/更新")
@@ -377,19 +377,35 @@ class TransportPage:
    
         st.markdown("---")
         
+        enable_profile = st.checkbox(
+            "⏱️ 処理時間を計測する",
+            value=False,
+            help="計画作成の各ステップの処理時間・需要件数を記録して表示します"
+        )
+        
         if st.button("🔄 積載計画を作成", type="primary", use_container_width=True):
             with st.spinner("積載計画を計算中..."):
                 try:
+                    # 以降の納入進度の変更だけを差分再計算の対象にする
+                    progress_cursor = self.service.progress_change_cursor()
+                    input_versions = self.service.planning_input_versions()
                     result = self.service.calculate_loading_plan_from_orders(
                         start_date=start_date,
-                        days=days
+                        days=days,
+                        profile=enable_profile
                     )
                     
                     st.session_state['loading_plan'] = result
+                    st.session_state['loading_plan_period'] = (start_date, days)
+                    st.session_state['loading_plan_progress_cursor'] = progress_cursor
+                    st.session_state['loading_plan_input_versions'] = input_versions
                     
                     summary = result['summary']
                     
-                    st.success("✅ 積載計画を作成しました")
+                    if result.get('from_cache'):
+                        st.success("✅ 積載計画を作成しました（入力データに変更がないため前回の計算結果を使用）")
+                    else:
+                        st.success("✅ 積載計画を作成しました")
                     
                     col_a, col_b, col_c, col_d = st.columns(4)
                     with col_a:
@@ -435,10 +451,15 @@ class TransportPage:
                     
                 except Exception as e:
                     st.error(f"積載計画作成エラー: {e}")
+        
+        self._show_incremental_replan()
                     
         if 'loading_plan' in st.session_state:
             result = st.session_state['loading_plan']
             
+            if result.get('profile'):
+                self._show_plan_profile(result['profile'])
+            
             st.markdown("---")
             st.subheader("💾 計画の保存とエクスポート")
             
@@ -454,9 +475,15 @@ class TransportPage:
                 
                 if st.button("💾 DBに保存", type="primary"):
                     try:
-                        plan_id = self.service.save_loading_plan(result, plan_name)
+                        plan_id, report = self.service.save_loading_plan_with_report(result, plan_name)
                         st.success(f"✅ 計画を保存しました (ID: {plan_id})")
                         st.session_state['saved_plan_id'] = plan_id
+                        if report:
+                            st.caption(
+                                f"明細 {report['detail_rows']}件 / 警告 {report['warning_rows']}件 / "
+                                f"積載不可 {report['unloaded_rows']}件 / 進度 更新 {report['progress_updated']}件・"
+                                f"新規 {report['progress_inserted']}件（{report['timings']['total_ms']}ms）"
+                            )
                     except Exception as e:
                         st.error(f"保存エラー: {e}")
             
@@ -504,6 +531,189 @@ class TransportPage:
                     except Exception as e:
                         st.error(f"CSV出力エラー: {e}")
     
+    def _show_incremental_replan(self):
+        """
+        作成済みの計画に、その後の受注・納入進度の変更だけを反映する
+
+        変わった製品は差分再計算側で前回の受注と比べて求めるため、CSV取込・計画保存など
+        納入進度画面以外の書き込みも対象になる（ここでは変更の有無を表示するだけ）。
+        """
+        if 'loading_plan' not in st.session_state or 'loading_plan_progress_cursor' not in st.session_state:
+            return
+        cursor = st.session_state['loading_plan_progress_cursor']
+        pending, latest = self.service.changed_progress_keys_since(cursor)
+        input_versions = self.service.planning_input_versions()
+        inputs_changed = input_versions != st.session_state.get('loading_plan_input_versions')
+        if not pending and not inputs_changed:
+            return
+        plan_start, plan_days = st.session_state['loading_plan_period']
+        if pending:
+            st.info(f"ℹ️ 計画作成後に納入進度が {len(pending)} 件（製品×納期）変更されています")
+        else:
+            st.info("ℹ️ 計画作成後に受注・納入進度・マスタが更新されています")
+        if st.button("♻️ 変更分だけ再計算", use_container_width=True):
+            with st.spinner("変更分を再計算中..."):
+                try:
+                    result = self.service.replan_loading_plan(
+                        st.session_state['loading_plan'], pending or None, plan_start, plan_days
+                    )
+                except Exception as e:
+                    st.error(f"差分再計算エラー: {e}")
+                    return
+                st.session_state['loading_plan'] = result
+                st.session_state['loading_plan_progress_cursor'] = latest
+                st.session_state['loading_plan_input_versions'] = input_versions
+                report = result.get('replan_report') or {}
+                if report.get('mode') == 'incremental':
+                    st.success(
+                        f"✅ 差分再計算しました（製品 {report['products']}件・トラック {report['trucks']}台・"
+                        f"影響日 {len(report['days'])}日、{report['elapsed_ms']:.0f} ms）"
+                    )
+                    st.caption("日ごとのトラックの並びは全体計算と異なることがあります（保存・出力前に揃える場合は「積載計画を作成」）")
+                elif report.get('mode') == 'unchanged':
+                    st.info(f"ℹ️ {report.get('reason', '')}")
+                else:
+                    st.success(f"✅ 全体を再計算しました（{report.get('reason', '')}）")
+
+    def _show_plan_profile(self, profile: Dict):
+        """計画作成のステップ別処理時間を表示"""
+        with st.expander(f"⏱️ 処理時間プロファイル（合計 {profile.get('total_ms', 0):,.0f} ms）", expanded=False):
+            steps = profile.get('steps', [])
+            if not steps:
+                st.info("計測データがありません")
+                return
+            
+            profile_df = pd.DataFrame([{
+                'ステップ': step['label'],
+                '処理時間(ms)': step['duration_ms'],
+                '需要(入力)': step.get('demands_in'),
+                '需要(出力)': step.get('demands_out'),
+                'トラック増減': step.get('trucks_delta'),
+                '積載明細増減': step.get('loaded_items_delta'),
+                '積み残し増減': step.get('remaining_delta'),
+            } for step in steps])
+            
+            st.dataframe(profile_df, use_container_width=True, hide_index=True)
+            st.bar_chart(profile_df.set_index('ステップ')['処理時間(ms)'])
+            
+            slowest = max(steps, key=lambda s: s['duration_ms'])
+            st.caption(f"最も時間がかかったステップ: {slowest['label']} ({slowest['duration_ms']:,.1f} ms)")
+    
+    def _show_scenario_comparison(self):
+        """what-if シナリオの一括比較"""
+        st.header("🧪 what-if シナリオ比較")
+        st.info("""
+        **機能説明:**
+        - トラック追加・前倒し可否・休日などを変えた計画をまとめて計算し、便数・積載率・警告・積み残しを比較します
+        - 受注・マスタ・カレンダーは一度だけ読み込み、各シナリオは別プロセスで並列に計算します
+        - DBの内容は変更しません
+        """)
+
+        col1, col2 = st.columns(2)
+        with col1:
+            start_date = st.date_input("計画開始日", value=date.today(), key="what_if_start")
+        with col2:
+            end_date = st.date_input("計画終了日", value=date.today() + timedelta(days=10),
+                                     min_value=start_date, key="what_if_end")
+        days = (end_date - start_date).days + 1
+
+        scenarios = st.session_state.setdefault('what_if_scenarios', [])
+
+        with st.expander("➕ シナリオを追加", expanded=not scenarios):
+            trucks_df = self.service.get_trucks()
+            truck_options = {}
+            if not trucks_df.empty:
+                truck_options = {f"{row['id']}: {row['name']}": int(row['id']) for _, row in trucks_df.iterrows()}
+            with st.form("what_if_form", clear_on_submit=True):
+                name = st.text_input("シナリオ名", placeholder="例: 4台目のデフォルト便")
+                copy_truck = st.selectbox("デフォルト便を追加（複製元トラック）",
+                                          ["（追加しない）"] + list(truck_options))
+                default_trucks = st.multiselect("デフォルト便にするトラック", list(truck_options))
+                advance_codes = st.text_input("前倒し可にする製品コード（カンマ区切り）")
+                holidays = st.text_input("休日にする日（YYYY-MM-DD、カンマ区切り）")
+                submitted = st.form_submit_button("追加")
+
+            if submitted:
+                scenario = {'name': name.strip() or f"シナリオ{len(scenarios) + 1}"}
+                if copy_truck in truck_options:
+                    scenario['add_trucks'] = [{
+                        'copy_of': truck_options[copy_truck],
+                        'name': f"追加便({copy_truck.split(': ', 1)[-1]})",
+                        'default_use': 1
+                    }]
+                if default_trucks:
+                    scenario['truck_updates'] = {truck_options[label]: {'default_use': 1} for label in default_trucks}
+                codes = [code.strip() for code in advance_codes.split(',') if code.strip()]
+                if codes:
+                    scenario['product_updates'] = {code: {'can_advance': 1} for code in codes}
+                holiday_list = [value.strip() for value in holidays.split(',') if value.strip()]
+                if holiday_list:
+                    scenario['holidays'] = holiday_list
+                scenarios.append(scenario)
+                st.success(f"✅ シナリオ「{scenario['name']}」を追加しました")
+
+        if scenarios:
+            st.dataframe(pd.DataFrame([{
+                'シナリオ': scenario['name'],
+                '内容': self._describe_scenario(scenario)
+            } for scenario in scenarios]), use_container_width=True, hide_index=True)
+
+            col_run, col_reload, col_clear = st.columns(3)
+            with col_run:
+                run_clicked = st.button("▶️ 一括実行", type="primary", use_container_width=True)
+            with col_reload:
+                if st.button("🔄 入力を再読み込み", use_container_width=True):
+                    st.session_state.pop('what_if_snapshot', None)
+                    st.success("次回の実行時にDBから読み込み直します")
+            with col_clear:
+                if st.button("🗑️ シナリオをクリア", use_container_width=True):
+                    st.session_state['what_if_scenarios'] = []
+                    st.session_state.pop('what_if_report', None)
+                    st.rerun()
+
+            if run_clicked:
+                with st.spinner(f"{len(scenarios) + 1}件のシナリオを計算中..."):
+                    try:
+                        snapshot = self._get_scenario_snapshot(start_date, days)
+                        report = self.scenario_service.run_scenarios(
+                            snapshot, [dict(scenario) for scenario in scenarios]
+                        )
+                        st.session_state['what_if_report'] = report['table']
+                    except Exception as e:
+                        st.error(f"シナリオ実行エラー: {e}")
+
+        table = st.session_state.get('what_if_report')
+        if table is not None and not table.empty:
+            st.subheader("📊 比較結果")
+            st.dataframe(table, use_container_width=True, hide_index=True)
+            errors = table[table['エラー'] != ''] if 'エラー' in table.columns else pd.DataFrame()
+            for _, row in errors.iterrows():
+                st.warning(f"⚠️ {row['シナリオ']}: {row['エラー']}")
+
+    def _get_scenario_snapshot(self, start_date: date, days: int):
+        """シナリオ比較の入力スナップショット（同じ期間なら再読み込みしない）"""
+        key = (start_date, days)
+        cached = st.session_state.get('what_if_snapshot')
+        if cached and cached['key'] == key:
+            return cached['snapshot']
+        snapshot = self.scenario_service.load_snapshot(start_date, days)
+        st.session_state['what_if_snapshot'] = {'key': key, 'snapshot': snapshot}
+        return snapshot
+
+    @staticmethod
+    def _describe_scenario(scenario: Dict) -> str:
+        """シナリオの上書き内容を1行で表示"""
+        parts = []
+        for truck in scenario.get('add_trucks') or []:
+            parts.append(f"トラック追加（ID{truck.get('copy_of')}を複製）")
+        if scenario.get('truck_updates'):
+            parts.append(f"デフォルト便化: {', '.join(str(tid) for tid in scenario['truck_updates'])}")
+        if scenario.get('product_updates'):
+            parts.append(f"前倒し可: {', '.join(scenario['product_updates'])}")
+        if scenario.get('holidays'):
+            parts.append(f"休日: {', '.join(str(d) for d in scenario['holidays'])}")
+        return ' / '.join(parts) or '変更なし'
+    
     def _show_plan_view(self):
         """計画確認"""
         st.header("📊 積載計画確認")
@@ -546,7 +756,7 @@ class TransportPage:
         if view_type == '日別表示':
             self._show_daily_view(daily_plans)
         else:
-            self._show_list_view(daily_plans)
+            self._show_list_view(result)
      
     def _show_saved_plans(self):
         """保存済み計画表示"""
@@ -798,14 +1008,14 @@ class TransportPage:
             if not edited_df.equals(plan_df):
                 # 必要な情報を取得
                 try:
-                    products_df = self.service.product_repo.get_all_products()
-                    capacity_map = dict(zip(products_df['product_code'], products_df['capacity']))
-                    containers = self.service.get_containers()
-                    container_map = {container.id: container for container in containers}
-                    trucks_df = self.service.get_trucks()
-                    truck_map = {truck['id']: truck for _, truck in trucks_df.iterrows()}
+                    masters = self.service.get_master_snapshot()
+                    product_by_code = masters.product_by_code
+                    capacity_map = {code: product.get('capacity') for code, product in product_by_code.items()}
+                    container_map = masters.container_by_id
+                    truck_map = masters.truck_by_id
                 except Exception as e:
                     st.warning(f"情報取得エラー: {e}")
+                    product_by_code = {}
                     capacity_map = {}
                     container_map = {}
                     truck_map = {}
@@ -851,9 +1061,9 @@ class TransportPage:
                             
                             # 製品の容器情報を取得
                             product_code = row['製品コード']
-                            product_info = products_df[products_df['product_code'] == product_code]
-                            if not product_info.empty:
-                                container_id = product_info.iloc[0]['used_container_id']
+                            product_info = product_by_code.get(str(product_code))
+                            if product_info is not None:
+                                container_id = product_info.get('used_container_id')
                                 if container_id and container_id in container_map:
                                     container = container_map[container_id]
                                     # 容器の体積と重量を計算
@@ -1047,34 +1257,16 @@ class TransportPage:
                 header = ['積載日', 'トラック', '製品コード', '製品名', '容器数', '合計数量', '納期']
                 all_plan_data.append(header)
                 
-                for date_str in sorted(daily_plans.keys()):
-                    day_plan = daily_plans[date_str]
-                    
-                    for truck in day_plan.get('trucks', []):
-                        truck_name = truck.get('truck_name', '不明')
-                        
-                        for item in truck.get('loaded_items', []):
-                            # 納期のフォーマット処理
-                            delivery_date = item.get('delivery_date')
-                            delivery_date_str = ''
-                            if delivery_date:
-                                if hasattr(delivery_date, 'strftime'):
-                                    delivery_date_str = delivery_date.strftime('%Y-%m-%d')
-                                elif hasattr(delivery_date, 'date'):
-                                    delivery_date_str = delivery_date.date().strftime('%Y-%m-%d')
-                                else:
-                                    delivery_date_str = str(delivery_date)
-                            
-                            row = [
-                                date_str,
-                                truck_name,
-                                item.get('product_code', ''),
-                                item.get('product_name', ''),
-                                str(item.get('num_containers', 0)),
-                                str(item.get('total_quantity', 0)),
-                                delivery_date_str
-                            ]
-                            all_plan_data.append(row)
+                items = PlanFrame.of(plan_data).items
+                all_plan_data.extend(pd.DataFrame({
+                    'loading_date': items['loading_date'],
+                    'truck_name': items['truck_name'].fillna('不明'),
+                    'product_code': items['product_code'],
+                    'product_name': items['product_name'],
+                    'num_containers': items['num_containers'].astype(str),
+                    'total_quantity': items['total_quantity'].astype(str),
+                    'delivery_date': items['delivery_date_str']
+                }).values.tolist())
                 
                 # テーブル作成
                 if len(all_plan_data) > 1:  # ヘッダー以外にデータがある場合
@@ -1332,46 +1524,25 @@ class TransportPage:
                     
                     st.markdown("---")
     
-    def _show_list_view(self, daily_plans):
+    def _show_list_view(self, plan_result):
         """一覧表示"""
         
-        all_items = []
+        items = PlanFrame.of(plan_result).items
         
-        for date_str in sorted(daily_plans.keys()):
-            plan = daily_plans[date_str]
-            
-            trucks = plan.get('trucks', [])
-            
-            for truck_plan in trucks:
-                loaded_items = truck_plan.get('loaded_items', [])
-                truck_name = truck_plan.get('truck_name', 'トラック名不明')
-                utilization = truck_plan.get('utilization', {})
-                
-                for item in loaded_items:
-                    delivery_date = item.get('delivery_date')
-                    if delivery_date:
-                        if hasattr(delivery_date, 'strftime'):
-                            delivery_date_str = delivery_date.strftime('%Y-%m-%d')
-                        else:
-                            delivery_date_str = str(delivery_date)
-                    else:
-                        delivery_date_str = '-'
-                    
-                    all_items.append({
-                        '積載日': date_str,
-                        'トラック': truck_name,
-                        '製品コード': item.get('product_code', ''),
-                        '製品名': item.get('product_name', ''),
-                        '容器数': item.get('num_containers', 0),
-                        '合計数量': item.get('total_quantity', 0),
-                        '納期': delivery_date_str,
-                        '体積率': f"{utilization.get('volume_rate', 0)}%",
-                        '重量率': f"{utilization.get('weight_rate', 0)}%"
-                    })
-        
-        if all_items:
-            df = pd.DataFrame(all_items)
+        if not items.empty:
+            df = pd.DataFrame({
+                '積載日': items['loading_date'],
+                'トラック': items['truck_name'].fillna('トラック名不明'),
+                '製品コード': items['product_code'],
+                '製品名': items['product_name'],
+                '容器数': items['num_containers'],
+                '合計数量': items['total_quantity'],
+                '納期': items['delivery_date_str'].replace('', '-'),
+                '体積率': items['volume_rate'].astype(str) + '%',
+                '重量率': items['weight_rate'].astype(str) + '%'
+            })
             st.dataframe(df, width='stretch')
+        else:
             st.info("表示するデータがありません")
 
     def _show_container_management(self):
@@ -1582,8 +1753,10 @@ class TransportPage:
             
             # 必要な情報を取得
             try:
-                products_df = self.service.product_repo.get_all_products()
-                capacity_map = dict(zip(products_df['product_code'], products_df['capacity']))
+                capacity_map = {
+                    code: product.get('capacity')
+                    for code, product in self.service.get_master_snapshot().product_by_code.items()
+                }
             except:
                 capacity_map = {}
                 st.warning("製品容量情報の取得に失敗しました")